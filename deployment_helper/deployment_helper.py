@@ -1,14 +1,24 @@
 import argparse
+import calendar
+import contextlib
+import cProfile
+import heapq
 import json
+import math
 import os
+import pstats
 import random
+import re
 import readline
 import socket
 import subprocess
 import sys
+import tarfile
+import tempfile
 import time
 import types
 import urllib2
+from multiprocessing.pool import ThreadPool
 
 args = None
 
@@ -19,6 +29,8 @@ VTTOP = None
 VT_MYSQL_ROOT = '/usr'
 DEPLOYMENT_DIR = None
 CELL = None
+# Cells config, see Cells. Its first cell is CELL.
+CELLS = None
 KEYSPACE = None
 DEPLOYMENT_HELPER_DIR = os.path.abspath(os.path.dirname(__file__))
 MYSQL_AUTH_PARAM = None
@@ -110,14 +122,102 @@ def read_list(prompt, default=[]):
         lst = default
     return lst
 
-def set_cell_and_keyspace(default_cell, default_keyspace=''):
-    global CELL, KEYSPACE
-    CELL = os.environ.get('CELL') or read_value('Enter CELL name:', default_cell)
-    if '-' in CELL:
+def check_cell_name(cell):
+    if '-' in cell:
         print("Error: CELL must not contain a '-' character")
         sys.exit(1)
+
+def set_cell_and_keyspace(default_cell, default_keyspace='', extra_cells=None):
+    global CELL, CELLS, KEYSPACE
+    CELL = os.environ.get('CELL') or read_value('Enter CELL name:', default_cell)
+    check_cell_name(CELL)
+    CELLS = Cells(CELL, extra_cells)
     KEYSPACE = read_value('Enter KEYSPACE name:', default_keyspace)
 
+class Profiler(object):
+    """Records wall time of named phases for --profile.
+
+    Phases nest, each one is recorded with its start offset, duration and
+    attributes (component, host, ...). Remote script runs are read back from
+    the timing file run_script_on_host.sh appends to.
+    """
+    TIMING_FILE_ENV = 'DEPLOYMENT_HELPER_TIMING_FILE'
+
+    def __init__(self):
+        self.start_time = time.time()
+        self.events = []
+        self.stack = []
+        fd, self.timing_file = tempfile.mkstemp(prefix='deployment_helper_timing_')
+        os.close(fd)
+        os.environ[self.TIMING_FILE_ENV] = self.timing_file
+
+    @contextlib.contextmanager
+    def phase(self, name, **attrs):
+        start = time.time()
+        self.stack.append(name)
+        try:
+            yield
+        finally:
+            self.stack.pop()
+            self.add(name, start, time.time(), depth=len(self.stack), **attrs)
+
+    def add(self, name, start, end, **attrs):
+        event = dict(name=name, start=start - self.start_time, duration=end - start)
+        event.update(attrs)
+        self.events.append(event)
+
+    def read_remote_timings(self):
+        """Adds one "remote" event per line of host, script, start, end, exit code."""
+        def seconds(value):
+            # date +%s.%N prints a literal N where %N is not supported.
+            return float(value.rstrip('N').rstrip('.'))
+        with open(self.timing_file) as fh:
+            for line in fh:
+                fields = line.rstrip('\n').split('\t')
+                if len(fields) != 5:
+                    continue
+                host, script, start, end, exit_code = fields
+                component = os.path.basename(script).split('-')[0]
+                self.add('remote:%s' % component, seconds(start), seconds(end),
+                         host=host, script=script, exit_code=int(exit_code))
+        os.unlink(self.timing_file)
+
+    def print_summary(self):
+        totals = {}
+        for event in self.events:
+            name = event['name']
+            if event.get('host'):
+                name = '%s@%s' % (name, event['host'])
+            total, count, longest = totals.get(name, (0.0, 0, 0.0))
+            totals[name] = (total + event['duration'], count + 1, max(longest, event['duration']))
+        print
+        print 'Profile (wall time, nested phases are included in their parents):'
+        print '%-60s %10s %8s %10s' % ('phase', 'total(s)', 'count', 'max(s)')
+        for name, (total, count, longest) in sorted(totals.iteritems(), key=lambda kv: -kv[1][0]):
+            print '%-60s %10.3f %8d %10.3f' % (name, total, count, longest)
+
+    def write_trace(self, path):
+        """Writes the events in Chrome trace event format (chrome://tracing)."""
+        trace = []
+        for event in self.events:
+            attrs = dict((k, v) for k, v in event.iteritems() if k not in ('name', 'start', 'duration'))
+            trace.append(dict(name=event['name'], ph='X', pid=1, tid=event.get('host', 'local'),
+                              ts=int(event['start'] * 1e6), dur=int(event['duration'] * 1e6), args=attrs))
+        with open(path, 'w') as fh:
+            json.dump(dict(traceEvents=trace), fh, indent=1)
+        print 'Profile trace written to: %s' % path
+
+profiler = None
+
+@contextlib.contextmanager
+def no_profile():
+    yield
+
+def profile_phase(name, **attrs):
+    if profiler is None:
+        return no_profile()
+    return profiler.phase(name, **attrs)
+
 base_ports = {
     'zk2': dict(leader_port=28881, election_port=38881, client_port=21811),
     'etcd': 2379,
@@ -133,7 +233,7 @@ class ConfigType(object):
     Written to a config file.
     Is prompted for and read from user input.
     """
-    ConfigTypes = [types.DictType, types.StringType, types.ListType, types.IntType]
+    ConfigTypes = [types.DictType, types.StringType, types.ListType, types.IntType, types.FloatType]
 
     def get_config_file(self):
         config_dir = os.path.join(DEPLOYMENT_DIR, 'config')
@@ -260,12 +360,13 @@ you can specify a file (one host per line) as "file:/path/to/file"."""
         fname = self.instance_filename(i, ftype)
         content = self.instance_content(i, ftype)
         fpath = os.path.join(DEPLOYMENT_DIR, 'bin', host, fname)
-        fdir = os.path.dirname(fpath)
-        if not os.path.exists(fdir):
-            os.makedirs(fdir)
-        with open(fpath, 'w') as fh:
-            fh.write(content)
-        os.chmod(fpath, 0755)
+        with profile_phase('write_file', component=self.short_name):
+            fdir = os.path.dirname(fpath)
+            if not os.path.exists(fdir):
+                os.makedirs(fdir)
+            with open(fpath, 'w') as fh:
+                fh.write(content)
+            os.chmod(fpath, 0755)
         return fpath
 
     def generate(self):
@@ -315,19 +416,69 @@ you can specify a file (one host per line) as "file:/path/to/file"."""
             subprocess.call(['bash', stop_command])
 
     def run_action(self, action):
-        if action == 'generate':
-            self.generate()
-        elif action == 'start':
-            self.start()
-        elif action == 'stop':
-            self.stop()
-        else:
-            print 'ERRROR: action "%s" is not defined in %s' % (action, self)
-            sys.exit(1)
+        with profile_phase('%s:%s' % (action, self.short_name), component=self.short_name):
+            if action == 'generate':
+                self.generate()
+            elif action == 'start':
+                self.start()
+            elif action == 'stop':
+                self.stop()
+            else:
+                print 'ERRROR: action "%s" is not defined in %s' % (action, self)
+                sys.exit(1)
 
 class Deployment(object):
     pass
 
+class Cells(ConfigType):
+    """The cells of the deployment, the home cell CELL first, and the cell of each host.
+
+    Every cell gets its own topo root, tablets and vtgates. Masters stay in
+    the home cell, the other cells hold replicas their local vtgates serve
+    reads from. Extra cells come from vtctld, $EXTRA_CELLS or a prompt the
+    first time, the home cell among them is skipped. Hosts are asked for
+    once and default to the cells round robin.
+    """
+    short_name = 'cells'
+
+    def __init__(self, home_cell, extra_cells=None):
+        self.cells = [home_cell]
+        self.host_cells = {}
+        config_file = self.get_config_file()
+        config = {}
+        if os.path.exists(config_file):
+            with open(config_file) as fh:
+                config = json.load(fh)
+            # The cells of the hosts are kept even when vtctld names the cells.
+            self.host_cells = config.get('host_cells', {})
+        if extra_cells is None and config:
+            extra_cells = config.get('cells', [])
+        elif extra_cells is None:
+            extra_cells = os.environ.get('EXTRA_CELLS')
+            if extra_cells is None:
+                extra_cells = read_value('Enter additional cells separated by commas, none for a single cell:', '')
+            extra_cells = [c.strip() for c in extra_cells.split(',') if c.strip()]
+        for cell in extra_cells:
+            check_cell_name(cell)
+            if cell not in self.cells:
+                self.cells.append(cell)
+        self.write_config()
+
+    def cell_of(self, host):
+        if len(self.cells) == 1:
+            return self.cells[0]
+        if self.host_cells.get(host) not in self.cells:
+            default = self.cells[len(self.host_cells) % len(self.cells)]
+            cell = None
+            while cell not in self.cells:
+                cell = read_value('Enter the cell of host "%s" %s:' % (host, self.cells), default)
+            self.host_cells[host] = cell
+            self.write_config()
+        return self.host_cells[host]
+
+    def hosts_in(self, cell, hosts):
+        return [h for h in hosts if self.cell_of(h) == cell]
+
 class LockServer(HostClass):
     short_name = 'lockserver'
     def __init__(self):
@@ -347,7 +498,7 @@ class LockServer(HostClass):
         cmd = ['$VTROOT/bin/vtctlclient', '-server', vtctld_endpoint, 'GetCellInfoNames']
         cells = [ c for c in subprocess.check_output(cmd).split('\n') if c]
         print 'Found cells: %s' % cells
-        set_cell_and_keyspace(cells[0])
+        set_cell_and_keyspace(cells[0], extra_cells=cells)
         cmd = ['$VTROOT/bin/vtctlclient', '-server', vtctld_endpoint, 'GetCellInfo', CELL]
         cell_info = json.loads(subprocess.check_output(cmd))
         self.set_topology_from_vtctld(cell_info)
@@ -394,7 +545,7 @@ class Zk2(HostClass):
     name = 'Zookeeper (zk2)'
     short_name = 'zk2'
     description = 'Zookeeper is a popular open source lock server written in Java'
-    hardware_recommendation = 'We recommend a host with x cpus and y memory for each Zookeeper instance'
+    hardware_recommendation = 'We recommend a host with 2 cpus and 4 GB memory for each Zookeeper instance, ideally with its own disk.'
     host_number_calculation = """A LockServer needs odd number of instances to establish quorum, we recommend at least 3
 on 3 different hosts. If you are running the local cluster demo, you can run all three on one host."""
 
@@ -512,20 +663,22 @@ CELL="%(cell)s"
                'touch','-p','/vitess/global']
 
         out.append(' '.join(cmd))
-        cmd = [os.path.join(VTROOT, 'bin/zk'),
-               '-server', '${ZK_SERVER}',
-               'touch','-p','/vitess/${CELL}']
-        out.append(' '.join(cmd))
+        for cell in CELLS.cells:
+            cmd = [os.path.join(VTROOT, 'bin/zk'),
+                   '-server', '${ZK_SERVER}',
+                   'touch','-p','/vitess/%s' % cell]
+            out.append(' '.join(cmd))
 
-        out.append('')
-        out.append('# Initialize cell.')
-        cmd = [os.path.join(VTROOT, 'bin/vtctl'),
-               '${TOPOLOGY_FLAGS}',
-               'AddCellInfo',
-               '-root /vitess/${CELL}',
-               '-server_address', '${ZK_SERVER}',
-               '${CELL}']
-        out.append(' '.join(cmd))
+        for cell in CELLS.cells:
+            out.append('')
+            out.append('# Initialize cell %s.' % cell)
+            cmd = [os.path.join(VTROOT, 'bin/vtctl'),
+                   '${TOPOLOGY_FLAGS}',
+                   'AddCellInfo',
+                   '-root /vitess/%s' % cell,
+                   '-server_address', '${ZK_SERVER}',
+                   cell]
+            out.append(' '.join(cmd))
         out.append('')
         rv = '\n'.join(out)
         return rv
@@ -535,13 +688,14 @@ def write_bin_file(fname, out):
 
 def write_dep_file(subdir, fname, out):
     fpath = os.path.join(DEPLOYMENT_DIR, subdir, fname)
-    dirpath = os.path.dirname(fpath)
-    if not os.path.isdir(dirpath):
-        os.makedirs(dirpath)
-    with open(fpath, 'w') as fh:
-        fh.write(out)
-    if subdir == 'bin':
-        os.chmod(os.path.join(fpath), 0755)
+    with profile_phase('write_file'):
+        dirpath = os.path.dirname(fpath)
+        if not os.path.isdir(dirpath):
+            os.makedirs(dirpath)
+        with open(fpath, 'w') as fh:
+            fh.write(out)
+        if subdir == 'bin':
+            os.chmod(os.path.join(fpath), 0755)
     return fpath
 
 class VtCtld(HostClass):
@@ -549,7 +703,7 @@ class VtCtld(HostClass):
 
     description = """The vtctld server provides a web interface that displays all of the coordination information stored in ZooKeeper.
 The vtctld server also accepts commands from the vtctlclient tool, which is used to administer the cluster."""
-    hardware_recommendation = 'We recommend a host with x cpus and y memory for the vtctld instance.'
+    hardware_recommendation = 'We recommend a host with 2 cpus and 2 GB memory for the vtctld instance.'
     host_number_calculation = 'You typically need only 1 vtctld instance in a cluster.'
     up_filename = 'vtctld-up.sh'
     down_filename = 'vtctld-down.sh'
@@ -626,6 +780,159 @@ MYSQL_AUTH_PARAM="%(mysql_auth_param)s"
 BACKUP_DIR="%(backup_dir)s"
 """ % locals()
 
+# Port the tablets register with Orchestrator on, see -orc_api_url.
+ORC_HTTP_PORT = 30000
+
+# MySQL user Orchestrator checks replication with, created by init_db.sql.
+ORC_MYSQL_USER = 'orc_client_user'
+ORC_MYSQL_PASSWORD = 'orc_client_user_password'
+
+def orchestrator_endpoint(default_host):
+    """Returns the host and port of Orchestrator, the vtctld host if it is not configured."""
+    config_file = os.path.join(DEPLOYMENT_DIR, 'config', 'orchestrator.json')
+    if os.path.exists(config_file):
+        with open(config_file) as fh:
+            config = json.load(fh)
+        if config.get('configured_hosts'):
+            return config['configured_hosts'][0], config.get('http_port', ORC_HTTP_PORT)
+    return default_host, ORC_HTTP_PORT
+
+class Orchestrator(HostClass):
+    name = 'Orchestrator'
+
+    description = """Orchestrator (https://github.com/github/orchestrator) watches the replication topology of every shard.
+When a master dies it promotes a replica, then its recovery hook tells vtctld with TabletExternallyReparented."""
+    hardware_recommendation = 'We recommend a host with 2 cpus and 2 GB memory for the orchestrator instance.'
+    host_number_calculation = 'One orchestrator with its SQLite backend is enough, only the first host is used.'
+    up_filename = 'orchestrator-up.sh'
+    down_filename = 'orchestrator-down.sh'
+    up_instance_template = 'orchestrator-up-instance.sh'
+    down_instance_template = 'orchestrator-down-instance.sh'
+    short_name = 'orchestrator'
+
+    def __init__(self, hostname, vtctld):
+        self.hostname = hostname
+        self.vtctld = vtctld
+        self.http_port = ORC_HTTP_PORT
+        self.orchestrator_root = '/usr/local/orchestrator'
+        # Seconds between probes of each mysqld, and the shortest time between two recoveries of a shard.
+        self.instance_poll_seconds = 1
+        self.recovery_period_seconds = 60
+        self.configured_hosts = []
+        self.read_config()
+
+    def read_config_interactive(self):
+        self.orchestrator_root = read_value('Enter the orchestrator install dir:', self.orchestrator_root)
+
+    def instance_filename(self, i, ftype):
+        return 'orchestrator-%s-instance-%d.sh' % (ftype, i)
+
+    def down_commands(self):
+        return self.make_commands('down')
+
+    def up_commands(self):
+        return self.make_commands('up')
+
+    def make_commands(self, ftype):
+        if ftype == 'up':
+            action = 'Starting'
+        else:
+            action = 'Stopping'
+        script_file = make_run_script_file()
+        out = []
+        out.append('#!/bin/bash')
+        out.append('')
+        out.append('echo %s orchestrator...' % action)
+        for i, host in enumerate(self.configured_hosts[:1]):
+            script = self.write_instance_script(i, host, ftype)
+            out.append('')
+            out.append('%s %s %s' % (script_file, host, script))
+        out.append('')
+        return '\n'.join(out)
+
+    def orc_dir(self):
+        return os.path.join(VTDATAROOT, 'orchestrator')
+
+    def make_config(self):
+        """Returns orchestrator.conf.json, tablets are told apart by the metadata vttablet keeps in _vt."""
+        hook = os.path.join(self.orc_dir(), 'recovery-hook.sh')
+        metadata = "SELECT value FROM _vt.local_metadata WHERE name='%s'"
+        config = {
+            'ListenAddress': ':%d' % self.http_port,
+            'BackendDB': 'sqlite',
+            'SQLite3DataFile': os.path.join(self.orc_dir(), 'orchestrator.sqlite3'),
+            'MySQLTopologyUser': ORC_MYSQL_USER,
+            'MySQLTopologyPassword': ORC_MYSQL_PASSWORD,
+            'InstancePollSeconds': self.instance_poll_seconds,
+            # Tablets register themselves under their tablet hostname, keep it as is.
+            'HostnameResolveMethod': 'none',
+            'MySQLHostnameResolveMethod': 'none',
+            'DetectClusterAliasQuery': metadata % 'ClusterAlias',
+            'DetectInstanceAliasQuery': metadata % 'Alias',
+            'DetectPromotionRuleQuery': metadata % 'PromotionRule',
+            'DetectDataCenterQuery': metadata % 'DataCenter',
+            'RecoveryPeriodBlockSeconds': self.recovery_period_seconds,
+            'RecoverMasterClusterFilters': ['*'],
+            'RecoverIntermediateMasterClusterFilters': ['*'],
+            'ApplyMySQLPromotionAfterMasterFailover': True,
+            'PreFailoverProcesses': [
+                '%s failover {failureType} {failureClusterAlias} {failedHost}:{failedPort}' % hook],
+            'PostMasterFailoverProcesses': [
+                '%s promoted {failureType} {failureClusterAlias} {failedHost}:{failedPort} {successorAlias}' % hook],
+            'PostUnsuccessfulFailoverProcesses': [
+                '%s failed {failureType} {failureClusterAlias} {failedHost}:{failedPort}' % hook],
+        }
+        return json.dumps(config, indent=4, separators=(',', ': '), sort_keys=True)
+
+    def make_recovery_hook(self):
+        vtroot = VTROOT
+        recovery_log = os.path.join(self.orc_dir(), 'recovery.log')
+        vtctld_server = '%s:%s' % (self.vtctld.hostname, self.vtctld.ports['grpc_port'])
+        return """#!/bin/bash
+
+VTROOT=%(vtroot)s
+RECOVERY_LOG=%(recovery_log)s
+VTCTLD_SERVER=%(vtctld_server)s
+""" % locals() + read_template('orchestrator-recovery-hook.sh')
+
+    def instance_header_up(self, i):
+        return self.instance_header() + """
+IFS= read -r -d '' ORC_CONFIG <<'ORC_EOF'
+%s
+ORC_EOF
+
+IFS= read -r -d '' ORC_RECOVERY_HOOK <<'ORC_EOF'
+%sORC_EOF
+""" % (self.make_config(), self.make_recovery_hook())
+
+    def instance_header_down(self, i):
+        return self.instance_header()
+
+    def instance_header(self):
+        hostname = self.configured_hosts[0]
+        vtroot = VTROOT
+        vtdataroot = VTDATAROOT
+        orchestrator_root = self.orchestrator_root
+        orc_port = self.http_port
+        return """
+#!/bin/bash
+
+export VTROOT=%(vtroot)s
+export VTDATAROOT=%(vtdataroot)s
+
+HOSTNAME="%(hostname)s"
+ORCHESTRATOR_ROOT=%(orchestrator_root)s
+ORC_PORT=%(orc_port)s
+ORC_DIR=$VTDATAROOT/orchestrator
+""" % locals()
+
+# Instance i of a host listens on the base ports + i, the gRPC ports of
+# more than 8 would run into the vtctld gRPC port.
+MAX_VTGATES_PER_HOST = 8
+
+# Ports the generated HAProxy config listens on in front of all vtgates.
+VTGATE_LB_PORTS = dict(mysql_server_port=15300, grpc_port=15990)
+
 class VtGate(HostClass):
     up_filename = 'vtgate-up.sh'
     down_filename = 'vtgate-down.sh'
@@ -638,13 +945,28 @@ class VtGate(HostClass):
         self.ls = ls
         self.ports = dict(web_port=15001, grpc_port=15991, mysql_server_port=15306)
         self.configured_hosts = []
+        self.instances_per_host = 1
         self.read_config()
 
     def read_config_interactive(self):
-        pass
-
-    def instance_filename(self, i, ftype):
-        return 'vtgate-%s-instance-%d.sh' % (ftype, i)
+        num = read_value('Number of vtgate instances per host (at most %d):' % MAX_VTGATES_PER_HOST,
+                         self.instances_per_host)
+        self.instances_per_host = max(1, min(int(num), MAX_VTGATES_PER_HOST))
+
+    def get_instances(self):
+        """Returns a dict per vtgate, the first instance of every host before the second of any."""
+        instances = []
+        for index in xrange(self.instances_per_host):
+            for host in self.configured_hosts:
+                instance = dict(host=host, index=index, name='vtgate-%d@%s' % (index, host),
+                                cell=CELLS.cell_of(host))
+                for port_type, port in self.ports.iteritems():
+                    instance[port_type] = port + index
+                instances.append(instance)
+        return instances
+
+    def instance_filename(self, instance, ftype):
+        return 'vtgate-%s-instance-%d.sh' % (ftype, instance['index'])
 
     def down_commands(self):
         return self.make_commands('down')
@@ -662,26 +984,29 @@ class VtGate(HostClass):
         out.append('#!/bin/bash')
         out.append('')
         out.append('echo %s vtgate...' % action)
-        for i, host in enumerate(self.configured_hosts):
-            script = self.write_instance_script(i, host, ftype)
+        for instance in self.get_instances():
+            script = self.write_instance_script(instance, instance['host'], ftype)
             out.append('')
-            out.append('%s %s %s' % (script_file, host, script))
+            out.append('%s %s %s' % (script_file, instance['host'], script))
         out.append('')
         return '\n'.join(out)
 
-    def instance_header_up(self, i):
-        return self.instance_header()
+    def instance_header_up(self, instance):
+        return self.instance_header(instance)
 
-    def instance_header_down(self, i):
-        return self.instance_header()
+    def instance_header_down(self, instance):
+        return self.instance_header(instance)
 
-    def instance_header(self):
+    def instance_header(self, instance):
         topology_flags = self.ls.topology_flags
-        cell = CELL
-        grpc_port = self.ports['grpc_port']
-        web_port = self.ports['web_port']
-        mysql_server_port = self.ports['mysql_server_port']
-        hostname = self.hostname
+        cell = instance['cell']
+        # Replica reads stay in the vtgate's cell, writes go to the masters in the home cell.
+        cells_to_watch = ','.join(sorted(set([cell, CELL])))
+        grpc_port = instance['grpc_port']
+        web_port = instance['web_port']
+        mysql_server_port = instance['mysql_server_port']
+        hostname = instance['host']
+        index = instance['index']
         vtroot = VTROOT
         vtdataroot = VTDATAROOT
         mysql_auth_param = MYSQL_AUTH_PARAM
@@ -698,13 +1023,202 @@ export VTDATAROOT=%(vtdataroot)s
 HOSTNAME="%(hostname)s"
 TOPOLOGY_FLAGS="%(topology_flags)s"
 CELL="%(cell)s"
+CELLS_TO_WATCH="%(cells_to_watch)s"
 GRPC_PORT=%(grpc_port)s
 WEB_PORT=%(web_port)s
 MYSQL_SERVER_PORT=%(mysql_server_port)s
 MYSQL_AUTH_PARAM="%(mysql_auth_param)s"
 BACKUP_DIR="%(backup_dir)s"
+VTGATE_DIR=$VTDATAROOT/vtgate_%(index)d
+""" % locals()
+
+    def make_haproxy_config(self, instances, fname, cell):
+        """Returns an HAProxy config balancing mysql and gRPC connections over the vtgates of a cell.
+
+        The vtgates of other cells are only used as backups when none of the cell is up.
+        """
+        out = ["""# Balances client connections over the vtgates of cell %s, run on a client host in it with:
+#   haproxy -f %s
+# Clients then connect to 127.0.0.1:%d (mysql) or 127.0.0.1:%d (gRPC).
+
+global
+    maxconn 100000
+
+defaults
+    mode tcp
+    timeout connect 5s
+    timeout client 1h
+    timeout server 1h
+""" % (cell, os.path.join(DEPLOYMENT_DIR, 'bin', fname),
+       VTGATE_LB_PORTS['mysql_server_port'], VTGATE_LB_PORTS['grpc_port'])]
+        for protocol, port_type in [('mysql', 'mysql_server_port'), ('grpc', 'grpc_port')]:
+            out.append('frontend vtgate_%s' % protocol)
+            out.append('    bind 127.0.0.1:%d' % VTGATE_LB_PORTS[port_type])
+            out.append('    default_backend vtgate_%s' % protocol)
+            out.append('')
+            out.append('backend vtgate_%s' % protocol)
+            # Sessions are long lived, so balance on open connections.
+            out.append('    balance leastconn')
+            out.append('    option httpchk GET /debug/health')
+            for instance in instances:
+                out.append('    server %s %s:%d check port %d%s' % (
+                    instance['name'], instance['host'], instance[port_type], instance['web_port'],
+                    '' if instance['cell'] == cell else ' backup'))
+            out.append('')
+        return '\n'.join(out)
+
+    def generate(self):
+        super(VtGate, self).generate()
+        instances = self.get_instances()
+        # The endpoint list clients spread their sessions over, see client_lib.load_vtgate_endpoints.
+        write_dep_file('config', 'vtgate_endpoints.json',
+                       json.dumps(dict(endpoints=instances, load_balancer=VTGATE_LB_PORTS),
+                                  indent=4, separators=(',', ': ')))
+        print '\tconfig/vtgate_endpoints.json'
+        for cell in CELLS.cells:
+            fname = 'haproxy-vtgate.cfg' if len(CELLS.cells) == 1 else 'haproxy-vtgate-%s.cfg' % cell
+            write_bin_file(fname, self.make_haproxy_config(instances, fname, cell))
+            print '\t%s' % fname
+
+def supervised_processes(config_dir):
+    """Returns {host: [process]} for the mysqld, vttablet and vtgate instance scripts generated for each host.
+
+    Each process has the script that starts it, the pid file it writes and
+    the down file its stop script leaves behind, see templates/supervisor.py.
+    """
+    hosts = {}
+    bin_dir = os.path.join(DEPLOYMENT_DIR, 'bin')
+    vttablet_config = os.path.join(config_dir, 'vttablet.json')
+    if os.path.exists(vttablet_config):
+        with open(vttablet_config) as fh:
+            tablets = json.load(fh).get('tablets', [])
+        for t in tablets:
+            tablet_dir = os.path.join(VTDATAROOT, t['tablet_dir'])
+            # Without managed mysqlds there are no mysqld scripts, an external mysql is not ours to restart.
+            commands = ['vttablet'] if args.external_mysql else ['mysqld', 'vttablet']
+            for command in commands:
+                script = os.path.join(bin_dir, t['host'], '%s-up-instance-%s.sh' % (command, t['unique_id']))
+                if not os.path.exists(script):
+                    continue
+                # mysqld_safe already restarts a mysqld that dies, watching it keeps a
+                # second mysqld from being started on the same data dir.
+                watched = 'mysqld_safe' if command == 'mysqld' else command
+                hosts.setdefault(t['host'], []).append(dict(
+                    name='%s-%s' % (command, t['unique_id']), command=watched, up=[script],
+                    pid_file=os.path.join(tablet_dir, '%s.pid' % watched),
+                    down_file=os.path.join(tablet_dir, '%s.down' % command)))
+    vtgate_config = os.path.join(config_dir, 'vtgate.json')
+    if os.path.exists(vtgate_config):
+        with open(vtgate_config) as fh:
+            config = json.load(fh)
+        for host in sorted(set(config.get('configured_hosts') or [config['hostname']])):
+            for index in xrange(config.get('instances_per_host', 1)):
+                script = os.path.join(bin_dir, host, 'vtgate-up-instance-%d.sh' % index)
+                if not os.path.exists(script):
+                    continue
+                vtgate_dir = os.path.join(VTDATAROOT, 'vtgate_%d' % index)
+                hosts.setdefault(host, []).append(dict(
+                    name='vtgate-%d' % index, command='vtgate', up=[script],
+                    pid_file=os.path.join(vtgate_dir, 'vtgate.pid'),
+                    down_file=os.path.join(vtgate_dir, 'vtgate.down')))
+    return hosts
+
+class Supervisor(HostClass):
+    """A process supervisor on every host with tablets or vtgates, see templates/supervisor.py.
+
+    It restarts the mysqlds, vttablets and vtgates of its host when they die
+    and serves their uptime and restart counts on 127.0.0.1:port. Generate
+    it after the components it watches, their instance scripts tell it what
+    runs on each host. The backoff settings come from config/supervisor.json.
+    """
+    up_filename = 'supervisor-up.sh'
+    down_filename = 'supervisor-down.sh'
+    up_instance_template = 'supervisor-up-instance.sh'
+    down_instance_template = 'supervisor-down-instance.sh'
+    short_name = 'supervisor'
+
+    def __init__(self):
+        self.port = 15500
+        # Seconds between checks, and the restart backoff, doubled while a process keeps
+        # dying within stable_time of being started.
+        self.interval = 1
+        self.min_backoff = 1
+        self.max_backoff = 60
+        self.stable_time = 60
+        self.start_timeout = 30
+        config_file = self.get_config_file()
+        if os.path.exists(config_file):
+            with open(config_file) as fh:
+                self.__dict__.update(json.load(fh))
+        else:
+            self.write_config()
+        self.processes = {}
+
+    def instance_filename(self, host, ftype):
+        return 'supervisor-%s.sh' % ftype
+
+    def instance_header(self, host):
+        vtroot = VTROOT
+        vtdataroot = VTDATAROOT
+        port = self.port
+        return """#!/bin/bash
+
+# Starts or stops the supervisor of the Vitess processes on this host.
+
+export VTROOT=%(vtroot)s
+export VTDATAROOT=%(vtdataroot)s
+
+HOSTNAME="%(host)s"
+SUPERVISOR_DIR=$VTDATAROOT/supervisor
+SUPERVISOR_PORT=%(port)d
 """ % locals()
 
+    def instance_header_up(self, host):
+        processes = self.processes[host]
+        config = dict(host=host, port=self.port, log_dir=os.path.join(VTDATAROOT, 'supervisor'),
+                      settings=dict((k, getattr(self, k)) for k in
+                                    ('interval', 'min_backoff', 'max_backoff', 'stable_time', 'start_timeout')),
+                      processes=processes)
+        return self.instance_header(host) + """NUM_PROCESSES=%d
+
+IFS= read -r -d '' SUPERVISOR_CONFIG <<'SUPERVISOR_EOF'
+%s
+SUPERVISOR_EOF
+
+IFS= read -r -d '' SUPERVISOR_PY <<'SUPERVISOR_EOF'
+%sSUPERVISOR_EOF
+""" % (len(processes), json.dumps(config, indent=4, separators=(',', ': ')), read_template('supervisor.py'))
+
+    def instance_header_down(self, host):
+        return self.instance_header(host)
+
+    def down_commands(self):
+        return self.make_commands('down')
+
+    def up_commands(self):
+        return self.make_commands('up')
+
+    def make_commands(self, ftype):
+        script_file = make_run_script_file()
+        out = []
+        out.append('#!/bin/bash')
+        out.append('')
+        out.append('echo %s supervisors...' % ('Starting' if ftype == 'up' else 'Stopping'))
+        for host in sorted(self.processes):
+            script = self.write_instance_script(host, host, ftype)
+            out.append('')
+            out.append('%s %s %s' % (script_file, host, script))
+        out.append('')
+        return '\n'.join(out)
+
+    def generate(self):
+        self.processes = supervised_processes(os.path.join(DEPLOYMENT_DIR, 'config'))
+        if not self.processes:
+            print 'WARNING: No instance scripts to supervise, generate vttablet or vtgate first.'
+        super(Supervisor, self).generate()
+        for host in sorted(self.processes):
+            print '\t%-40s %d processes' % (host, len(self.processes[host]))
+
 
 NUM_BYTES = 1
 MAX_SHARDS = 2 ** (NUM_BYTES * 8)
@@ -785,6 +1299,7 @@ class MySqld(HostClass):
         self.shards = self.vttablet.shards
         self.tablets = self.vttablet.tablets
         self.dbconfig = DbConnectionTypes()
+        self.inventory = HostInventory()
         if args.external_mysql:
             self.up_instance_template = 'mysqld-up-instance-external-mysql.sh'
 
@@ -792,7 +1307,23 @@ class MySqld(HostClass):
         pass
 
     def instance_header_up(self, tablet):
-        return self.vttablet.instance_header(tablet)
+        header = self.vttablet.instance_header(tablet)
+        if args.external_mysql:
+            return header
+        host = tablet['host']
+        inventory = self.inventory.get(host)
+        colocated = colocated_tablets(self.tablets, tablet)
+        settings = mysql_tuning(inventory, colocated, tablet)
+        lines = ['%s = %s' % kv for kv in settings]
+        data_volume, binlog_volume = assign_volumes(inventory, colocated)[tablet['unique_id']]
+        return header + """
+# my.cnf overrides for this %s tablet, one of %d mysqld on a %d cpu, %d MB, %s host.
+MY_CNF_OVERRIDES="%s"
+# Volumes for the data files and binlogs, empty keeps them under VTDATAROOT.
+DATA_VOLUME=%s
+BINLOG_VOLUME=%s
+""" % (tablet['ttype'], len(colocated), inventory['cpus'], inventory['memory_mb'], inventory['disk'], '\n'.join(lines),
+       data_volume or '', binlog_volume or '') + self.vttablet.isolation_header(tablet)
 
     def instance_header_down(self, tablet):
         return self.vttablet.instance_header(tablet)
@@ -800,6 +1331,55 @@ class MySqld(HostClass):
     def instance_filename(self, tablet, ftype="up"):
         return 'mysqld-%s-instance-%s.sh' % (ftype, tablet['unique_id'])
 
+    def print_volume_report(self):
+        """Prints the data and binlog dirs placed on each volume of the hosts that have volumes."""
+        rows = []
+        for host in sorted(set(t['host'] for t in self.tablets)):
+            inventory = self.inventory.get(host)
+            if not inventory.get('volumes'):
+                continue
+            colocated = [t for t in self.tablets if t['host'] == host]
+            placement = assign_volumes(inventory, colocated)
+            for volume in inventory['volumes']:
+                data = [t for t in colocated if placement[t['unique_id']][0] == volume]
+                binlogs = [t for t in colocated if placement[t['unique_id']][1] == volume]
+                rows.append((host, volume, data, binlogs))
+        if not rows:
+            return
+        print
+        print 'Tablet data and binlog dirs per volume:'
+        print '%-30s %-20s %6s %8s  %s' % ('host', 'volume', 'data', 'binlogs', 'data by type')
+        for host, volume, data, binlogs in rows:
+            types = dict((ttype, len([t for t in data if t['ttype'] == ttype])) for ttype in TABLET_TYPE_MEMORY_WEIGHT)
+            print '%-30s %-20s %6d %8d  %s' % (host, volume, len(data), len(binlogs),
+                                               ' '.join('%s=%d' % kv for kv in sorted(types.items()) if kv[1]))
+        print
+
+    def print_isolation_report(self):
+        """Prints the CPUs and memory limits each tablet gets with --isolation."""
+        print
+        print 'Tablet isolation (%s):' % args.isolation
+        print '%-30s %6s %-8s %8s %6s %-12s %5s %10s %10s' % (
+            'host', 'tablet', 'type', 'weight', 'quota', 'cpus', 'node', 'mem_low', 'mem_max')
+        for tablet in sorted(self.tablets, key=lambda t: (t['host'], t['unique_id'])):
+            colocated = [t for t in self.tablets if t['host'] == tablet['host']]
+            limits = isolation_limits(self.inventory.get(tablet['host']), colocated, tablet)
+            print '%-30s %6s %-8s %8d %6s %-12s %5s %8dMB %8dMB' % (
+                tablet['host'], tablet['unique_id'], tablet['ttype'], limits['cpu_weight'],
+                limits['cpu_quota'] and '%d%%' % limits['cpu_quota'] or '-', limits['cpuset'], limits['mems'] or '-',
+                limits['mysqld_memory_low'], limits['mysqld_memory_max'])
+        print
+
+    def check_memory(self):
+        """Warns about hosts where the co-located mysqlds get too little memory each."""
+        for host in sorted(set(t['host'] for t in self.tablets)):
+            inventory = self.inventory.get(host)
+            colocated = [t for t in self.tablets if t['host'] == host]
+            budget = mysqld_memory_budget(inventory, len(colocated))
+            if budget / len(colocated) < MIN_MYSQLD_MEMORY_MB:
+                print 'WARNING: %d tablets on %s leave %d MB per mysqld, add hosts or memory.' % (
+                    len(colocated), host, budget / len(colocated))
+
     def down_commands_shard(self, shard):
         script_file = make_run_script_file()
         out = []
@@ -861,8 +1441,362 @@ class MySqld(HostClass):
         return '\n'.join(out)
 
     def generate(self):
-        super(MySqld, self).generate()
-        self.dbconfig.generate()
+        with profile_phase('generate:mysqld', component='mysqld'):
+            if not args.external_mysql:
+                self.check_memory()
+            super(MySqld, self).generate()
+            self.dbconfig.generate()
+            if not args.external_mysql:
+                self.print_volume_report()
+            if args.isolation != 'none':
+                self.print_isolation_report()
+
+class HostInventory(ConfigType):
+    """CPU, memory, disk type and data volumes of each host, used to size and place the mysqld of its tablets.
+
+    Hosts are probed with the inventory action, hosts that were not probed
+    get the defaults. Volumes are not probed but given with --data-volumes.
+    """
+    short_name = 'host_inventory'
+    default = dict(cpus=4, memory_mb=8192, disk='ssd')
+
+    def __init__(self):
+        self.hosts = {}
+        config_file = self.get_config_file()
+        if os.path.exists(config_file):
+            with open(config_file) as fh:
+                self.hosts = json.load(fh).get('hosts', {})
+
+    def get(self, host):
+        return self.hosts.get(host, self.default)
+
+    def probe(self, hosts):
+        """Probes the hosts in parallel and stores what it finds."""
+        pool = ThreadPool(max(1, min(args.collect_concurrency, len(hosts))))
+        for host, inventory in pool.imap_unordered(probe_host, hosts):
+            if inventory is None:
+                print '\t%-40s could not probe, using defaults' % host
+                continue
+            if args.data_volumes is not None:
+                inventory['volumes'] = [v for v in args.data_volumes.split(',') if v]
+            elif host in self.hosts:
+                inventory['volumes'] = self.hosts[host].get('volumes', [])
+            self.hosts[host] = inventory
+            print '\t%-40s %3d cpus %8d MB %s %d numa nodes %s' % (
+                host, inventory['cpus'], inventory['memory_mb'], inventory['disk'],
+                len(inventory.get('numa_nodes', [])), ','.join(inventory.get('volumes', [])))
+        self.write_config()
+        print 'Host inventory written to: %s' % self.get_config_file()
+
+PROBE_HOST_CMD = """nproc 2>/dev/null || sysctl -n hw.ncpu
+awk '/MemTotal/ {print int($2 / 1024)}' /proc/meminfo 2>/dev/null || echo $(( $(sysctl -n hw.memsize) / 1048576 ))
+dev=$(basename $( (df -P %s || df -P /) 2>/dev/null | awk 'NR == 2 {print $1}'))
+cat /sys/class/block/$dev/queue/rotational /sys/class/block/$dev/../queue/rotational 2>/dev/null | head -1
+echo numa $(cat /sys/devices/system/node/node*/cpulist 2>/dev/null)
+"""
+
+def probe_host(host):
+    """Returns (host, dict of cpus, memory_mb, disk and numa_nodes), None instead of the dict if it fails.
+
+    The disk is the one of VTDATAROOT, or of / before VTDATAROOT exists.
+    """
+    cmd = PROBE_HOST_CMD % VTDATAROOT
+    argv = ['bash', '-c', cmd] if is_local_host(host) else ['ssh'] + SSH_OPTS + [host, '--', cmd]
+    try:
+        out = subprocess.check_output(argv).split()
+        return host, dict(cpus=int(out[0]), memory_mb=int(out[1]),
+                          disk='hdd' if out[2:3] == ['1'] else 'ssd',
+                          numa_nodes=out[out.index('numa') + 1:])
+    except (subprocess.CalledProcessError, ValueError, IndexError, OSError):
+        return host, None
+
+# Memory kept for the OS and page cache, and for each vttablet process.
+OS_RESERVED_MEMORY_MB = 1024
+VTTABLET_MEMORY_MB = 256
+MIN_MYSQLD_MEMORY_MB = 512
+# Share of a host's memory given to each mysqld, rdonly tablets only serve batch jobs.
+TABLET_TYPE_MEMORY_WEIGHT = dict(master=2, replica=2, rdonly=1)
+# IOPS a mysqld may use when it has the disk to itself.
+DISK_IO_CAPACITY = dict(ssd=2000, hdd=200)
+
+# Expected I/O on the data files and binlogs of a tablet by type, balanced
+# over the volumes of a host. Masters take the writes, rdonly tablets are
+# only read by batch jobs.
+DATA_VOLUME_WEIGHT = dict(master=3, replica=2, rdonly=1)
+BINLOG_VOLUME_WEIGHT = dict(master=2, replica=1, rdonly=1)
+
+def assign_volumes(inventory, colocated):
+    """Returns {unique_id: (data volume, binlog volume)} for the tablets of a host.
+
+    The heaviest tablets go first. Data dirs, each a full copy of a shard,
+    are balanced by count and then by I/O, binlogs by I/O. With
+    --separate-binlogs and several volumes, binlogs go to another volume
+    than the data. Hosts without volumes keep everything under VTDATAROOT.
+    """
+    volumes = inventory.get('volumes') or []
+    if not volumes:
+        return dict((t['unique_id'], (None, None)) for t in colocated)
+    data_dirs = dict((v, 0) for v in volumes)
+    binlog_load = dict((v, 0) for v in volumes)
+    load = dict((v, 0) for v in volumes)
+    placement = {}
+    for tablet in sorted(colocated, key=lambda t: (-DATA_VOLUME_WEIGHT.get(t['ttype'], 1), t['unique_id'])):
+        data = min(volumes, key=lambda v: (data_dirs[v], load[v]))
+        data_dirs[data] += 1
+        load[data] += DATA_VOLUME_WEIGHT.get(tablet['ttype'], 1)
+        binlog = data
+        if args.separate_binlogs and len(volumes) > 1:
+            binlog = min([v for v in volumes if v != data], key=lambda v: (binlog_load[v], load[v]))
+        binlog_load[binlog] += BINLOG_VOLUME_WEIGHT.get(tablet['ttype'], 1)
+        load[binlog] += BINLOG_VOLUME_WEIGHT.get(tablet['ttype'], 1)
+        placement[tablet['unique_id']] = (data, binlog)
+    return placement
+
+def colocated_tablets(tablets, tablet):
+    """The tablets on the host of tablet, including tablet itself when it is not one of tablets.
+
+    The throwaway tablets of benchmark_restore are sized like the regular
+    tablets of their host without being part of the deployment.
+    """
+    colocated = [t for t in tablets if t['host'] == tablet['host']]
+    if tablet['unique_id'] not in [t['unique_id'] for t in colocated]:
+        colocated.append(tablet)
+    return colocated
+
+def mysqld_memory_budget(inventory, num_tablets):
+    reserved = max(OS_RESERVED_MEMORY_MB, inventory['memory_mb'] / 10) + num_tablets * VTTABLET_MEMORY_MB
+    return max(inventory['memory_mb'] - reserved, 0)
+
+def mysqld_memory_mb(inventory, colocated, tablet):
+    """The tablet's share of the memory left to the mysqlds of its host."""
+    weights = sum(TABLET_TYPE_MEMORY_WEIGHT.get(t['ttype'], 1) for t in colocated)
+    share = TABLET_TYPE_MEMORY_WEIGHT.get(tablet['ttype'], 1) / float(weights)
+    return max(int(mysqld_memory_budget(inventory, len(colocated)) * share), MIN_MYSQLD_MEMORY_MB)
+
+def mysql_tuning(inventory, colocated, tablet):
+    """Returns my.cnf (name, value) pairs sizing the mysqld of a tablet for its share of the host."""
+    colocated = colocated_tablets(colocated, tablet)
+    memory_mb = mysqld_memory_mb(inventory, colocated, tablet)
+    # Most of it goes to the buffer pool, in whole 128 MB chunks, the rest to connections.
+    buffer_pool_mb = max(memory_mb * 3 / 4 / 128 * 128, 128)
+    log_file_mb = min(max(buffer_pool_mb / 8, 48), 2048)
+    max_connections = min(max((memory_mb - buffer_pool_mb) / 4, 100), 1000)
+    io_threads = min(max(inventory['cpus'] / len(colocated), 2), 16)
+    # The disk is shared by the tablets with their data on the same volume.
+    placement = assign_volumes(inventory, colocated)
+    sharing = [t for t in colocated if placement[t['unique_id']][0] == placement[tablet['unique_id']][0]]
+    io_capacity = max(DISK_IO_CAPACITY[inventory['disk']] / len(sharing), 100)
+    settings = [
+        ('innodb_buffer_pool_size', '%dM' % buffer_pool_mb),
+        ('innodb_buffer_pool_instances', min(max(buffer_pool_mb / 1024, 1), 8)),
+        ('innodb_log_file_size', '%dM' % log_file_mb),
+        ('innodb_log_files_in_group', 2),
+        ('innodb_io_capacity', io_capacity),
+        ('innodb_io_capacity_max', io_capacity * 2),
+        ('innodb_read_io_threads', io_threads),
+        ('innodb_write_io_threads', io_threads),
+        ('max_connections', max_connections),
+        ('thread_cache_size', min(max_connections / 4, 100)),
+    ]
+    if tablet['ttype'] == 'rdonly':
+        # Batch jobs sort and join large results, and an rdonly can be rebuilt from a backup.
+        settings += [
+            ('sort_buffer_size', '4M'),
+            ('join_buffer_size', '4M'),
+            ('tmp_table_size', '64M'),
+            ('max_heap_table_size', '64M'),
+            ('innodb_flush_log_at_trx_commit', 2),
+            ('sync_binlog', 0),
+        ]
+    else:
+        settings += [
+            ('innodb_flush_log_at_trx_commit', 1),
+            ('sync_binlog', 1),
+        ]
+    return settings
+
+# cgroup cpu.weight of the processes of a tablet, masters win under contention.
+TABLET_TYPE_CPU_WEIGHT = dict(master=1000, replica=300, rdonly=50)
+# Share of a host's CPUs each tablet gets, rdonly tablets share one batch set.
+TABLET_TYPE_CPU_SHARE = dict(master=4, replica=2, rdonly=1)
+# mysqld memory limit over its share of the host, masters are also protected up to their share.
+TABLET_TYPE_MEMORY_LIMIT = dict(master=2.0, replica=1.5, rdonly=1.25)
+
+def parse_cpu_list(cpu_list):
+    """'0-3,8' -> [0, 1, 2, 3, 8]"""
+    cpus = []
+    for part in cpu_list.split(','):
+        if '-' in part:
+            first, last = part.split('-')
+            cpus += range(int(first), int(last) + 1)
+        elif part:
+            cpus.append(int(part))
+    return cpus
+
+def format_cpu_list(cpus):
+    """[0, 1, 2, 3, 8] -> '0-3,8'"""
+    ranges = []
+    for cpu in sorted(cpus):
+        if ranges and ranges[-1][1] == cpu - 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+    return ','.join(str(a) if a == b else '%d-%d' % (a, b) for a, b in ranges)
+
+def allocate_cpus(inventory, colocated, numa):
+    """Returns {unique_id: (cpu list, numa node or None)} for the tablets of a host.
+
+    Tablets are spread over the NUMA nodes of the host (one node without
+    --numa), heaviest first. Within a node, masters and replicas get CPUs
+    of their own by TABLET_TYPE_CPU_SHARE and all rdonly tablets share the
+    rest. A node with fewer CPUs than tablets needing their own is shared
+    by all of its tablets.
+    """
+    nodes = [parse_cpu_list(n) for n in inventory.get('numa_nodes', [])] if numa else []
+    if len(nodes) < 2:
+        nodes = [range(inventory['cpus'])]
+    numa = len(nodes) > 1
+    node_load = [0] * len(nodes)
+    node_tablets = [[] for _ in nodes]
+    for tablet in sorted(colocated, key=lambda t: (-TABLET_TYPE_CPU_SHARE.get(t['ttype'], 1), t['unique_id'])):
+        node = min(xrange(len(nodes)), key=lambda n: node_load[n] / float(len(nodes[n])))
+        node_load[node] += TABLET_TYPE_CPU_SHARE.get(tablet['ttype'], 1)
+        node_tablets[node].append(tablet)
+
+    allocation = {}
+    for node, (cpus, tablets) in enumerate(zip(nodes, node_tablets)):
+        node_id = node if numa else None
+        own = [t for t in tablets if t['ttype'] != 'rdonly']
+        batch = [t for t in tablets if t['ttype'] == 'rdonly']
+        if len(cpus) < len(own) + (1 if batch else 0):
+            for t in tablets:
+                allocation[t['unique_id']] = (format_cpu_list(cpus), node_id)
+            continue
+        shares = [TABLET_TYPE_CPU_SHARE.get(t['ttype'], 1) for t in own]
+        total = sum(shares) + (TABLET_TYPE_CPU_SHARE['rdonly'] * len(batch) if batch else 0)
+        # Everyone gets one CPU, the rest goes by share, the batch set takes what is left.
+        counts = [1 + int((len(cpus) - len(own) - (1 if batch else 0)) * share / float(total)) for share in shares]
+        start = 0
+        for t, count in zip(own, counts):
+            allocation[t['unique_id']] = (format_cpu_list(cpus[start:start + count]), node_id)
+            start += count
+        if not batch and own:
+            # No batch set, the last tablet takes the leftover CPUs.
+            last = own[-1]['unique_id']
+            allocation[last] = (format_cpu_list(parse_cpu_list(allocation[last][0]) + cpus[start:]), node_id)
+        for t in batch:
+            allocation[t['unique_id']] = (format_cpu_list(cpus[start:]), node_id)
+    return allocation
+
+def isolation_limits(inventory, colocated, tablet):
+    """Returns the cgroup settings of the mysqld and vttablet of a tablet, see --isolation."""
+    colocated = colocated_tablets(colocated, tablet)
+    allocation = allocate_cpus(inventory, colocated, args.numa)
+    cpus, node = allocation[tablet['unique_id']]
+    memory_mb = mysqld_memory_mb(inventory, colocated, tablet)
+    ttype = tablet['ttype']
+    limits = dict(cpu_weight=TABLET_TYPE_CPU_WEIGHT.get(ttype, 100),
+                  cpu_quota='',
+                  cpuset=cpus,
+                  mems='' if node is None else str(node),
+                  mysqld_memory_max=int(memory_mb * TABLET_TYPE_MEMORY_LIMIT.get(ttype, 1.5)),
+                  mysqld_memory_low=memory_mb if ttype == 'master' else 0,
+                  vttablet_memory_max=VTTABLET_MEMORY_MB * 4)
+    if ttype == 'rdonly':
+        # Batch tablets are capped at their share of the CPUs even when the host is idle.
+        sharing = len([t for t in colocated if allocation[t['unique_id']][0] == cpus])
+        share = max(len(parse_cpu_list(cpus)) / sharing, 1)
+        limits['cpu_quota'] = share * 100
+    return limits
+
+class Workload(ConfigType):
+    """Expected peak load per shard, used to size the query server pools of the tablets.
+
+    Set it with the workload action, from --expected-qps or from a client
+    result file written with --results. Shards without an entry get the default.
+    """
+    short_name = 'workload'
+
+    def __init__(self):
+        self.default = dict(read_qps=500, write_qps=100)
+        self.shards = {}
+        # Seconds a read and a write transaction hold a connection.
+        self.read_latency = 0.005
+        self.write_latency = 0.02
+        # Share of the reads sent to replicas instead of the master.
+        self.replica_read_share = 0.0
+        self.query_timeout = 30
+        self.transaction_timeout = 30
+        config_file = self.get_config_file()
+        if os.path.exists(config_file):
+            with open(config_file) as fh:
+                self.__dict__.update(json.load(fh))
+
+    def get(self, shard):
+        return self.shards.get(shard, self.default)
+
+    def set_from_results(self, path, shards):
+        """Spreads the peak QPS of a client run evenly over the shards, as the hash vindex does."""
+        intervals = []
+        summary = None
+        with open(path) as fh:
+            for line in fh:
+                entry = json.loads(line)
+                if entry['type'] == 'interval':
+                    intervals.append(entry)
+                elif entry['type'] == 'summary':
+                    summary = entry
+        if summary is None or not intervals:
+            print >> sys.stderr, 'ERROR: No complete run in: %s' % path
+            sys.exit(1)
+        read_qps = max(i['read_qps'] for i in intervals)
+        write_qps = max(i['write_qps'] for i in intervals)
+        for shard in shards:
+            self.shards[shard] = dict(read_qps=read_qps / len(shards), write_qps=write_qps / len(shards))
+        self.read_latency = summary['read_p99'] or self.read_latency
+        self.write_latency = summary['write_p99'] or self.write_latency
+
+# Vitess' defaults are pool 16, stream pool 200, transaction cap 20, sized
+# here for the load instead. Connections are kept for dba, replication
+# and filtered replication on top of the pools.
+MIN_POOL_SIZE = 4
+POOL_HEADROOM = 2
+STREAM_POOL_SIZE = dict(master=8, replica=8, rdonly=32)
+RESERVED_MYSQL_CONNECTIONS = 10
+
+def queryserver_sizing(workload, tablet, num_replicas, max_connections):
+    """Returns the query server pool sizes and timeouts of a tablet by Little's law.
+
+    Replicas can be promoted, so they are sized for the larger of the
+    master's load and their share of the replica reads. Only rdonly
+    tablets get the minimum pools.
+    """
+    load = workload.get(tablet['shard'])
+    master_reads = load['read_qps'] * (1 - workload.replica_read_share)
+    replica_reads = load['read_qps'] * workload.replica_read_share / max(num_replicas, 1)
+    if tablet['ttype'] == 'master':
+        read_concurrency = master_reads * workload.read_latency
+        write_concurrency = load['write_qps'] * workload.write_latency
+    elif tablet['ttype'] == 'replica':
+        read_concurrency = max(master_reads, replica_reads) * workload.read_latency
+        write_concurrency = load['write_qps'] * workload.write_latency
+    else:
+        read_concurrency = 0
+        write_concurrency = 0
+    sizing = dict(pool_size=int(math.ceil(read_concurrency * POOL_HEADROOM)) + MIN_POOL_SIZE,
+                  stream_pool_size=STREAM_POOL_SIZE.get(tablet['ttype'], MIN_POOL_SIZE),
+                  transaction_cap=int(math.ceil(write_concurrency * POOL_HEADROOM)) + MIN_POOL_SIZE)
+    if max_connections is not None:
+        budget = max_connections - RESERVED_MYSQL_CONNECTIONS
+        total = sum(sizing.values())
+        if total > budget:
+            for key in sizing:
+                sizing[key] = max(sizing[key] * budget / total, 2)
+    # Batch queries on rdonly tablets run for much longer.
+    timeout_scale = 10 if tablet['ttype'] == 'rdonly' else 1
+    sizing.update(query_timeout=workload.query_timeout * timeout_scale,
+                  transaction_timeout=workload.transaction_timeout)
+    return sizing
 
 class VtTablet(HostClass):
     up_filename = 'vttablet-up.sh'
@@ -889,6 +1823,7 @@ class VtTablet(HostClass):
             self.read_config_add()
         self.mysqld = MySqld(self)
         self.dbconfig = self.mysqld.dbconfig
+        self.workload = Workload()
 
     def read_config_interactive(self):
         print
@@ -930,13 +1865,34 @@ class VtTablet(HostClass):
             num_instances['master'] = 1
             num_instances['replica'] = read_value('Number of additional tablets of type "replica":', '2')
             num_instances['rdonly'] = read_value('Number of tablets of type "rdonly":', '2')
-            shard_config[shard] = dict(num_instances=num_instances)
+            shard_config[shard] = dict(num_instances=num_instances, cells={})
+            # Other cells get replicas for local reads, the master stays in the home cell.
+            for cell in CELLS.cells[1:]:
+                print 'For shard "%s" in cell "%s":' % (shard, cell)
+                cell_instances = dict(master=0)
+                cell_instances['replica'] = read_value('Number of tablets of type "replica":', '2')
+                cell_instances['rdonly'] = read_value('Number of tablets of type "rdonly":', '0')
+                shard_config[shard]['cells'][cell] = dict(num_instances=cell_instances)
 
         print
         print 'Now we will gather information about each tablet'
         print
-        tablets_per_host, host_per_tablet = distribute_tablets(shard_config, self.configured_hosts)
-        print 'Distributed %d tablets across %d hosts.' % (len(host_per_tablet), len(tablets_per_host))
+        # Tablets are spread over the hosts of their own cell.
+        host_per_tablet = {}
+        for cell in CELLS.cells:
+            cell_hosts = CELLS.hosts_in(cell, self.configured_hosts)
+            if cell == CELL:
+                cell_config = dict((shard, shard_config[shard]) for shard in new_shards)
+            else:
+                cell_config = dict((shard, shard_config[shard]['cells'][cell]) for shard in new_shards)
+            if not cell_hosts:
+                print >> sys.stderr, 'ERROR: No vttablet hosts in cell "%s", add some.' % cell
+                sys.exit(1)
+            tablets_per_host, cell_host_per_tablet = distribute_tablets(cell_config, cell_hosts)
+            print 'Distributed %d tablets across %d hosts in cell "%s".' % (
+                len(cell_host_per_tablet), len(tablets_per_host), cell)
+            for (shard, ttype, i), host in cell_host_per_tablet.iteritems():
+                host_per_tablet[(cell, shard, ttype, i)] = host
         print 'The hosts will be presented to you as defaults.'
         print
         tablets = []
@@ -944,50 +1900,55 @@ class VtTablet(HostClass):
             shard_config[shard]['tablets'] = []
             base_offset = self.offset_base * (all_shards.index(shard) + 1)
             cnt = int(os.getenv('TABLET_ID_OFFSET', '0'))
-            for ttype in self.tablet_types:
-                num_instances = int(shard_config[shard]['num_instances'][ttype])
-                for i in xrange(1, num_instances + 1):
-                    cnt += 1
-                    default_host = host_per_tablet[(shard, ttype, i)]
-                    unique_id = base_offset + cnt - 1
-                    cell = CELL
-                    alias = '%s-%010d' %(cell, unique_id)
-                    tablet_dir ='vt_%010d' % unique_id
-                    print 'Tablet "%(alias)s" (cell="%(cell)s",shard="%(shard)s",type="%(ttype)s",num=%(i)d):' % locals()
-                    prompt = '\tEnter host name:'
-                    host = read_value(prompt, default_host)
-                    prompt = '\tEnter web port number:'
-                    default = self.base_ports['web'] + base_offset + cnt
-                    web_port = read_value(prompt, default)
-                    prompt = '\tEnter grpc port number:'
-                    default = self.base_ports['grpc'] + base_offset + cnt
-                    grpc_port = read_value(prompt, default)
-                    prompt = '\tEnter mysql host:'
-                    default = host
-                    mysql_host = read_value(prompt, default)
-                    if mysql_host == host:
-                        default = self.base_ports['mysql'] + base_offset + cnt
-                    else:
-                        default = 3306
-                    prompt = '\tEnter mysql port number:'
-                    mysql_port = read_value(prompt, default)
-                    print
-                    tablet = dict(host=host,
-                                  grpc_port=grpc_port,
-                                  web_port=web_port,
-                                  mysql_host=mysql_host,
-                                  mysql_port=mysql_port,
-                                  alias=alias,
-                                  tablet_dir=tablet_dir,
-                                  unique_id=unique_id,
-                                  shard=shard,
-                                  ttype=ttype,
-                                  )
-
-                    tablets.append(tablet)
-                    if host not in hosts:
-                        hosts[host] = []
-                    hosts[host].append(tablet)
+            for cell in CELLS.cells:
+                if cell == CELL:
+                    cell_instances = shard_config[shard]['num_instances']
+                else:
+                    cell_instances = shard_config[shard]['cells'][cell]['num_instances']
+                for ttype in self.tablet_types:
+                    num_instances = int(cell_instances[ttype])
+                    for i in xrange(1, num_instances + 1):
+                        cnt += 1
+                        default_host = host_per_tablet[(cell, shard, ttype, i)]
+                        unique_id = base_offset + cnt - 1
+                        alias = '%s-%010d' %(cell, unique_id)
+                        tablet_dir ='vt_%010d' % unique_id
+                        print 'Tablet "%(alias)s" (cell="%(cell)s",shard="%(shard)s",type="%(ttype)s",num=%(i)d):' % locals()
+                        prompt = '\tEnter host name:'
+                        host = read_value(prompt, default_host)
+                        prompt = '\tEnter web port number:'
+                        default = self.base_ports['web'] + base_offset + cnt
+                        web_port = read_value(prompt, default)
+                        prompt = '\tEnter grpc port number:'
+                        default = self.base_ports['grpc'] + base_offset + cnt
+                        grpc_port = read_value(prompt, default)
+                        prompt = '\tEnter mysql host:'
+                        default = host
+                        mysql_host = read_value(prompt, default)
+                        if mysql_host == host:
+                            default = self.base_ports['mysql'] + base_offset + cnt
+                        else:
+                            default = 3306
+                        prompt = '\tEnter mysql port number:'
+                        mysql_port = read_value(prompt, default)
+                        print
+                        tablet = dict(host=host,
+                                      grpc_port=grpc_port,
+                                      web_port=web_port,
+                                      mysql_host=mysql_host,
+                                      mysql_port=mysql_port,
+                                      alias=alias,
+                                      cell=cell,
+                                      tablet_dir=tablet_dir,
+                                      unique_id=unique_id,
+                                      shard=shard,
+                                      ttype=ttype,
+                                      )
+
+                        tablets.append(tablet)
+                        if host not in hosts:
+                            hosts[host] = []
+                        hosts[host].append(tablet)
         self.shards += new_shards
         self.tablets += tablets
         self.hosts = hosts
@@ -997,6 +1958,7 @@ class VtTablet(HostClass):
         super(VtTablet, self).generate()
         if self.manage_mysqld:
             self.mysqld.generate()
+        self.print_connection_report()
 
     def make_header(self):
         topology_flags = self.ls.topology_flags
@@ -1050,11 +2012,13 @@ TOPOLOGY_FLAGS="%(topology_flags)s"
         init_file = os.path.join(DEPLOYMENT_DIR, 'config', self.dbconfig.init_file)
         vtctld_host = self.vtctld.hostname
         vtctld_web_port = self.vtctld.ports['web_port']
+        orc_host, orc_port = orchestrator_endpoint(vtctld_host)
         keyspace = KEYSPACE
         vt_mysql_root = VT_MYSQL_ROOT
         dbname = self.dbconfig.get_dbname()
         mysql_auth_param = MYSQL_AUTH_PARAM
         backup_dir = BACKUP_DIR
+        golden_datadir = 1 if args.golden_datadir else 0
         all_vars = locals()
         all_vars.update(tablet)
         if all_vars['ttype'] == 'master':
@@ -1076,6 +2040,8 @@ DBCONFIG_FLAGS=%(dbconfig_flags)s
 INIT_DB_SQL_FILE=%(init_file)s
 VTCTLD_HOST=%(vtctld_host)s
 VTCTLD_WEB_PORT=%(vtctld_web_port)s
+ORC_HOST=%(orc_host)s
+ORC_PORT=%(orc_port)s
 HOSTNAME=%(host)s
 
 TABLET_DIR=%(tablet_dir)s
@@ -1089,10 +2055,51 @@ TABLET_TYPE=%(ttype)s
 EXTRA_PARAMS="%(extra_params)s"
 EXTERNAL_MYSQL=%(external_mysql)s
 BACKUP_DIR="%(backup_dir)s"
+GOLDEN_DATADIR=%(golden_datadir)s
 """ % all_vars
 
+    def tablet_sizing(self, tablet):
+        num_replicas = len([t for t in self.tablets if t['shard'] == tablet['shard'] and t['ttype'] == 'replica'])
+        max_connections = None
+        if self.manage_mysqld and not args.external_mysql:
+            colocated = colocated_tablets(self.tablets, tablet)
+            max_connections = dict(mysql_tuning(self.mysqld.inventory.get(tablet['host']), colocated, tablet))['max_connections']
+        return queryserver_sizing(self.workload, tablet, num_replicas, max_connections)
+
     def instance_header_up(self, tablet):
-        return self.instance_header(tablet)
+        sizing = self.tablet_sizing(tablet)
+        flags = ('-queryserver-config-pool-size %(pool_size)d '
+                 '-queryserver-config-stream-pool-size %(stream_pool_size)d '
+                 '-queryserver-config-transaction-cap %(transaction_cap)d '
+                 '-queryserver-config-query-timeout %(query_timeout)d '
+                 '-queryserver-config-transaction-timeout %(transaction_timeout)d') % sizing
+        load = self.workload.get(tablet['shard'])
+        return self.instance_header(tablet) + """
+# Query server sized for %d reads/s and %d writes/s on shard %s.
+QUERYSERVER_FLAGS="%s"
+""" % (load['read_qps'], load['write_qps'], tablet['shard'], flags) + self.isolation_header(tablet)
+
+    def isolation_header(self, tablet):
+        """The cgroup limits of the mysqld and vttablet of a tablet and the isolate function applying them."""
+        if args.isolation == 'none':
+            # isolate runs the commands as they are, the memory sizes only need to be numbers.
+            limits = dict(cpu_weight='', cpu_quota='', cpuset='', mems='',
+                          mysqld_memory_max=0, mysqld_memory_low=0, vttablet_memory_max=0)
+        else:
+            colocated = colocated_tablets(self.tablets, tablet)
+            limits = isolation_limits(self.mysqld.inventory.get(tablet['host']), colocated, tablet)
+        limits['isolation'] = args.isolation
+        return """
+# CPU and memory limits of this tablet's processes, applied with ISOLATION=systemd or cgroup.
+ISOLATION=%(isolation)s
+CPU_WEIGHT=%(cpu_weight)s
+CPU_QUOTA=%(cpu_quota)s
+CPUSET=%(cpuset)s
+MEMS=%(mems)s
+MYSQLD_MEMORY_MAX=%(mysqld_memory_max)s
+MYSQLD_MEMORY_LOW=%(mysqld_memory_low)s
+VTTABLET_MEMORY_MAX=%(vttablet_memory_max)s
+""" % limits + read_template('isolate-instance.sh')
 
     def instance_header_down(self, tablet):
         return self.instance_header(tablet)
@@ -1100,6 +2107,26 @@ BACKUP_DIR="%(backup_dir)s"
     def instance_filename(self, tablet, ftype="up"):
         return 'vttablet-%s-instance-%s.sh' % (ftype, tablet['unique_id'])
 
+    def print_connection_report(self):
+        """Prints the hosts with the most MySQL connections the pools of their tablets can open."""
+        hosts = {}
+        for tablet in self.tablets:
+            sizing = self.tablet_sizing(tablet)
+            connections = (sizing['pool_size'] + sizing['stream_pool_size'] + sizing['transaction_cap'] +
+                           RESERVED_MYSQL_CONNECTIONS)
+            count, total = hosts.get(tablet['host'], (0, 0))
+            hosts[tablet['host']] = (count + 1, total + connections)
+        print
+        print 'MySQL connections per host (query server pools plus %d reserved per tablet):' % RESERVED_MYSQL_CONNECTIONS
+        print '%-40s %8s %12s' % ('host', 'tablets', 'connections')
+        ranked = sorted(hosts.iteritems(), key=lambda kv: -kv[1][1])
+        for host, (count, total) in ranked[:args.top]:
+            print '%-40s %8d %12d' % (host, count, total)
+        if len(ranked) > args.top:
+            print '... %d more hosts' % (len(ranked) - args.top)
+        print '%-40s %8d %12d' % ('total', len(self.tablets), sum(total for _, total in hosts.itervalues()))
+        print
+
     def down_commands_shard(self, shard):
         script_file = make_run_script_file()
         out = []
@@ -1169,6 +2196,252 @@ BACKUP_DIR="%(backup_dir)s"
 
         return '\n'.join(out)
 
+    def vtctl_command(self, *command):
+        server = '%s:%s' % (self.vtctld.hostname, self.vtctld.ports['grpc_port'])
+        return [os.path.join(VTROOT, 'bin', 'vtctlclient'), '-server', server] + list(command)
+
+    def backup_source(self, shard):
+        """Picks an rdonly tablet to back up, else a replica, so serving traffic is not slowed down."""
+        for ttype in ('rdonly', 'replica'):
+            for tablet in self.tablets:
+                if tablet['shard'] == shard and tablet['ttype'] == ttype:
+                    return tablet
+        return None
+
+    def run_backup(self, tablet):
+        log_file = os.path.join(DEPLOYMENT_DIR, 'log', 'backup-%s.log' % tablet['alias'])
+        start = time.time()
+        with open(log_file, 'w') as fh:
+            exit_code = subprocess.call(
+                self.vtctl_command('Backup', '-concurrency', str(args.backup_file_concurrency), tablet['alias']),
+                stdout=fh, stderr=subprocess.STDOUT)
+        name, size = latest_backup(KEYSPACE, tablet['shard'])
+        return dict(time=start, keyspace=KEYSPACE, shard=tablet['shard'], tablet=tablet['alias'],
+                    host=tablet['host'], seconds=time.time() - start, exit_code=exit_code,
+                    backup=name, bytes=size, log=log_file)
+
+    def backup(self):
+        """Backs up every shard of the newest shard set, --backup-concurrency shards at a time."""
+        shards = self.shard_sets[-1] if self.shard_sets else self.shards
+        sources = []
+        for shard in shards:
+            tablet = self.backup_source(shard)
+            if tablet is None:
+                print 'WARNING: No rdonly or replica tablet to back up shard "%s".' % shard
+            else:
+                sources.append(tablet)
+        if not sources:
+            return
+        log_dir = os.path.join(DEPLOYMENT_DIR, 'log')
+        if not os.path.exists(log_dir):
+            os.makedirs(log_dir)
+        print 'Backing up %d shards, %d at a time.' % (len(sources), args.backup_concurrency)
+        print '%-12s %-20s %10s %14s %10s  %s' % ('shard', 'tablet', 'seconds', 'bytes', 'MB/s', 'status')
+        pool = ThreadPool(max(1, min(args.backup_concurrency, len(sources))))
+        failed = 0
+        with open(os.path.join(log_dir, 'backups.jsonl'), 'a') as fh:
+            for result in pool.imap_unordered(self.run_backup, sources):
+                fh.write(json.dumps(result) + '\n')
+                fh.flush()
+                if result['exit_code'] != 0:
+                    failed += 1
+                    status = 'FAILED, see %s' % result['log']
+                else:
+                    status = result['backup']
+                size = result['bytes']
+                rate = '%.1f' % (size / result['seconds'] / 1e6) if size else '-'
+                print '%-12s %-20s %10.1f %14s %10s  %s' % (
+                    result['shard'], result['tablet'], result['seconds'], size if size is not None else '-', rate, status)
+        print 'Backup results appended to: %s' % os.path.join(log_dir, 'backups.jsonl')
+        if failed:
+            print >> sys.stderr, 'ERROR: %d backups failed.' % failed
+            sys.exit(1)
+
+    def restore_tablet(self, shard, i):
+        """A throwaway rdonly tablet for shard, rdonly so only batch traffic can reach it while it serves."""
+        host = args.restore_host or self.hostname
+        unique_id = RESTORE_BENCH_UID_BASE + i
+        port = args.restore_base_port + 3 * i
+        return dict(host=host, web_port=port, grpc_port=port + 1, mysql_host=host, mysql_port=port + 2,
+                    alias='%s-%010d' % (CELL, unique_id), tablet_dir='vt_%010d' % unique_id,
+                    unique_id=unique_id, shard=shard, ttype='rdonly')
+
+    def run_on_host(self, tablet, script, *extra):
+        return subprocess.call([make_run_script_file(), tablet['host'], script] + list(extra))
+
+    def benchmark_one_restore(self, tablet):
+        """Starts a tablet from the latest backup and returns the seconds until it serves, None on timeout."""
+        init_db_sql = os.path.join(DEPLOYMENT_DIR, 'config', self.dbconfig.init_file)
+        mysqld_up = self.mysqld.write_instance_script(tablet, tablet['host'], 'up')
+        vttablet_up = self.write_instance_script(tablet, tablet['host'], 'up')
+        start = time.time()
+        self.run_on_host(tablet, mysqld_up, init_db_sql)
+        mysqld_seconds = time.time() - start
+        self.run_on_host(tablet, vttablet_up)
+        target = dict(host=tablet['host'], web_port=tablet['web_port'])
+        while time.time() - start < args.restore_timeout:
+            dvars = fetch_vars((target, 1))
+            if dvars is not None and dvars.get('TabletStateName') == 'SERVING':
+                return mysqld_seconds, time.time() - start
+            time.sleep(1)
+        return mysqld_seconds, None
+
+    def remove_restore_tablet(self, tablet):
+        self.run_on_host(tablet, self.write_instance_script(tablet, tablet['host'], 'down'))
+        self.run_on_host(tablet, self.mysqld.write_instance_script(tablet, tablet['host'], 'down'))
+        subprocess.call(self.vtctl_command('DeleteTablet', tablet['alias']))
+        cleanup = write_bin_file(os.path.join(tablet['host'], 'restore-bench-cleanup-%s.sh' % tablet['unique_id']),
+                                 self.instance_header(tablet) + 'rm -rf $VTDATAROOT/$TABLET_DIR\n')
+        self.run_on_host(tablet, cleanup)
+
+    def benchmark_restore(self):
+        """Measures time-to-serving of a new tablet restored from the latest backup of each shard."""
+        shards = self.shard_sets[-1] if self.shard_sets else self.shards
+        results = []
+        for i, shard in enumerate(shards):
+            name, size = latest_backup(KEYSPACE, shard)
+            if name is None:
+                print 'WARNING: No backup of shard "%s" under %s, run the backup action first.' % (shard, BACKUP_DIR)
+                continue
+            tablet = self.restore_tablet(shard, i)
+            print 'Restoring %s (%s bytes) into throwaway tablet %s on %s' % (name, size, tablet['alias'], tablet['host'])
+            try:
+                mysqld_seconds, seconds = self.benchmark_one_restore(tablet)
+            finally:
+                self.remove_restore_tablet(tablet)
+            results.append(dict(time=time.time(), keyspace=KEYSPACE, shard=shard, backup=name, bytes=size,
+                                host=tablet['host'], mysqld_seconds=mysqld_seconds, seconds=seconds))
+        if not results:
+            return
+        log_dir = os.path.join(DEPLOYMENT_DIR, 'log')
+        if not os.path.exists(log_dir):
+            os.makedirs(log_dir)
+        with open(os.path.join(log_dir, 'restores.jsonl'), 'a') as fh:
+            for result in results:
+                fh.write(json.dumps(result) + '\n')
+        print
+        print '%-12s %14s %12s %18s %10s' % ('shard', 'backup bytes', 'mysqld(s)', 'time to serve(s)', 'MB/s')
+        for r in results:
+            serve = '%.1f' % r['seconds'] if r['seconds'] is not None else 'TIMEOUT'
+            rate = '%.1f' % (r['bytes'] / r['seconds'] / 1e6) if r['bytes'] and r['seconds'] else '-'
+            print '%-12s %14s %12.1f %18s %10s' % (r['shard'], r['bytes'], r['mysqld_seconds'], serve, rate)
+        print 'Restore results appended to: %s' % os.path.join(log_dir, 'restores.jsonl')
+
+    def shard_master(self, shard):
+        """Returns the alias of the master of a shard in the topology, None if there is none or vtctld does not answer."""
+        try:
+            out = subprocess.check_output(self.vtctl_command('GetShard', '%s/%s' % (KEYSPACE, shard)))
+            alias = json.loads(out).get('master_alias')
+        except (subprocess.CalledProcessError, ValueError, OSError):
+            return None
+        if not alias:
+            return None
+        return '%s-%010d' % (alias['cell'], alias['uid'])
+
+    def failover_drill(self):
+        """Kills the master mysqld of a shard and times the failover Orchestrator runs.
+
+        The mysqld is killed with SIGKILL after its down file is written, so a
+        supervisor does not bring it back, and so is the mysqld_safe that
+        would restart it. While the kill script checks that the mysqld stays
+        down, the drill already waits for vtctld to report another master,
+        then for that tablet to serve as master. Both times count from the
+        start of the kill, the stay-down check is reported on its own.
+        """
+        shards = self.shard_sets[-1] if self.shard_sets else self.shards
+        shard = args.drill_shard or shards[0]
+        tablets = dict((t['alias'], t) for t in self.tablets if t['shard'] == shard)
+        old_master = self.shard_master(shard)
+        if old_master not in tablets:
+            print >> sys.stderr, 'ERROR: No master of shard "%s" found with: %s' % (
+                shard, ' '.join(self.vtctl_command('GetShard', '%s/%s' % (KEYSPACE, shard))))
+            sys.exit(1)
+        tablet = tablets[old_master]
+        kill = write_bin_file(os.path.join(tablet['host'], 'failover-drill-kill-%s.sh' % tablet['unique_id']),
+                              self.instance_header(tablet) + FAILOVER_DRILL_KILL)
+        print 'Killing mysqld of master %s of shard %s on %s' % (old_master, shard, tablet['host'])
+        start = time.time()
+        # Orchestrator starts recovering right after the kill, before the stay-down check ends.
+        kill_proc = subprocess.Popen([make_run_script_file(), tablet['host'], kill])
+        killed = new_master = reparented = serving = None
+        while time.time() - start < args.drill_timeout:
+            if killed is None and kill_proc.poll() is not None:
+                if kill_proc.returncode != 0:
+                    print >> sys.stderr, 'ERROR: Could not kill the mysqld of %s, or it was started again.' % old_master
+                    sys.exit(1)
+                killed = time.time()
+            if reparented is None:
+                master = self.shard_master(shard)
+                if master is not None and master != old_master:
+                    new_master, reparented = master, time.time()
+            if reparented is not None and serving is None and new_master in tablets:
+                dvars = fetch_vars((tablets[new_master], 1))
+                if (dvars is not None and str(dvars.get('TabletType')).lower() == 'master' and
+                        dvars.get('TabletStateName') == 'SERVING'):
+                    serving = time.time()
+            if serving is not None and killed is not None:
+                break
+            time.sleep(args.drill_interval)
+        if killed is None:
+            if kill_proc.wait() != 0:
+                print >> sys.stderr, 'ERROR: Could not kill the mysqld of %s, or it was started again.' % old_master
+                sys.exit(1)
+            killed = time.time()
+        result = dict(time=start, keyspace=KEYSPACE, shard=shard, old_master=old_master, new_master=new_master,
+                      kill_seconds=killed - start,
+                      reparent_seconds=reparented - start if reparented else None,
+                      serving_seconds=serving - start if serving else None)
+        log_dir = os.path.join(DEPLOYMENT_DIR, 'log')
+        if not os.path.exists(log_dir):
+            os.makedirs(log_dir)
+        with open(os.path.join(log_dir, 'failover_drills.jsonl'), 'a') as fh:
+            fh.write(json.dumps(result) + '\n')
+        print
+        print '%-12s %-20s %-20s %14s %14s %14s' % (
+            'shard', 'old master', 'new master', 'kill check(s)', 'reparented(s)', 'serving(s)')
+        print '%-12s %-20s %-20s %14.1f %14s %14s' % (
+            shard, old_master, new_master or '-', result['kill_seconds'],
+            '%.1f' % result['reparent_seconds'] if reparented else 'TIMEOUT',
+            '%.1f' % result['serving_seconds'] if serving else 'TIMEOUT')
+        print 'Drill result appended to: %s' % os.path.join(log_dir, 'failover_drills.jsonl')
+        print 'The mysqld of the old master stays down, start it again with: %s' % (
+            self.mysqld.write_instance_script(tablet, tablet['host'], 'up'))
+        if serving is None:
+            print >> sys.stderr, 'ERROR: No new master served within %ds.' % args.drill_timeout
+            sys.exit(1)
+
+# Kills the mysqld of a tablet for failover_drill and checks it stays down.
+FAILOVER_DRILL_KILL = """
+touch $VTDATAROOT/$TABLET_DIR/mysqld.down
+# mysqld_safe restarts a mysqld that dies, so it goes first.
+pkill -9 -f "mysqld_safe.*--defaults-file=$VTDATAROOT/$TABLET_DIR/my.cnf"
+kill -9 `cat $VTDATAROOT/$TABLET_DIR/mysql.pid`
+for i in 1 2 3; do
+    sleep 1
+    if pgrep -f -- "--defaults-file=$VTDATAROOT/$TABLET_DIR/my.cnf" > /dev/null; then
+        echo "The mysqld of tablet $ALIAS is running again."
+        exit 1
+    fi
+done
+"""
+
+# Unique ids of the throwaway tablets of benchmark_restore, far above the ids of regular tablets.
+RESTORE_BENCH_UID_BASE = 900000
+
+def latest_backup(keyspace, shard):
+    """Returns the name and size in bytes of the newest file backup of a shard, (None, None) if there is none."""
+    shard_dir = os.path.join(BACKUP_DIR, keyspace, shard)
+    if not os.path.isdir(shard_dir):
+        return None, None
+    # Backup names end in a sortable timestamp and the tablet alias: 2017-01-01.120000.cell-0000000102
+    names = sorted(os.listdir(shard_dir), key=lambda n: n.rsplit('.', 1)[0])
+    if not names:
+        return None, None
+    size = 0
+    for dirpath, _, filenames in os.walk(os.path.join(shard_dir, names[-1])):
+        size += sum(os.path.getsize(os.path.join(dirpath, f)) for f in filenames)
+    return names[-1], size
+
 def get_public_hostname():
     fqdn = socket.getfqdn()
     # If we are on aws, use the public address.
@@ -1296,7 +2569,8 @@ class DbConnectionTypes(ConfigType):
         for fname in ('vschema.json', 'database_schema.sql'):
             out = read_template(fname)
             write_dep_file('config', fname, out)
-        for fname in ('client.sh', 'client_grpc.py', 'client_mysql.py'):
+        for fname in ('client.sh', 'client_grpc.py', 'client_mysql.py', 'client_lib.py', 'compare_results.py',
+                      'generate_dataset.py', 'wait_for_lag.py', 'vtgate_scaling.py'):
             out = read_template(fname)
             write_bin_file(fname, out)
 
@@ -1391,13 +2665,15 @@ GRANT SELECT, INSERT, UPDATE, DELETE, CREATE, DROP, RELOAD, PROCESS, FILE, REFER
 
 """ % locals()
 
+        orc_user = ORC_MYSQL_USER
+        orc_password = ORC_MYSQL_PASSWORD
         footer = """
 # User for Orchestrator (https://github.com/github/orchestrator).
-CREATE USER IF NOT EXISTS 'orc_client_user' IDENTIFIED BY 'orc_client_user_password';
+CREATE USER IF NOT EXISTS '%(orc_user)s' IDENTIFIED BY '%(orc_password)s';
 GRANT SUPER, PROCESS, REPLICATION SLAVE, RELOAD
-  ON *.* TO 'orc_client_user'@'%%';
+  ON *.* TO '%(orc_user)s'@'%%';
 GRANT SELECT
-  ON %(sidecar_dbname)s.* TO 'orc_client_user'@'%%';
+  ON %(sidecar_dbname)s.* TO '%(orc_user)s'@'%%';
 
 FLUSH PRIVILEGES;
 
@@ -1428,8 +2704,10 @@ FLUSH PRIVILEGES;
 
         return header + '\n'.join(out) + footer
 
-ACTION_CHOICES = [ 'generate', 'start', 'stop', 'run_demo']
-COMPONENT_CHOICES = ['lockserver', 'vtctld', 'vttablet', 'vtgate', 'all']
+ACTION_CHOICES = [ 'generate', 'start', 'stop', 'run_demo', 'summarize_events', 'status', 'collect_logs', 'analyze_logs',
+                   'backup', 'benchmark_restore', 'inventory',
+                   'workload', 'failover_drill']
+COMPONENT_CHOICES = ['lockserver', 'vtctld', 'orchestrator', 'vttablet', 'vtgate', 'supervisor', 'all']
 
 def define_args():
     ap = argparse.ArgumentParser('Vitess Cluster Management helper.')
@@ -1452,6 +2730,22 @@ def define_args():
                     default=False, const=True,
                     help='Generate scripts that work with a RDS')
 
+    ap.add_argument('--golden-datadir', type=str2bool, nargs='?',
+                    default=True, const=True,
+                    help='Initialize new mysqld instances by copying a data dir initialized once per host.')
+
+    ap.add_argument('--separate-binlogs', type=str2bool, nargs='?',
+                    default=True, const=True,
+                    help='On hosts with several data volumes, put binlogs on another volume than the tablet data.')
+
+    ap.add_argument('--isolation', choices=['none', 'systemd', 'cgroup'], default='none',
+                    help='Run each mysqld and vttablet in a cgroup with CPU and memory limits sized '
+                    'from the host inventory, through systemd-run scopes or cgroup v2 directly.')
+
+    ap.add_argument('--numa', type=str2bool, nargs='?',
+                    default=False, const=True,
+                    help='With --isolation, keep the CPUs and memory of each tablet on one NUMA node.')
+
     ap.add_argument('--use-config-without-prompt', type=str2bool, nargs='?',
                     default=False, const=True,
                     help='If we find a config, use it without asking.')
@@ -1466,9 +2760,83 @@ def define_args():
 
     ap.add_argument('--vtctld-addr',
                     help='Specify vtctld-addr (useful in non-interactive mode).')
+
+    ap.add_argument('--profile', nargs='?', const='', default=None, metavar='TRACE_FILE',
+                    help='Time each phase, component and remote host, print a summary and write a JSON trace '
+                    '(default: DEPLOYMENT_DIR/profile.json).')
+
+    ap.add_argument('--cprofile', metavar='STATS_FILE',
+                    help='Also run under cProfile and write pstats output to this file, implies --profile.')
+
+    ap.add_argument('--event-log', metavar='EVENT_LOG',
+                    help='Event log of remote commands (default: DEPLOYMENT_DIR/log/events.jsonl).')
+
+    ap.add_argument('--run-id',
+                    help='With summarize_events, only summarize this run, "all" for every run (default: the last run).')
+
+    ap.add_argument('--top', type=int, default=10,
+                    help='With summarize_events and status, number of rows to list per table.')
+
+    ap.add_argument('--status-interval', type=float, default=2,
+                    help='With status, seconds between refreshes.')
+
+    ap.add_argument('--status-count', type=int, default=0,
+                    help='With status, stop after this many refreshes, 0 runs until interrupted.')
+
+    ap.add_argument('--status-concurrency', type=int, default=32,
+                    help='With status, number of /debug/vars pages fetched at the same time.')
+
+    ap.add_argument('--status-timeout', type=float, default=1,
+                    help='With status, timeout in seconds of each /debug/vars fetch.')
+
+    ap.add_argument('--since',
+                    help='With collect_logs and analyze_logs, start of the time window, either relative '
+                    '("30m", "2h", "1d") or "YYYY-mm-dd HH:MM[:SS]".')
+
+    ap.add_argument('--until',
+                    help='With collect_logs and analyze_logs, end of the time window, same format as --since.')
+
+    ap.add_argument('--log-dir',
+                    help='With analyze_logs, directory of collected logs (default: the newest under DEPLOYMENT_DIR/logs).')
+
+    ap.add_argument('--collect-concurrency', type=int, default=16,
+                    help='With collect_logs and inventory, number of hosts contacted at the same time.')
+
+    ap.add_argument('--data-volumes', metavar='PATHS',
+                    help='With inventory, comma separated mount points tablet data and binlogs are spread over.')
+
+    ap.add_argument('--expected-qps', type=int, nargs=2, metavar=('READ_QPS', 'WRITE_QPS'),
+                    help='With workload, expected peak reads and writes per second of each shard.')
+
+    ap.add_argument('--workload-results', metavar='RESULTS_FILE',
+                    help='With workload, take the peak load of each shard from a client --results file.')
+
+    ap.add_argument('--backup-concurrency', type=int, default=2,
+                    help='With backup, number of shards backed up at the same time.')
+
+    ap.add_argument('--backup-file-concurrency', type=int, default=4,
+                    help='With backup, files copied at the same time by each backup.')
+
+    ap.add_argument('--restore-host',
+                    help='With benchmark_restore, host of the throwaway tablets (default: this host).')
+
+    ap.add_argument('--restore-base-port', type=int, default=29000,
+                    help='With benchmark_restore, first of the web, grpc and mysql ports of the throwaway tablets.')
+
+    ap.add_argument('--restore-timeout', type=int, default=3600,
+                    help='With benchmark_restore, seconds to wait for a throwaway tablet to serve.')
+
+    ap.add_argument('--drill-shard',
+                    help='With failover_drill, shard whose master is killed (default: the first shard).')
+
+    ap.add_argument('--drill-timeout', type=int, default=300,
+                    help='With failover_drill, seconds to wait for a new master to serve.')
+
+    ap.add_argument('--drill-interval', type=float, default=0.2,
+                    help='With failover_drill, seconds between checks of the shard master.')
     return ap
 
-def create_start_cluster(vtctld_host, vtgate_host, tablets, dbname):
+def create_start_cluster(vtctld_host, vtgates, tablets, dbname):
     cell = CELL
     keyspace = KEYSPACE
     deployment_dir = DEPLOYMENT_DIR
@@ -1480,6 +2848,8 @@ def create_start_cluster(vtctld_host, vtgate_host, tablets, dbname):
         l = '\tAccess tablet %(alias)s at http://%(host)s:%(web_port)s/debug/status' % locals()
         tlines.append(l)
     tablet_urls = '\n'.join(tlines)
+    vtgate_urls = '\n'.join('\tAccess vtgate %(name)s at http://%(host)s:%(web_port)s/debug/status' % v
+                            for v in vtgates)
     write_bin_file('start_cluster.sh', read_template('start_cluster.sh') % locals())
 
 def create_destroy_cluster():
@@ -1532,25 +2902,80 @@ def main():
         components = COMPONENT_CHOICES
         components.remove('all')
 
+    global profiler
+    cprofiler = None
+    if args.profile is not None or args.cprofile:
+        profiler = Profiler()
+        if args.cprofile:
+            cprofiler = cProfile.Profile()
+            cprofiler.enable()
+    try:
+        run_actions(actions, components)
+    finally:
+        # Also when an action exits early, so the profile is kept and the timing file removed.
+        if profiler is not None:
+            finish_profile(cprofiler)
+
+def run_actions(actions, components):
+    if 'summarize_events' in actions:
+        check_host()
+        summarize_events(args.event_log or get_event_log(), args.run_id, args.top)
+        return
+    if 'status' in actions:
+        check_host()
+        show_status(os.path.join(DEPLOYMENT_DIR, 'config'))
+        return
+    if 'workload' in actions:
+        check_host()
+        set_workload(os.path.join(DEPLOYMENT_DIR, 'config'))
+        return
+    if 'inventory' in actions:
+        check_host()
+        HostInventory().probe(load_config_hosts(os.path.join(DEPLOYMENT_DIR, 'config')))
+        return
+    if 'collect_logs' in actions or 'analyze_logs' in actions:
+        check_host()
+        since = parse_log_time(args.since)
+        until = parse_log_time(args.until)
+        log_dir = args.log_dir
+        if 'collect_logs' in actions:
+            log_dir = collect_logs(os.path.join(DEPLOYMENT_DIR, 'config'), since, args.collect_concurrency)
+        analyze_logs(log_dir or latest_log_dir(), since, until, args.top)
+        return
+
     print 'Will perform the action[s]: %s' % ' '.join(['"%s"' % a for a in actions])
     print 'On component[s]: %s' % ' '.join(['"%s"' % c for c in components])
     print
-    public_hostname = get_public_hostname()
-    check_host()
+    with profile_phase('hostname_lookup'):
+        public_hostname = get_public_hostname()
+    with profile_phase('check_host'):
+        check_host()
+    # Tags the events run_script_on_host.sh logs for this invocation.
+    os.environ[EVENT_LOG_ENV] = args.event_log or get_event_log()
+    os.environ[RUN_ID_ENV] = time.strftime('%Y%m%d-%H%M%S-') + str(os.getpid())
     c_instances = {}
-    c_instances['lockserver'] = LockServer()
-    if 'vtctld' in components or 'vttablet' in components:
-        c_instances['vtctld'] = VtCtld(public_hostname, c_instances['lockserver'])
+    with profile_phase('config:lockserver', component='lockserver'):
+        c_instances['lockserver'] = LockServer()
+    if 'vtctld' in components or 'vttablet' in components or 'orchestrator' in components:
+        with profile_phase('config:vtctld', component='vtctld'):
+            c_instances['vtctld'] = VtCtld(public_hostname, c_instances['lockserver'])
+    if 'orchestrator' in components:
+        with profile_phase('config:orchestrator', component='orchestrator'):
+            c_instances['orchestrator'] = Orchestrator(public_hostname, c_instances['vtctld'])
     if 'vtgate' in components:
-        c_instances['vtgate'] = VtGate(public_hostname, c_instances['lockserver'])
+        with profile_phase('config:vtgate', component='vtgate'):
+            c_instances['vtgate'] = VtGate(public_hostname, c_instances['lockserver'])
     if 'vttablet' in components:
-        c_instances['vttablet'] = VtTablet(public_hostname, c_instances['lockserver'], c_instances['vtctld'])
+        with profile_phase('config:vttablet', component='vttablet'):
+            c_instances['vttablet'] = VtTablet(public_hostname, c_instances['lockserver'], c_instances['vtctld'])
         global MYSQL_AUTH_PARAM
         MYSQL_AUTH_PARAM = c_instances['vttablet'].dbconfig.get_mysql_auth_param()
+    if 'supervisor' in components:
+        c_instances['supervisor'] = Supervisor()
     # TODO: sort actions
     # TODO: sort components
     for action in actions:
-        if action == 'run_demo':
+        if action in ('run_demo', 'backup', 'benchmark_restore', 'failover_drill'):
             continue
         if action == 'generate':
             print
@@ -1559,11 +2984,555 @@ def main():
         for component in components:
             c_instances[component].run_action(action)
 
+    for action in ('backup', 'benchmark_restore', 'failover_drill'):
+        if action not in actions:
+            continue
+        if 'vttablet' not in c_instances:
+            print >> sys.stderr, 'ERROR: %s needs the vttablet component.' % action
+            sys.exit(1)
+        with profile_phase(action, component='vttablet'):
+            if action == 'backup':
+                c_instances['vttablet'].backup()
+            elif action == 'benchmark_restore':
+                c_instances['vttablet'].benchmark_restore()
+            else:
+                c_instances['vttablet'].failover_drill()
+
     if 'run_demo' in actions:
+        with profile_phase('run_demo'):
             run_demo(c_instances['lockserver'], c_instances['vtctld'], c_instances['vtgate'], c_instances['vttablet'])
 
+def finish_profile(cprofiler):
+    profiler.read_remote_timings()
+    profiler.print_summary()
+    # DEPLOYMENT_DIR is unknown when check_host exited.
+    trace_file = args.profile or (DEPLOYMENT_DIR and os.path.join(DEPLOYMENT_DIR, 'profile.json'))
+    if trace_file:
+        profiler.write_trace(trace_file)
+    if cprofiler is not None:
+        cprofiler.disable()
+        cprofiler.dump_stats(args.cprofile)
+        print 'cProfile stats written to: %s' % args.cprofile
+        pstats.Stats(cprofiler).sort_stats('cumulative').print_stats(20)
+
+EVENT_LOG_ENV = 'DEPLOYMENT_HELPER_EVENT_LOG'
+RUN_ID_ENV = 'DEPLOYMENT_HELPER_RUN_ID'
+
+def get_event_log():
+    return os.path.join(DEPLOYMENT_DIR, 'log', 'events.jsonl')
+
+def read_events(event_log):
+    events = []
+    with open(event_log) as fh:
+        for line in fh:
+            try:
+                event = json.loads(line)
+            except ValueError:
+                # A run killed mid write can leave a partial line behind.
+                continue
+            event['duration'] = event['end'] - event['start']
+            events.append(event)
+    return events
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(int(len(values) * p), len(values) - 1)]
+
+def summarize_events(event_log, run_id, top):
+    """Prints the slowest hosts and commands and where failures cluster."""
+    if not os.path.exists(event_log):
+        print >> sys.stderr, 'ERROR: No event log at: %s' % event_log
+        sys.exit(1)
+    events = read_events(event_log)
+    run_ids = []
+    for e in events:
+        if e['run_id'] not in run_ids:
+            run_ids.append(e['run_id'])
+    if run_id is None and run_ids:
+        run_id = run_ids[-1]
+    if run_id != 'all':
+        events = [e for e in events if e['run_id'] == run_id]
+    if not events:
+        print 'No events for run "%s" in %s, runs: %s' % (run_id, event_log, ' '.join(run_ids))
+        return
+    failed = [e for e in events if e['exit_code'] != 0]
+    span = max(e['end'] for e in events) - min(e['start'] for e in events)
+    print 'Run: %s (%d runs in %s)' % (run_id, len(run_ids), event_log)
+    print '%d commands on %d hosts in %.1fs, %d failed (%d ssh), %d bytes copied' % (
+        len(events), len(set(e['host'] for e in events)), span, len(failed),
+        len([e for e in failed if e['ssh_failed']]), sum(e['bytes'] for e in events))
+
+    print
+    print 'By component and command:'
+    print '%-24s %8s %8s %10s %10s %10s' % ('command', 'count', 'failed', 'p50(s)', 'p99(s)', 'max(s)')
+    groups = {}
+    for e in events:
+        groups.setdefault('%s %s' % (e['component'], e['command']), []).append(e)
+    for name, group in sorted(groups.iteritems()):
+        durations = [e['duration'] for e in group]
+        print '%-24s %8d %8d %10.3f %10.3f %10.3f' % (
+            name, len(group), len([e for e in group if e['exit_code'] != 0]),
+            percentile(durations, 0.5), percentile(durations, 0.99), max(durations))
+
+    hosts = {}
+    for e in events:
+        hosts.setdefault(e['host'], []).append(e)
+    print
+    print 'Slowest hosts:'
+    print '%-40s %8s %10s %10s %8s' % ('host', 'count', 'total(s)', 'max(s)', 'failed')
+    by_total = sorted(hosts.iteritems(), key=lambda kv: -sum(e['duration'] for e in kv[1]))
+    for host, group in by_total[:top]:
+        print '%-40s %8d %10.3f %10.3f %8d' % (
+            host, len(group), sum(e['duration'] for e in group), max(e['duration'] for e in group),
+            len([e for e in group if e['exit_code'] != 0]))
+
+    print
+    print 'Slowest commands:'
+    for e in sorted(events, key=lambda e: -e['duration'])[:top]:
+        print '%10.3fs  exit=%-3d %-40s %s' % (e['duration'], e['exit_code'], e['host'], e['script'])
+
+    if not failed:
+        return
+    print
+    print 'Failure hotspots:'
+    hotspots = {}
+    for e in failed:
+        reason = 'ssh' if e['ssh_failed'] else 'exit=%d' % e['exit_code']
+        hotspots.setdefault((e['host'], reason), []).append(e)
+    for (host, reason), group in sorted(hotspots.iteritems(), key=lambda kv: -len(kv[1]))[:top]:
+        components = sorted(set('%s %s' % (e['component'], e['command']) for e in group))
+        print '%-40s %-8s %6d  %s' % (host, reason, len(group), ', '.join(components))
+
+# Timings var with the query counts and times of each kind of process.
+STATUS_TIMINGS_VAR = dict(vttablet='Queries', vtgate='VtgateApi')
+STATUS_ERRORS_VAR = dict(vttablet='Errors', vtgate='VtgateApiErrorCounts')
+STATUS_POOLS = ['ConnPool', 'StreamConnPool', 'TransactionPool']
+
+def load_status_targets(config_dir):
+    """Returns a dict of kind, host, web_port and shard for every tablet and vtgate in the config."""
+    targets = []
+    vttablet_config = os.path.join(config_dir, 'vttablet.json')
+    if os.path.exists(vttablet_config):
+        with open(vttablet_config) as fh:
+            for t in json.load(fh).get('tablets', []):
+                targets.append(dict(kind='vttablet', host=t['host'], web_port=t['web_port'],
+                                    shard=t['shard'], name=t['alias'], ttype=t['ttype']))
+    vtgate_config = os.path.join(config_dir, 'vtgate.json')
+    if os.path.exists(vtgate_config):
+        with open(vtgate_config) as fh:
+            config = json.load(fh)
+        for host in sorted(set(config.get('configured_hosts') or [config['hostname']])):
+            for index in xrange(config.get('instances_per_host', 1)):
+                targets.append(dict(kind='vtgate', host=host, web_port=config['ports']['web_port'] + index,
+                                    shard=None, name='vtgate-%d@%s' % (index, host), ttype=None))
+    return targets
+
+def fetch_vars(target_and_timeout):
+    target, timeout = target_and_timeout
+    url = 'http://%s:%s/debug/vars' % (target['host'], target['web_port'])
+    try:
+        return json.load(urllib2.urlopen(url, timeout=timeout))
+    except Exception:
+        return None
+
+def sum_counters(value):
+    if isinstance(value, dict):
+        return sum(sum_counters(v) for v in value.itervalues())
+    if isinstance(value, (int, long, float)):
+        return value
+    return 0
+
+class StatusCollector(object):
+    """Scrapes /debug/vars of all targets concurrently and turns counters into rates."""
+
+    def __init__(self, targets, concurrency, timeout):
+        self.targets = targets
+        self.timeout = timeout
+        self.pool = ThreadPool(max(1, min(concurrency, len(targets))))
+        self.last = {}
+
+    def scrape(self):
+        """Returns one sample per target, rates are None until a target was scraped twice."""
+        now = time.time()
+        results = self.pool.map(fetch_vars, [(t, self.timeout) for t in self.targets])
+        samples = []
+        for target, dvars in zip(self.targets, results):
+            sample = dict(target, up=dvars is not None, queries=None, query_time=None, errors=None,
+                          elapsed=None, pool_use=None, lag=None)
+            samples.append(sample)
+            if dvars is None:
+                self.last.pop(target['name'], None)
+                continue
+            timings = dvars.get(STATUS_TIMINGS_VAR[target['kind']]) or {}
+            counters = (now, timings.get('TotalCount', 0), timings.get('TotalTime', 0),
+                        sum_counters(dvars.get(STATUS_ERRORS_VAR[target['kind']])))
+            last = self.last.get(target['name'])
+            self.last[target['name']] = counters
+            if last is not None:
+                sample['elapsed'] = counters[0] - last[0]
+                sample['queries'] = counters[1] - last[1]
+                sample['query_time'] = (counters[2] - last[2]) / 1e9
+                sample['errors'] = counters[3] - last[3]
+            for pool in STATUS_POOLS:
+                capacity = dvars.get(pool + 'Capacity')
+                if capacity:
+                    use = (capacity - dvars.get(pool + 'Available', capacity)) / float(capacity)
+                    if sample['pool_use'] is None or use > sample['pool_use'][0]:
+                        sample['pool_use'] = (use, pool)
+            if target['ttype'] not in (None, 'master') and 'SecondsBehindMaster' in dvars:
+                sample['lag'] = dvars['SecondsBehindMaster']
+        return samples
+
+def aggregate_samples(samples, key):
+    """Sums rates and takes the worst pool use and lag of the samples per key."""
+    groups = {}
+    for sample in samples:
+        group = groups.setdefault(sample[key], dict(count=0, down=0, qps=0.0, queries=0, query_time=0.0,
+                                                    errors=0.0, pool_use=None, lag=None))
+        group['count'] += 1
+        if not sample['up']:
+            group['down'] += 1
+            continue
+        if sample['elapsed']:
+            group['qps'] += sample['queries'] / sample['elapsed']
+            group['errors'] += sample['errors'] / sample['elapsed']
+            group['queries'] += sample['queries']
+            group['query_time'] += sample['query_time']
+        if sample['pool_use'] is not None and (group['pool_use'] is None or sample['pool_use'] > group['pool_use']):
+            group['pool_use'] = sample['pool_use']
+        if sample['lag'] is not None:
+            group['lag'] = max(group['lag'], sample['lag'])
+    return groups
+
+def print_status_table(title, groups, top):
+    print
+    print '%-40s %5s %5s %10s %9s %8s %22s %7s' % (title, 'n', 'down', 'qps', 'lat(ms)', 'err/s', 'busiest pool', 'lag(s)')
+    for name, g in sorted(groups.iteritems(), key=lambda kv: -kv[1]['qps'])[:top]:
+        latency = '%.2f' % (g['query_time'] / g['queries'] * 1000) if g['queries'] else '-'
+        pool = '%s %3.0f%%' % (g['pool_use'][1], g['pool_use'][0] * 100) if g['pool_use'] else '-'
+        lag = '%d' % g['lag'] if g['lag'] is not None else '-'
+        print '%-40s %5d %5d %10.1f %9s %8.1f %22s %7s' % (
+            name, g['count'], g['down'], g['qps'], latency, g['errors'], pool, lag)
+    if len(groups) > top:
+        print '... %d more' % (len(groups) - top)
+
+def show_status(config_dir):
+    """Prints a refreshing per shard, per host and per vtgate view of the cluster."""
+    targets = load_status_targets(config_dir)
+    if not targets:
+        print >> sys.stderr, 'ERROR: No tablets or vtgates configured under: %s' % config_dir
+        sys.exit(1)
+    collector = StatusCollector(targets, args.status_concurrency, args.status_timeout)
+    collector.scrape()
+    refreshes = 0
+    try:
+        while not args.status_count or refreshes < args.status_count:
+            time.sleep(args.status_interval)
+            samples = collector.scrape()
+            refreshes += 1
+            if sys.stdout.isatty():
+                sys.stdout.write('\033[H\033[2J')
+            down = len([s for s in samples if not s['up']])
+            print 'Cluster status at %s, %d tablets and vtgates, %d unreachable, every %ss' % (
+                time.strftime('%H:%M:%S'), len(samples), down, args.status_interval)
+            tablets = [s for s in samples if s['kind'] == 'vttablet']
+            vtgates = [s for s in samples if s['kind'] == 'vtgate']
+            if tablets:
+                print_status_table('shard', aggregate_samples(tablets, 'shard'), args.top)
+            if vtgates:
+                print_status_table('vtgate', aggregate_samples(vtgates, 'name'), args.top)
+            print_status_table('host', aggregate_samples(samples, 'host'), args.top)
+            sys.stdout.flush()
+    except KeyboardInterrupt:
+        print
+
+def set_workload(config_dir):
+    """Stores the expected load per shard that vttablet pools are sized for on the next generate."""
+    workload = Workload()
+    if args.expected_qps:
+        workload.default = dict(read_qps=args.expected_qps[0], write_qps=args.expected_qps[1])
+        workload.shards = {}
+    if args.workload_results:
+        with open(os.path.join(config_dir, 'vttablet.json')) as fh:
+            config = json.load(fh)
+        shard_sets = config.get('shard_sets') or [config.get('shards', ['0'])]
+        workload.set_from_results(args.workload_results, shard_sets[-1])
+    if args.expected_qps or args.workload_results:
+        workload.write_config()
+        print 'Workload written to: %s' % workload.get_config_file()
+    print '%-12s %10s %10s' % ('shard', 'reads/s', 'writes/s')
+    print '%-12s %10d %10d' % ('default', workload.default['read_qps'], workload.default['write_qps'])
+    for shard, load in sorted(workload.shards.iteritems()):
+        print '%-12s %10d %10d' % (shard, load['read_qps'], load['write_qps'])
+    print 'Latency: reads %.1fms, writes %.1fms, replica read share %.0f%%' % (
+        workload.read_latency * 1000, workload.write_latency * 1000, workload.replica_read_share * 100)
+
+SSH_OPTS = ['-q', '-o', 'StrictHostKeyChecking=no', '-o', 'UserKnownHostsFile=/dev/null', '-o', 'ConnectTimeout=10']
+
+def load_config_hosts(config_dir):
+    """Returns every host named in the lockserver, vtctld, vtgate and vttablet configs."""
+    hosts = set()
+    for name in ['zk2', 'vtctld', 'vtgate', 'vttablet']:
+        config_file = os.path.join(config_dir, '%s.json' % name)
+        if not os.path.exists(config_file):
+            continue
+        with open(config_file) as fh:
+            config = json.load(fh)
+        hosts.update(config.get('hosts', []))
+        hosts.update(config.get('configured_hosts', []))
+        for t in config.get('tablets', []):
+            hosts.update([t['host'], t.get('mysql_host', t['host'])])
+    return sorted(hosts)
+
+def is_local_host(host):
+    return host in ('localhost', '127.0.0.1', socket.gethostname(), socket.getfqdn(), get_public_hostname())
+
+def parse_log_time(value):
+    """Turns "30m", "2h", "1d" or "YYYY-mm-dd HH:MM[:SS]" into a unix time, None stays None."""
+    if value is None:
+        return None
+    units = dict(s=1, m=60, h=3600, d=86400)
+    if value[-1:] in units and value[:-1].isdigit():
+        return time.time() - int(value[:-1]) * units[value[-1]]
+    for fmt in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M'):
+        try:
+            return time.mktime(time.strptime(value, fmt))
+        except ValueError:
+            pass
+    print >> sys.stderr, 'ERROR: Can not parse time: %s' % value
+    sys.exit(1)
+
+def collect_host_logs(host_since_out):
+    """Streams the logs of a host into a tar.gz file, returns (host, exit code, bytes, seconds)."""
+    host, since, out_file = host_since_out
+    # Logs live in $VTDATAROOT/tmp and in the tablet and vtgate dirs, skip the mysql data files below those.
+    cmd = "cd %s && find tmp vt_* vtgate_* -maxdepth 1 -type f \\( -name '*.out' -o -name '*.log' -o -name '*.log.*' \\)" % VTDATAROOT
+    if since is not None:
+        cmd += " -newermt '%s'" % time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(since))
+    cmd += ' -print0 2>/dev/null | tar czf - --null -T -'
+    if is_local_host(host):
+        argv = ['bash', '-c', cmd]
+    else:
+        argv = ['ssh'] + SSH_OPTS + [host, '--', cmd]
+    start = time.time()
+    with open(out_file, 'w') as fh:
+        exit_code = subprocess.call(argv, stdout=fh)
+    return host, exit_code, os.path.getsize(out_file), time.time() - start
+
+def collect_logs(config_dir, since, concurrency):
+    """Copies the logs of all configured hosts in parallel, returns the directory holding them."""
+    hosts = load_config_hosts(config_dir)
+    if not hosts:
+        print >> sys.stderr, 'ERROR: No hosts configured under: %s' % config_dir
+        sys.exit(1)
+    log_dir = os.path.join(DEPLOYMENT_DIR, 'logs', time.strftime('%Y%m%d-%H%M%S'))
+    os.makedirs(log_dir)
+    print 'Collecting logs from %d hosts into: %s' % (len(hosts), log_dir)
+    pool = ThreadPool(max(1, min(concurrency, len(hosts))))
+    jobs = [(host, since, os.path.join(log_dir, '%s.tar.gz' % host)) for host in hosts]
+    failed = 0
+    for host, exit_code, size, seconds in pool.imap_unordered(collect_host_logs, jobs):
+        status = 'ok' if exit_code == 0 else 'FAILED exit=%d' % exit_code
+        print '\t%-40s %10d bytes %6.1fs  %s' % (host, size, seconds, status)
+        if exit_code != 0:
+            failed += 1
+    if failed:
+        print 'WARNING: Could not collect logs from %d hosts.' % failed
+    return log_dir
+
+def latest_log_dir():
+    logs_dir = os.path.join(DEPLOYMENT_DIR, 'logs')
+    collections = sorted(os.listdir(logs_dir)) if os.path.isdir(logs_dir) else []
+    if not collections:
+        print >> sys.stderr, 'ERROR: No collected logs under: %s, run collect_logs first.' % logs_dir
+        sys.exit(1)
+    return os.path.join(logs_dir, collections[-1])
+
+GLOG_LINE = re.compile(r'^([IWEF])(\d\d)(\d\d) (\d\d):(\d\d):(\d\d)\.\d+\s+\d+ (\S+:\d+)\] (.*)')
+GLOG_CREATED = re.compile(r'^Log file created at: (\d{4})/(\d\d)/(\d\d) (\d\d):(\d\d):(\d\d)')
+MYSQL_TIME = re.compile(r'^(?:# Time: )?(\d{4})-(\d\d)-(\d\d)([T ])(\d\d):(\d\d):(\d\d)[.\d]*(Z?)')
+SLOW_QUERY_TIME = re.compile(r'^# Query_time: ([\d.]+)')
+def mysql_log_time(m):
+    year, month, day, sep, hour, minute, second, utc = m.groups()
+    t = (int(year), int(month), int(day), int(hour), int(minute), int(second), 0, 0, -1)
+    # MySQL 5.7 logs in UTC by default ("...T10:00:00.000000Z"), older versions in local time.
+    return calendar.timegm(t) if utc else time.mktime(t)
+
+# Distinct error messages kept per analysis, so memory stays bounded on huge logs.
+MAX_LOG_MESSAGES = 10000
+
+class LogAnalyzer(object):
+    """Streams through log lines keeping only per source counters and the top entries."""
+
+    def __init__(self, since, until, top):
+        self.since = since
+        self.until = until
+        self.top = top
+        self.sources = {}
+        self.messages = {}
+        self.slow_queries = []
+        self.year = time.localtime().tm_year
+
+    def source(self, key):
+        return self.sources.setdefault(key, dict(errors=0, warnings=0, starts=0, crashes=0, slow=0))
+
+    def in_window(self, when):
+        if when is None:
+            return True
+        return (self.since is None or when >= self.since) and (self.until is None or when <= self.until)
+
+    def add_message(self, key, message):
+        message = re.sub(r'\d+', 'N', message)[:120]
+        if (key, message) in self.messages or len(self.messages) < MAX_LOG_MESSAGES:
+            self.messages[(key, message)] = self.messages.get((key, message), 0) + 1
+
+    def add_slow_query(self, query_time, key, query):
+        entry = (query_time, key, ' '.join(query)[:200])
+        if len(self.slow_queries) < self.top:
+            heapq.heappush(self.slow_queries, entry)
+        else:
+            heapq.heappushpop(self.slow_queries, entry)
+
+    def glog_time(self, month, day, hour, minute, second):
+        when = time.mktime((self.year, int(month), int(day), int(hour), int(minute), int(second), 0, 0, -1))
+        if when > time.time() + 86400:
+            # glog lines have no year, this one is from last year.
+            when = time.mktime((self.year - 1, int(month), int(day), int(hour), int(minute), int(second), 0, 0, -1))
+        return when
+
+    def add_glog(self, key, lines):
+        when = None
+        for line in lines:
+            m = GLOG_CREATED.match(line)
+            if m is not None:
+                created = time.mktime(tuple(int(g) for g in m.groups()) + (0, 0, -1))
+                if self.in_window(created):
+                    self.source(key)['starts'] += 1
+                continue
+            m = GLOG_LINE.match(line)
+            if m is None:
+                continue
+            level, month, day, hour, minute, second, where, message = m.groups()
+            when = self.glog_time(month, day, hour, minute, second)
+            if not self.in_window(when):
+                continue
+            if level in 'EF':
+                self.source(key)['errors'] += 1
+                self.add_message(key, '%s] %s' % (where, message))
+            elif level == 'W':
+                self.source(key)['warnings'] += 1
+
+    def add_out(self, key, lines, mtime=None):
+        # Stdout/stderr of a process, glog lines there are copies of the log files. A
+        # panic has no time of its own, it is dated by the glog line before it, else by
+        # the file, which the panic is the last write to.
+        when = None
+        for line in lines:
+            m = GLOG_LINE.match(line)
+            if m is not None:
+                when = self.glog_time(*m.groups()[1:6])
+            elif line.startswith('panic:') or line.startswith('fatal error:'):
+                if self.in_window(when if when is not None else mtime):
+                    self.source(key)['crashes'] += 1
+                    self.add_message(key, line.strip())
+
+    def add_mysqld_error_log(self, key, lines):
+        when = None
+        for line in lines:
+            m = MYSQL_TIME.match(line)
+            if m is not None:
+                when = mysql_log_time(m)
+            if not self.in_window(when):
+                continue
+            if 'ready for connections' in line:
+                self.source(key)['starts'] += 1
+            elif '[ERROR]' in line:
+                self.source(key)['errors'] += 1
+                self.add_message(key, line.split('[ERROR]', 1)[1].strip())
+
+    def add_slow_log(self, key, lines):
+        when = None
+        query_time = None
+        query = []
+        for line in lines:
+            if line.startswith('#'):
+                if query_time is not None and query and self.in_window(when):
+                    self.source(key)['slow'] += 1
+                    self.add_slow_query(query_time, key, query)
+                    query_time, query = None, []
+                m = MYSQL_TIME.match(line)
+                if m is not None:
+                    when = mysql_log_time(m)
+                m = SLOW_QUERY_TIME.match(line)
+                if m is not None:
+                    query_time = float(m.group(1))
+            elif query_time is not None and not line.startswith('SET timestamp=') and not line.startswith('use '):
+                query.append(line.strip())
+        if query_time is not None and query and self.in_window(when):
+            self.source(key)['slow'] += 1
+            self.add_slow_query(query_time, key, query)
+
+    def add_file(self, host, path, lines, mtime=None):
+        dirname, filename = os.path.split(path.lstrip('./'))
+        if dirname.startswith('vt_'):
+            key = '%s/%s' % (host, dirname)
+        else:
+            key = '%s/%s' % (host, filename.split('.')[0])
+        if '.log.' in filename:
+            # glog writes every line to the INFO file and copies to the WARNING/ERROR/FATAL ones.
+            if '.log.INFO.' in filename:
+                self.add_glog(key, lines)
+        elif filename.endswith('.out'):
+            self.add_out(key, lines, mtime)
+        elif filename == 'slow-query.log':
+            self.add_slow_log(key, lines)
+        elif filename.endswith('.log'):
+            self.add_mysqld_error_log(key, lines)
+
+    def add_archive(self, host, path):
+        # Stream mode reads the archive front to back without an index.
+        tar = tarfile.open(path, 'r|gz')
+        try:
+            for member in tar:
+                if member.isfile():
+                    self.add_file(host, member.name, tar.extractfile(member), member.mtime)
+        finally:
+            tar.close()
+
+    def print_report(self):
+        print
+        print 'Worst offenders:'
+        print '%-50s %8s %8s %8s %8s %8s' % ('source', 'crashes', 'starts', 'errors', 'warnings', 'slow')
+        ranked = sorted(self.sources.iteritems(),
+                        key=lambda kv: (-kv[1]['crashes'], -kv[1]['starts'], -kv[1]['errors'], -kv[1]['slow']))
+        for key, s in ranked[:self.top]:
+            print '%-50s %8d %8d %8d %8d %8d' % (key, s['crashes'], s['starts'], s['errors'], s['warnings'], s['slow'])
+        if self.messages:
+            print
+            print 'Most frequent errors:'
+            for (key, message), count in sorted(self.messages.iteritems(), key=lambda kv: -kv[1])[:self.top]:
+                print '%8d  %-40s %s' % (count, key, message)
+        if self.slow_queries:
+            print
+            print 'Slowest queries:'
+            for query_time, key, query in sorted(self.slow_queries, reverse=True):
+                print '%9.3fs  %-40s %s' % (query_time, key, query)
+
+def analyze_logs(log_dir, since, until, top):
+    """Ranks tablets and processes by crashes, restarts, errors and slow queries in collected logs."""
+    analyzer = LogAnalyzer(since, until, top)
+    archives = sorted(f for f in os.listdir(log_dir) if f.endswith('.tar.gz'))
+    print 'Analyzing %d host log archives under: %s' % (len(archives), log_dir)
+    for archive in archives:
+        host = archive[:-len('.tar.gz')]
+        try:
+            analyzer.add_archive(host, os.path.join(log_dir, archive))
+        except (tarfile.TarError, IOError) as e:
+            print 'WARNING: Could not read %s: %s' % (archive, e)
+    analyzer.print_report()
+
 def run_demo(ls, vtctld, vtgate, vttablets):
-    create_start_cluster(vtctld.hostname, vtgate.hostname, vttablets.tablets, vttablets.dbconfig.get_dbname())
+    create_start_cluster(vtctld.hostname, vtgate.get_instances(), vttablets.tablets, vttablets.dbconfig.get_dbname())
     create_destroy_cluster()
     create_sharding_workflow_script(ls, vtctld)
     print '\t%s' % 'start_cluster.sh'
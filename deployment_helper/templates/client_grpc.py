@@ -15,72 +15,252 @@
 # limitations under the License.
 
 
-"""Sample Vitess client in Python.
+"""Vitess gRPC benchmark client in Python.
 
-This is a sample for using the Python Vitess client.
-It's a script that inserts some random messages on random pages of the
-guestbook sample app.
+Runs a read/write load on the messages table of the guestbook sample app
+over the vtgate gRPC protocol, from several concurrent sessions, and prints
+the same status line as client_mysql.py so the two protocols can be
+compared side by side.
 
 Before running this, start up a local example cluster as described in the
 README.md file.
 
-Then run client.sh, which sets up PYTHONPATH before running client.py:
-vitess/examples/local$ ./client.sh
+Then run client.sh, which sets up PYTHONPATH before running client_grpc.py:
+vitess/examples/local$ ./client.sh --sessions 8 --qps 1000
 """
 
 import argparse
 import random
+import sys
+import threading
 import time
 
 from vtdb import vtgate_client
+from vtdb import vtgate_cursor
 
 # register the python gRPC client upon import
 from vtdb import grpc_vtgate_client  # pylint: disable=unused-import
 
+import client_lib
+
 # Parse args
 parser = argparse.ArgumentParser()
-parser.add_argument('--server', dest='server', default='localhost:15991')
+parser.add_argument('--server', dest='server', default='localhost:15991',
+                    help='Comma separated vtgate host:grpc_port, sessions are spread over them.')
+parser.add_argument('--vtgates', dest='vtgates', type=int, default=0,
+                    help='Spread sessions over the first this many vtgates of vtgate_endpoints.json '
+                    'instead of --server, -1 uses all of them.')
+parser.add_argument('--cell', dest='cell', default=None,
+                    help='With --vtgates, only use the vtgates of this cell so reads stay local.')
 parser.add_argument('--timeout', dest='timeout', type=float, default='10.0')
+parser.add_argument('--sessions', dest='sessions', type=int, default=4,
+                    help='Concurrent sessions, each with its own connection.')
+parser.add_argument('--qps', dest='qps', type=float, default='100.0',
+                    help='Total target qps over all sessions, 0 runs unthrottled.')
+parser.add_argument('--read-write-ratio', dest='read_write_ratio', type=float, default='0.8')
+parser.add_argument('--tablet-type', dest='tablet_type', default='master',
+                    choices=['master', 'replica', 'rdonly'],
+                    help='Tablet type reads are sent to, writes always go to master.')
+parser.add_argument('--pages', dest='pages', type=int, default=100)
+parser.add_argument('--batch-rows', dest='batch_rows', type=int, default=1,
+                    help='Rows per INSERT, sent as bind variables.')
+parser.add_argument('--stream', dest='stream', action='store_true', default=False,
+                    help='Read whole pages with streaming execute instead of point reads.')
+parser.add_argument('--duration', dest='duration', type=int, default=0,
+                    help='Seconds to run, 0 runs until interrupted.')
+parser.add_argument('--results', dest='results', default=None,
+                    help='Write per-second results to this file, see compare_results.py.')
+parser.add_argument('--config-dir', dest='config_dir',
+                    default=client_lib.default_config_dir(),
+                    help='Deployment config dir holding vttablet.json.')
 args = parser.parse_args()
 
-# Connect
-conn = vtgate_client.connect('grpc', args.server, args.timeout)
-
-try:
-  # Insert some messages on random pages.
-  print 'Inserting into master...'
-  cursor = conn.cursor(tablet_type='master', writable=True)
-  for i in range(3):
-    page = random.randint(1, 100)
-
-    cursor.begin()
-    cursor.execute(
-        'INSERT INTO messages (page, time_created_ns, message)'
-        ' VALUES (:page, :time_created_ns, :message)',
-        {
-            'page': page,
-            'time_created_ns': int(time.time() * 1e9),
-            'message': 'V is for speed',
-        })
-    cursor.commit()
-
-  # Read it back from the master.
-  print 'Reading from master...'
-  cursor.execute('SELECT page, time_created_ns, message FROM messages', {})
-  for row in cursor.fetchall():
-    print row
-
-  cursor.close()
-
-  # Read from a replica.
-  # Note that this may be behind master due to replication lag.
-  print 'Reading from replica...'
-  cursor = conn.cursor(tablet_type='replica')
-  cursor.execute('SELECT page, time_created_ns, message FROM messages', {})
-  for row in cursor.fetchall():
-    print row
-  cursor.close()
-
-finally:
-  # Clean up
-  conn.close()
+if args.vtgates:
+  endpoints = client_lib.load_vtgate_endpoints(args.config_dir, args.cell)
+  if args.vtgates > 0:
+    endpoints = endpoints[:args.vtgates]
+  if not endpoints or len(endpoints) < args.vtgates:
+    print 'ERROR: %d vtgates requested, %d in %s' % (
+        args.vtgates, len(endpoints), args.config_dir)
+    sys.exit(1)
+  servers = ['%(host)s:%(grpc_port)d' % e for e in endpoints]
+else:
+  servers = args.server.split(',')
+
+
+class Stats(object):
+  """Counters shared by all sessions."""
+
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.read_count = 0
+    self.write_count = 0
+    self.write_rows = 0
+    self.error_count = 0
+    self.read_latencies = client_lib.LatencyHistogram()
+    self.write_latencies = client_lib.LatencyHistogram()
+    self.recorder = None
+
+  def read(self, latency):
+    with self.lock:
+      self.read_count += 1
+      self.read_latencies.add(latency)
+      if self.recorder:
+        self.recorder.read(latency)
+
+  def write(self, latency, rows):
+    with self.lock:
+      self.write_count += 1
+      self.write_rows += rows
+      self.write_latencies.add(latency)
+      if self.recorder:
+        self.recorder.write(latency, rows)
+
+  def error(self):
+    with self.lock:
+      self.error_count += 1
+      if self.recorder:
+        self.recorder.error()
+
+
+stats = Stats()
+done = threading.Event()
+
+
+class Session(threading.Thread):
+  """One vtgate connection running its share of the load."""
+
+  def __init__(self, session_id):
+    super(Session, self).__init__(name='session-%d' % session_id)
+    self.daemon = True
+    self.server = servers[session_id % len(servers)]
+    self.conn = None
+    # page -> time_created_ns values written by this session.
+    self.written = {}
+    self.insert_sql = (
+        'INSERT INTO messages (page, time_created_ns, message) VALUES ' +
+        ', '.join('(:page%d, :time_created_ns%d, :message%d)' % (i, i, i)
+                  for i in xrange(args.batch_rows)))
+
+  def connect(self):
+    if self.conn:
+      try:
+        self.conn.close()
+      except Exception:  # pylint: disable=broad-except
+        pass
+    self.conn = vtgate_client.connect('grpc', self.server, args.timeout)
+
+  def write(self):
+    bind_vars = {}
+    keys = []
+    base_ns = int(time.time() * 1e9)
+    for i in xrange(args.batch_rows):
+      page = random.randint(1, args.pages)
+      time_created_ns = base_ns + i
+      keys.append((page, time_created_ns))
+      bind_vars['page%d' % i] = page
+      bind_vars['time_created_ns%d' % i] = time_created_ns
+      bind_vars['message%d' % i] = 'V is for speed'
+    cursor = self.conn.cursor(tablet_type='master', writable=True)
+    try:
+      cursor.begin()
+      cursor.execute(self.insert_sql, bind_vars)
+      cursor.commit()
+    finally:
+      cursor.close()
+    for page, time_created_ns in keys:
+      self.written.setdefault(page, []).append(time_created_ns)
+    return len(keys)
+
+  def read(self):
+    if args.stream:
+      cursor = self.conn.cursor(tablet_type=args.tablet_type,
+                                cursorclass=vtgate_cursor.StreamVTGateCursor)
+      try:
+        cursor.execute(
+            'SELECT page, time_created_ns, message FROM messages'
+            ' WHERE page = :page', {'page': random.randint(1, args.pages)})
+        for _ in cursor:
+          pass
+      finally:
+        cursor.close()
+      return
+    if self.written:
+      page = random.choice(self.written.keys())
+      time_created_ns = random.choice(self.written[page])
+    else:
+      page, time_created_ns = random.randint(1, args.pages), 0
+    cursor = self.conn.cursor(tablet_type=args.tablet_type)
+    try:
+      cursor.execute(
+          'SELECT page, time_created_ns, message FROM messages'
+          ' WHERE page = :page AND time_created_ns = :time_created_ns',
+          {'page': page, 'time_created_ns': time_created_ns})
+      cursor.fetchall()
+    finally:
+      cursor.close()
+
+  def run(self):
+    budget = args.sessions / args.qps if args.qps > 0 else 0
+    self.connect()
+    while not done.is_set():
+      start_time = time.time()
+      try:
+        if random.random() < args.read_write_ratio:
+          self.read()
+          stats.read(time.time() - start_time)
+        else:
+          rows = self.write()
+          stats.write(time.time() - start_time, rows)
+      except Exception as e:  # pylint: disable=broad-except
+        stats.error()
+        print e
+        try:
+          self.connect()
+        except Exception as e:  # pylint: disable=broad-except
+          print e
+          time.sleep(1)
+      under_budget = budget - (time.time() - start_time)
+      if under_budget > 0:
+        time.sleep(under_budget)
+
+
+def main():
+  print '*grpc* @ %s sessions=%d tablet_type=%s' % (
+      ','.join(servers), args.sessions, args.tablet_type)
+  if args.results:
+    stats.recorder = client_lib.ResultRecorder(
+        args.results, 'client_grpc', vars(args),
+        client_lib.load_layout(args.config_dir))
+  sessions = [Session(i) for i in xrange(args.sessions)]
+  for session in sessions:
+    session.start()
+  start_time = time.time()
+  try:
+    while not args.duration or time.time() - start_time < args.duration:
+      time.sleep(1)
+      with stats.lock:
+        msg = client_lib.format_status(
+            time.time() - start_time, None, stats.read_count,
+            stats.write_count, stats.write_rows, stats.error_count,
+            stats.read_latencies, stats.write_latencies)
+        if stats.recorder:
+          stats.recorder.end_interval()
+      sys.stdout.write(msg)
+      sys.stdout.flush()
+  except KeyboardInterrupt:
+    pass
+  finally:
+    done.set()
+    for session in sessions:
+      session.join(args.timeout)
+      if session.conn:
+        session.conn.close()
+    print
+    if stats.recorder:
+      stats.recorder.close()
+      print 'Results written to %s' % args.results
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,379 @@
+"""Helpers shared by the sample clients.
+
+Computes keyspace ids the same way the vitess "hash" vindex does, maps them
+to shards, draws pages from skewed distributions and keeps latency
+histograms in constant memory.
+"""
+
+import binascii
+import bisect
+import json
+import math
+import os
+import random
+import struct
+import time
+import urllib2
+
+# Upper bound of message length, see messages.message in database_schema.sql.
+MAX_MESSAGE_SIZE = 10000
+
+# DES tables (FIPS 46-3).
+_IP = [58, 50, 42, 34, 26, 18, 10, 2, 60, 52, 44, 36, 28, 20, 12, 4,
+       62, 54, 46, 38, 30, 22, 14, 6, 64, 56, 48, 40, 32, 24, 16, 8,
+       57, 49, 41, 33, 25, 17, 9, 1, 59, 51, 43, 35, 27, 19, 11, 3,
+       61, 53, 45, 37, 29, 21, 13, 5, 63, 55, 47, 39, 31, 23, 15, 7]
+
+_FP = [40, 8, 48, 16, 56, 24, 64, 32, 39, 7, 47, 15, 55, 23, 63, 31,
+       38, 6, 46, 14, 54, 22, 62, 30, 37, 5, 45, 13, 53, 21, 61, 29,
+       36, 4, 44, 12, 52, 20, 60, 28, 35, 3, 43, 11, 51, 19, 59, 27,
+       34, 2, 42, 10, 50, 18, 58, 26, 33, 1, 41, 9, 49, 17, 57, 25]
+
+_E = [32, 1, 2, 3, 4, 5, 4, 5, 6, 7, 8, 9, 8, 9, 10, 11, 12, 13,
+      12, 13, 14, 15, 16, 17, 16, 17, 18, 19, 20, 21, 20, 21, 22, 23, 24, 25,
+      24, 25, 26, 27, 28, 29, 28, 29, 30, 31, 32, 1]
+
+_P = [16, 7, 20, 21, 29, 12, 28, 17, 1, 15, 23, 26, 5, 18, 31, 10,
+      2, 8, 24, 14, 32, 27, 3, 9, 19, 13, 30, 6, 22, 11, 4, 25]
+
+_PC1 = [57, 49, 41, 33, 25, 17, 9, 1, 58, 50, 42, 34, 26, 18,
+        10, 2, 59, 51, 43, 35, 27, 19, 11, 3, 60, 52, 44, 36,
+        63, 55, 47, 39, 31, 23, 15, 7, 62, 54, 46, 38, 30, 22,
+        14, 6, 61, 53, 45, 37, 29, 21, 13, 5, 28, 20, 12, 4]
+
+_PC2 = [14, 17, 11, 24, 1, 5, 3, 28, 15, 6, 21, 10,
+        23, 19, 12, 4, 26, 8, 16, 7, 27, 20, 13, 2,
+        41, 52, 31, 37, 47, 55, 30, 40, 51, 45, 33, 48,
+        44, 49, 39, 56, 34, 53, 46, 42, 50, 36, 29, 32]
+
+_SHIFTS = [1, 1, 2, 2, 2, 2, 2, 2, 1, 2, 2, 2, 2, 2, 2, 1]
+
+_SBOX = [
+    [14, 4, 13, 1, 2, 15, 11, 8, 3, 10, 6, 12, 5, 9, 0, 7,
+     0, 15, 7, 4, 14, 2, 13, 1, 10, 6, 12, 11, 9, 5, 3, 8,
+     4, 1, 14, 8, 13, 6, 2, 11, 15, 12, 9, 7, 3, 10, 5, 0,
+     15, 12, 8, 2, 4, 9, 1, 7, 5, 11, 3, 14, 10, 0, 6, 13],
+    [15, 1, 8, 14, 6, 11, 3, 4, 9, 7, 2, 13, 12, 0, 5, 10,
+     3, 13, 4, 7, 15, 2, 8, 14, 12, 0, 1, 10, 6, 9, 11, 5,
+     0, 14, 7, 11, 10, 4, 13, 1, 5, 8, 12, 6, 9, 3, 2, 15,
+     13, 8, 10, 1, 3, 15, 4, 2, 11, 6, 7, 12, 0, 5, 14, 9],
+    [10, 0, 9, 14, 6, 3, 15, 5, 1, 13, 12, 7, 11, 4, 2, 8,
+     13, 7, 0, 9, 3, 4, 6, 10, 2, 8, 5, 14, 12, 11, 15, 1,
+     13, 6, 4, 9, 8, 15, 3, 0, 11, 1, 2, 12, 5, 10, 14, 7,
+     1, 10, 13, 0, 6, 9, 8, 7, 4, 15, 14, 3, 11, 5, 2, 12],
+    [7, 13, 14, 3, 0, 6, 9, 10, 1, 2, 8, 5, 11, 12, 4, 15,
+     13, 8, 11, 5, 6, 15, 0, 3, 4, 7, 2, 12, 1, 10, 14, 9,
+     10, 6, 9, 0, 12, 11, 7, 13, 15, 1, 3, 14, 5, 2, 8, 4,
+     3, 15, 0, 6, 10, 1, 13, 8, 9, 4, 5, 11, 12, 7, 2, 14],
+    [2, 12, 4, 1, 7, 10, 11, 6, 8, 5, 3, 15, 13, 0, 14, 9,
+     14, 11, 2, 12, 4, 7, 13, 1, 5, 0, 15, 10, 3, 9, 8, 6,
+     4, 2, 1, 11, 10, 13, 7, 8, 15, 9, 12, 5, 6, 3, 0, 14,
+     11, 8, 12, 7, 1, 14, 2, 13, 6, 15, 0, 9, 10, 4, 5, 3],
+    [12, 1, 10, 15, 9, 2, 6, 8, 0, 13, 3, 4, 14, 7, 5, 11,
+     10, 15, 4, 2, 7, 12, 9, 5, 6, 1, 13, 14, 0, 11, 3, 8,
+     9, 14, 15, 5, 2, 8, 12, 3, 7, 0, 4, 10, 1, 13, 11, 6,
+     4, 3, 2, 12, 9, 5, 15, 10, 11, 14, 1, 7, 6, 0, 8, 13],
+    [4, 11, 2, 14, 15, 0, 8, 13, 3, 12, 9, 7, 5, 10, 6, 1,
+     13, 0, 11, 7, 4, 9, 1, 10, 14, 3, 5, 12, 2, 15, 8, 6,
+     1, 4, 11, 13, 12, 3, 7, 14, 10, 15, 6, 8, 0, 5, 9, 2,
+     6, 11, 13, 8, 1, 4, 10, 7, 9, 5, 0, 15, 14, 2, 3, 12],
+    [13, 2, 8, 4, 6, 15, 11, 1, 10, 9, 3, 14, 5, 0, 12, 7,
+     1, 15, 13, 8, 10, 3, 7, 4, 12, 5, 6, 11, 0, 14, 9, 2,
+     7, 11, 4, 1, 9, 12, 14, 2, 0, 6, 10, 13, 15, 3, 5, 8,
+     2, 1, 14, 7, 4, 10, 8, 13, 15, 12, 9, 0, 3, 5, 6, 11],
+]
+
+def _permute(value, table, width):
+    out = 0
+    for pos in table:
+        out = (out << 1) | ((value >> (width - pos)) & 1)
+    return out
+
+def _subkeys(key):
+    cd = _permute(key, _PC1, 64)
+    c, d = cd >> 28, cd & 0xfffffff
+    keys = []
+    for shift in _SHIFTS:
+        c = ((c << shift) | (c >> (28 - shift))) & 0xfffffff
+        d = ((d << shift) | (d >> (28 - shift))) & 0xfffffff
+        keys.append(_permute((c << 28) | d, _PC2, 56))
+    return keys
+
+def _feistel(r, subkey):
+    x = _permute(r, _E, 32) ^ subkey
+    out = 0
+    for i in xrange(8):
+        six = (x >> (42 - 6 * i)) & 0x3f
+        row = ((six >> 4) & 2) | (six & 1)
+        col = (six >> 1) & 0xf
+        out = (out << 4) | _SBOX[i][row * 16 + col]
+    return _permute(out, _P, 32)
+
+def des_encrypt_block(block, subkeys):
+    """Encrypts one 64 bit integer block with DES."""
+    x = _permute(block, _IP, 64)
+    l, r = x >> 32, x & 0xffffffff
+    for subkey in subkeys:
+        l, r = r, l ^ _feistel(r, subkey)
+    return _permute((r << 32) | l, _FP, 64)
+
+# The hash vindex uses 3DES with an all zero key, which is the same as
+# single DES with an all zero key.
+_ZERO_KEY_SUBKEYS = _subkeys(0)
+
+def hash_keyspace_id(value):
+    """Returns the 8 byte keyspace id the vitess "hash" vindex assigns to an unsigned integer."""
+    return struct.pack('>Q', des_encrypt_block(value & 0xffffffffffffffff, _ZERO_KEY_SUBKEYS))
+
+def shard_keyrange(shard):
+    """Returns (start, end) keyspace id bounds of a shard name like "-80" or "80-"; "" is unbounded."""
+    if shard in ('0', '-'):
+        return '', ''
+    start, end = shard.split('-')
+    return binascii.unhexlify(start), binascii.unhexlify(end)
+
+class UniformPages(object):
+    def __init__(self, pages):
+        self.pages = pages
+
+    def next_page(self):
+        return random.randint(1, self.pages)
+
+class ZipfianPages(object):
+    """Page 1 is the most popular, page n is accessed 1/n**theta as often."""
+    def __init__(self, pages, theta):
+        self.pages = pages
+        self.cdf = []
+        total = 0.0
+        for i in xrange(1, pages + 1):
+            total += 1.0 / (i ** theta)
+            self.cdf.append(total)
+        self.total = total
+
+    def next_page(self):
+        return bisect.bisect_left(self.cdf, random.random() * self.total) + 1
+
+class HotspotPages(object):
+    """hot_access of the requests go to the first hot_fraction of the pages."""
+    def __init__(self, pages, hot_fraction, hot_access):
+        self.pages = pages
+        self.hot_pages = max(1, int(pages * hot_fraction))
+        self.hot_access = hot_access
+
+    def next_page(self):
+        if self.hot_pages >= self.pages or random.random() < self.hot_access:
+            return random.randint(1, self.hot_pages)
+        return random.randint(self.hot_pages + 1, self.pages)
+
+def make_key_distribution(cfg):
+    dist_type = cfg.get('type', 'uniform')
+    pages = int(cfg.get('pages', 100))
+    if dist_type == 'uniform':
+        return UniformPages(pages)
+    elif dist_type == 'zipfian':
+        return ZipfianPages(pages, float(cfg.get('theta', 0.99)))
+    elif dist_type == 'hotspot':
+        return HotspotPages(pages, float(cfg.get('hot_fraction', 0.2)), float(cfg.get('hot_access', 0.8)))
+    raise ValueError('unknown key distribution "%s"' % dist_type)
+
+class ShardMap(object):
+    """Maps keyspace ids to the shard whose keyrange contains them."""
+    def __init__(self, shards):
+        self.shards = list(shards)
+        self.ranges = [(shard_keyrange(s), s) for s in self.shards]
+        self.page_cache = {}
+
+    def find(self, keyspace_id):
+        for (start, end), shard in self.ranges:
+            if keyspace_id >= start and (not end or keyspace_id < end):
+                return shard
+        return None
+
+    def shard_for_page(self, page):
+        shard = self.page_cache.get(page)
+        if shard is None:
+            shard = self.page_cache[page] = self.find(hash_keyspace_id(page))
+        return shard
+
+def load_shards(config_dir, shard_set=-1):
+    """Returns the shards of a shard set from vttablet.json in the deployment config dir."""
+    with open(os.path.join(config_dir, 'vttablet.json')) as fh:
+        config = json.load(fh)
+    shard_sets = config.get('shard_sets') or [config.get('shards', ['0'])]
+    return [str(s) for s in shard_sets[shard_set]]
+
+def default_config_dir():
+    """The clients are generated into DEPLOYMENT_DIR/bin, the config lives in DEPLOYMENT_DIR/config."""
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'config')
+
+class LatencyHistogram(object):
+    """Log scale latency histogram, accurate to ~2%, in constant memory."""
+    GROWTH = 1.02
+    MIN_LATENCY = 1e-6
+
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, latency):
+        bucket = int(math.log(max(latency, self.MIN_LATENCY) / self.MIN_LATENCY, self.GROWTH))
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+        self.count += 1
+        self.total += latency
+        if latency > self.max:
+            self.max = latency
+
+    def merge(self, other):
+        for bucket, count in other.buckets.iteritems():
+            self.buckets[bucket] = self.buckets.get(bucket, 0) + count
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def mean(self):
+        if not self.count:
+            return 0.0
+        return self.total / self.count
+
+    def percentile(self, pct):
+        if not self.count:
+            return 0.0
+        rank = self.count * pct / 100.0
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                return min(self.MIN_LATENCY * self.GROWTH ** (bucket + 1), self.max)
+        return self.max
+
+def format_status(total_time, row_count, read_count, write_count, write_rows, error_count, read_latencies, write_latencies):
+    """The carriage return status line printed by both sample clients, so their numbers compare directly.
+
+    row_count is the number of rows in the table, None leaves it out for a
+    client that does not count them.
+    """
+    total_time = max(total_time, 1e-6)
+    rows = ' rows(count=%4d)' % row_count if row_count is not None else ''
+    return ('\relapsed=%4d%s read(count=%4d qps=%.2f p50=%.2fms p99=%.2fms) '
+            'write(count=%4d qps=%.2f rows=%4d rows/s=%.2f p50=%.2fms p99=%.2fms) error(count=%4d)' % (
+                int(total_time), rows,
+                read_count, read_count / total_time,
+                read_latencies.percentile(50) * 1000, read_latencies.percentile(99) * 1000,
+                write_count, write_count / total_time, write_rows, write_rows / total_time,
+                write_latencies.percentile(50) * 1000, write_latencies.percentile(99) * 1000,
+                error_count))
+
+def load_tablets(config_dir):
+    """Returns the tablet dicts (host, web_port, shard, ttype, ...) from vttablet.json."""
+    with open(os.path.join(config_dir, 'vttablet.json')) as fh:
+        return json.load(fh).get('tablets', [])
+
+def load_vtgate_endpoints(config_dir, cell=None):
+    """Returns the vtgate dicts (host, cell, web_port, grpc_port, mysql_server_port, ...) from vtgate_endpoints.json.
+
+    The first instance of every host comes before the second of any, so the
+    first n endpoints spread over as many hosts as possible. With a cell,
+    only the vtgates of that cell are returned.
+    """
+    try:
+        with open(os.path.join(config_dir, 'vtgate_endpoints.json')) as fh:
+            endpoints = json.load(fh)['endpoints']
+    except (IOError, ValueError, KeyError):
+        return []
+    return [e for e in endpoints if cell is None or e.get('cell') == cell]
+
+def fetch_debug_vars(host, port, timeout=1):
+    """Returns the parsed /debug/vars of a vitess process."""
+    response = urllib2.urlopen('http://%s:%s/debug/vars' % (host, port), timeout=timeout)
+    return json.load(response)
+
+def load_layout(config_dir):
+    """Summarizes the cluster layout from vttablet.json, empty if there is no config."""
+    try:
+        with open(os.path.join(config_dir, 'vttablet.json')) as fh:
+            config = json.load(fh)
+    except (IOError, ValueError):
+        return {}
+    tablets = config.get('tablets', [])
+    tablet_types = {}
+    for tablet in tablets:
+        tablet_types[tablet['ttype']] = tablet_types.get(tablet['ttype'], 0) + 1
+    return dict(shards=config.get('shards', []),
+                shard_sets=config.get('shard_sets', []),
+                num_tablets=len(tablets),
+                tablet_types=tablet_types,
+                hosts=sorted(set(t['host'] for t in tablets)))
+
+class ResultRecorder(object):
+    """Streams a benchmark run to a JSON lines result file.
+
+    The first line describes the run (config and cluster layout), then one
+    line per interval with throughput, latency percentiles and errors, and
+    a summary line when the run ends. compare_results.py reads these files.
+    """
+    def __init__(self, path, client, config, layout):
+        self.fh = open(path, 'w')
+        self.start_time = time.time()
+        self.totals = dict(reads=0, writes=0, rows=0, errors=0)
+        self.read_latencies = LatencyHistogram()
+        self.write_latencies = LatencyHistogram()
+        self.reset_interval()
+        self.write_line(dict(type='run', client=client, start_time=self.start_time, config=config, layout=layout))
+
+    def reset_interval(self):
+        self.interval_start = time.time()
+        self.interval = dict(reads=0, writes=0, rows=0, errors=0)
+        self.interval_reads = LatencyHistogram()
+        self.interval_writes = LatencyHistogram()
+
+    def write_line(self, entry):
+        self.fh.write(json.dumps(entry, sort_keys=True) + '\n')
+        self.fh.flush()
+
+    def read(self, latency):
+        self.interval['reads'] += 1
+        self.interval_reads.add(latency)
+
+    def write(self, latency, rows=1):
+        self.interval['writes'] += 1
+        self.interval['rows'] += rows
+        self.interval_writes.add(latency)
+
+    def error(self):
+        self.interval['errors'] += 1
+
+    def stats_line(self, elapsed, counts, reads, writes):
+        elapsed = max(elapsed, 1e-6)
+        return dict(read_qps=counts['reads'] / elapsed,
+                    write_qps=counts['writes'] / elapsed,
+                    rows_per_s=counts['rows'] / elapsed,
+                    errors=counts['errors'],
+                    read_p50=reads.percentile(50), read_p90=reads.percentile(90),
+                    read_p99=reads.percentile(99), read_max=reads.max,
+                    write_p50=writes.percentile(50), write_p90=writes.percentile(90),
+                    write_p99=writes.percentile(99), write_max=writes.max)
+
+    def end_interval(self):
+        now = time.time()
+        entry = self.stats_line(now - self.interval_start, self.interval, self.interval_reads, self.interval_writes)
+        entry.update(type='interval', t=now - self.start_time)
+        # An interval without reads or writes has no latency, 0 would pull the averages down.
+        for prefix, latencies in (('read', self.interval_reads), ('write', self.interval_writes)):
+            if not latencies.count:
+                for stat in ('p50', 'p90', 'p99', 'max'):
+                    entry['%s_%s' % (prefix, stat)] = None
+        self.write_line(entry)
+        for key in self.totals:
+            self.totals[key] += self.interval[key]
+        self.read_latencies.merge(self.interval_reads)
+        self.write_latencies.merge(self.interval_writes)
+        self.reset_interval()
+
+    def close(self):
+        self.end_interval()
+        entry = self.stats_line(time.time() - self.start_time, self.totals, self.read_latencies, self.write_latencies)
+        entry.update(type='summary', duration=time.time() - self.start_time)
+        self.write_line(entry)
+        self.fh.close()
@@ -1,16 +1,28 @@
 #!/usr/bin/env python
 
+import bisect
+import json
 import mysql.connector
 import os
+import Queue
 import signal
 import subprocess
 import socket
 import sys
+import threading
 import time
 import random
 import argparse
 
+import client_lib
+
 def handle_sigint(signo, frame):
+    if shard_map is not None:
+        print_shard_report()
+    if recorder is not None:
+        recorder.close()
+        print
+        print 'Results written to %s' % args.results
     sys.exit()
 
 def get_hostname():
@@ -40,41 +52,350 @@ vtgate_config = {
     'port': '15306',
 }
 
+# Operations a workload profile can mix. Weights need not add up to 1.
+OPERATIONS = ['point_read', 'range_scan', 'insert', 'update', 'delete', 'scatter_count']
+READ_OPERATIONS = ['point_read', 'range_scan', 'scatter_count']
+
+BUILTIN_PROFILES = {
+    'read_heavy': {
+        'operations': {'point_read': 0.7, 'range_scan': 0.15, 'insert': 0.1, 'update': 0.05},
+        'key_distribution': {'type': 'uniform', 'pages': 100},
+        'message_size': {'min': 14, 'max': 200},
+    },
+    'write_heavy': {
+        'operations': {'point_read': 0.2, 'insert': 0.6, 'update': 0.15, 'delete': 0.05},
+        'key_distribution': {'type': 'uniform', 'pages': 100},
+        'message_size': {'min': 200, 'max': 2000},
+    },
+    'zipfian': {
+        'operations': {'point_read': 0.6, 'range_scan': 0.1, 'insert': 0.2, 'update': 0.1},
+        'key_distribution': {'type': 'zipfian', 'pages': 10000, 'theta': 0.99},
+        'message_size': {'min': 14, 'max': 1000},
+    },
+    'hotspot': {
+        'operations': {'point_read': 0.6, 'range_scan': 0.1, 'insert': 0.2, 'update': 0.1},
+        'key_distribution': {'type': 'hotspot', 'pages': 10000, 'hot_fraction': 0.01, 'hot_access': 0.9},
+        'message_size': {'min': 14, 'max': 1000},
+    },
+    'large_rows': {
+        'operations': {'point_read': 0.5, 'insert': 0.5},
+        'key_distribution': {'type': 'uniform', 'pages': 100},
+        'message_size': {'min': 5000, 'max': client_lib.MAX_MESSAGE_SIZE},
+    },
+    'scan': {
+        'operations': {'range_scan': 0.8, 'scatter_count': 0.05, 'insert': 0.15},
+        'key_distribution': {'type': 'uniform', 'pages': 100},
+        'message_size': {'min': 14, 'max': 200},
+        'range_scan_limit': 100,
+    },
+    'bulk_insert': {
+        'operations': {'insert': 1},
+        'key_distribution': {'type': 'uniform', 'pages': 10000},
+        'message_size': {'min': 100, 'max': 1000},
+    },
+}
+
+# Disruption events, formatted with the vtctld address and the event argument.
+EVENT_PRESETS = {
+    'migrate_served_types': '$VTROOT/bin/vtctlclient -server %(vtctld)s MigrateServedTypes %(arg)s',
+    'planned_reparent': '$VTROOT/bin/vtctlclient -server %(vtctld)s PlannedReparentShard -keyspace_shard %(arg)s',
+    'kill_tablet': 'kill -9 `cat $VTDATAROOT/%(arg)s/vttablet.pid`',
+    'command': '%(arg)s',
+}
+
 cnx = None
 cursor = None
+write_cursor = None
 args = None
+profile = None
+shard_map = None
+recorder = None
 
 def parse_args():
     global args
     parser = argparse.ArgumentParser()
     parser.add_argument('--server', dest='server', default='vtgate')
     parser.add_argument('--host', dest='host', default=get_hostname())
+    parser.add_argument('--port', dest='port', type=int, default=None,
+                        help='Defaults to the vtgate or mysql port, set it to go through haproxy-vtgate.cfg.')
     parser.add_argument('--timeout', dest='timeout', type=int, default='5')
     parser.add_argument('--qps', dest='qps', type=float, default='10.0')
     parser.add_argument('--read-write-ratio', dest='read_write_ratio', type=float, default='0.8')
+    parser.add_argument('--profile', dest='profile', default=None,
+                        help='Workload profile: one of %s or a path to a JSON file.' % sorted(BUILTIN_PROFILES))
+    parser.add_argument('--batch-rows', dest='batch_rows', type=int, default=1,
+                        help='Rows per INSERT statement.')
+    parser.add_argument('--batch-statements', dest='batch_statements', type=int, default=1,
+                        help='INSERT statements per transaction.')
+    parser.add_argument('--prepared', dest='prepared', action='store_true', default=False,
+                        help='Use server side prepared statements for writes.')
+    parser.add_argument('--shard-report-interval', dest='shard_report_interval', type=int, default=0,
+                        help='Print per-shard qps and latency percentiles every this many seconds, 0 disables.')
+    parser.add_argument('--shards', dest='shards', default=None,
+                        help='Comma separated shards to account load against, defaults to the newest shard set in vttablet.json.')
+    parser.add_argument('--config-dir', dest='config_dir', default=client_lib.default_config_dir(),
+                        help='Deployment config dir holding vttablet.json.')
+    parser.add_argument('--event', dest='events', action='append', default=[],
+                        help='Disruption event to run under load, as "preset:argument", preset one of %s. '
+                        'May be repeated, events run one after another.' % sorted(EVENT_PRESETS))
+    parser.add_argument('--event-window', dest='event_window', type=int, default=10,
+                        help='Seconds of load before the first event, between events and after the last one.')
+    parser.add_argument('--vtctld', dest='vtctld', default='localhost:15999',
+                        help='vtctld grpc address used by the event presets.')
+    parser.add_argument('--offload-share', dest='offload_share', type=float, default=0.0,
+                        help='Share of point reads and range scans sent to --offload-tablet-type instead of master.')
+    parser.add_argument('--offload-tablet-type', dest='offload_tablet_type', default='replica',
+                        choices=['replica', 'rdonly'])
+    parser.add_argument('--max-replica-lag', dest='max_replica_lag', type=float, default=5.0,
+                        help='Send offloaded reads to master while the shard\'s tablets lag more than this many seconds.')
+    parser.add_argument('--lag-poll-interval', dest='lag_poll_interval', type=float, default=1.0,
+                        help='Seconds between polls of SecondsBehindMaster on the offload tablets.')
+    parser.add_argument('--results', dest='results', default=None,
+                        help='Write config, cluster layout and per-second results to this file, see compare_results.py.')
+    parser.add_argument('--record-trace', dest='record_trace', default=None,
+                        help='Append every query this client runs to a JSON lines trace file.')
+    parser.add_argument('--replay-trace', dest='replay_trace', default=None,
+                        help='Replay a JSON lines query trace instead of generating load.')
+    parser.add_argument('--replay-speed', dest='replay_speed', type=float, default=1.0,
+                        help='Replay at this multiple of the recorded rate, 0 replays as fast as possible.')
+    parser.add_argument('--replay-sessions', dest='replay_sessions', type=int, default=8,
+                        help='Concurrent replay connections; queries of one trace session stay in order on one connection.')
     args = parser.parse_args()
 
-def connect():
-    global cnx, cursor
+class Profile(object):
+    def __init__(self, cfg):
+        operations = cfg.get('operations', {})
+        for op in operations:
+            if op not in OPERATIONS:
+                print 'ERROR: unknown operation "%s", expected one of %s' % (op, OPERATIONS)
+                sys.exit(1)
+        self.operations = [op for op in OPERATIONS if operations.get(op, 0) > 0]
+        if not self.operations:
+            print 'ERROR: no operation with a positive weight in %s, expected some of %s' % (operations, OPERATIONS)
+            sys.exit(1)
+        self.op_cdf = []
+        total = 0.0
+        for op in self.operations:
+            total += float(operations[op])
+            self.op_cdf.append(total)
+        self.op_total = total
+        try:
+            self.pages = client_lib.make_key_distribution(cfg.get('key_distribution', {}))
+        except ValueError as e:
+            print 'ERROR: %s' % e
+            sys.exit(1)
+        message_size = cfg.get('message_size', {})
+        self.min_message_size = min(int(message_size.get('min', 14)), client_lib.MAX_MESSAGE_SIZE)
+        self.max_message_size = min(int(message_size.get('max', self.min_message_size)), client_lib.MAX_MESSAGE_SIZE)
+        self.range_scan_limit = int(cfg.get('range_scan_limit', 20))
+
+    def next_operation(self):
+        return self.operations[bisect.bisect_left(self.op_cdf, random.random() * self.op_total)]
+
+    def next_page(self):
+        return self.pages.next_page()
+
+    def next_message(self):
+        size = random.randint(self.min_message_size, self.max_message_size)
+        base = 'V is for speed '
+        return (base * (size / len(base) + 1))[:size]
+
+def load_profile():
+    global profile
+    if args.profile is None:
+        # Same mix as before profiles existed.
+        cfg = {
+            'operations': {'point_read': args.read_write_ratio, 'insert': 1 - args.read_write_ratio},
+            'key_distribution': {'type': 'uniform', 'pages': 100},
+            'message_size': {'min': 14, 'max': 14},
+        }
+    elif args.profile in BUILTIN_PROFILES:
+        cfg = BUILTIN_PROFILES[args.profile]
+    elif os.path.isfile(args.profile):
+        with open(args.profile) as fh:
+            cfg = json.load(fh)
+    else:
+        print 'ERROR: profile "%s" is neither a builtin profile %s nor a file' % (args.profile, sorted(BUILTIN_PROFILES))
+        sys.exit(1)
+    profile = Profile(cfg)
+
+def load_shard_map():
+    global shard_map
+    if args.shard_report_interval <= 0:
+        return
+    if args.shards:
+        shards = args.shards.split(',')
+    else:
+        shards = client_lib.load_shards(args.config_dir)
+    shard_map = client_lib.ShardMap(shards)
+    print 'Accounting load against shards: %s' % ' '.join(shards)
+
+def make_connection(tablet_type=None):
     config.update(dict(connection_timeout=args.timeout))
     config.update(dict(host=args.host))
     if args.server == 'vtgate':
         config.update(vtgate_config)
     else:
         config.update(mysql_config)
-    try:
-        print '*%s* @ %s:%s' % (args.server, config['host'], config['port'])
-        cnx = mysql.connector.connect(**config)
-    except Exception as e:
-        print e
-        sys.exit()
+    if args.port:
+        config.update(port=args.port)
+    print '*%s* @ %s:%s' % (args.server, config['host'], config['port'])
+    if tablet_type is None:
+        return mysql.connector.connect(**config)
+    # vtgate routes a connection to "keyspace@tablet_type" to tablets of that type.
+    return mysql.connector.connect(**dict(config, database='%s@%s' % (config['database'], tablet_type)))
+
+def connect():
+    global cnx, cursor, write_cursor
+    outage_start = None
+    while True:
+        try:
+            cnx = make_connection()
+            break
+        except Exception as e:
+            print e
+            if not args.events or events_done.is_set():
+                sys.exit()
+            # Keep retrying while a disruption is in progress, the time without a connection is what we measure.
+            if outage_start is None:
+                outage_start = time.time()
+            time.sleep(0.1)
+    if outage_start is not None:
+        outages.append((outage_start, time.time()))
+    cursor = cnx.cursor(buffered=True)
+    if args.prepared:
+        write_cursor = cnx.cursor(prepared=True)
     else:
-        cursor = cnx.cursor(buffered=True)
+        write_cursor = cursor
+
+trace_file = None
 
-time_created_values = []
+def trace_session(connection):
+    """The trace session of a connection, the replay keeps the queries of one session in order."""
+    return '%d-%s' % (os.getpid(), connection.connection_id)
+
+def record_trace(sql, params, start_time, latency, session, tablet_type):
+    """Writes one trace entry in the format --replay-trace reads."""
+    entry = dict(ts=start_time, session=session, sql=sql, bind=list(params or []),
+                 tablet_type=tablet_type, latency=latency)
+    trace_file.write(json.dumps(entry) + '\n')
+
+# page -> list of time_created_ns written by this client.
+written_keys = {}
 write_counter = 0
+write_row_counter = 0
 read_counter = 0
 error_counter = 0
+read_latencies = client_lib.LatencyHistogram()
+write_latencies = client_lib.LatencyHistogram()
+
+SCATTER = 'scatter'
+# shard -> LatencyHistogram and error count since the last per-shard report.
+shard_latencies = {}
+shard_errors = {}
+last_shard_report = time.time()
+
+# Per second [ok count, error count, max latency] while events are configured.
+timeline = {}
+# (name, command, start, end, exit code) of the disruption events that ran.
+events_run = []
+events_done = threading.Event()
+# (start, end) of the times connect() could not reach the server, no queries run then.
+outages = []
+
+def record_query(pages, latency, ok):
+    if args.events:
+        second = timeline.setdefault(int(time.time()), [0, 0, 0.0])
+        if ok:
+            second[0] += 1
+            second[2] = max(second[2], latency)
+        else:
+            second[1] += 1
+    record_shards(pages, latency, ok)
+
+def record_shards(pages, latency, ok):
+    """Attributes one query to the shards owning pages, or to all shards if pages is None."""
+    if shard_map is None:
+        return
+    if pages is None:
+        shards = [SCATTER]
+    else:
+        shards = set(shard_map.shard_for_page(page) for page in pages)
+    for shard in shards:
+        if ok:
+            shard_latencies.setdefault(shard, client_lib.LatencyHistogram()).add(latency)
+        else:
+            shard_errors[shard] = shard_errors.get(shard, 0) + 1
+
+def print_shard_report():
+    global shard_latencies, shard_errors, last_shard_report
+    now = time.time()
+    elapsed = max(now - last_shard_report, 1e-6)
+    print
+    print '%-12s %10s %10s %10s %10s %10s %8s' % ('shard', 'qps', 'p50(ms)', 'p90(ms)', 'p99(ms)', 'max(ms)', 'errors')
+    for shard in shard_map.shards + [SCATTER]:
+        hist = shard_latencies.get(shard, client_lib.LatencyHistogram())
+        errors = shard_errors.get(shard, 0)
+        if shard == SCATTER and not hist.count and not errors:
+            continue
+        print '%-12s %10.2f %10.2f %10.2f %10.2f %10.2f %8d' % (
+            shard, hist.count / elapsed, hist.percentile(50) * 1000, hist.percentile(90) * 1000,
+            hist.percentile(99) * 1000, hist.max * 1000, errors)
+    shard_latencies = {}
+    shard_errors = {}
+    last_shard_report = now
+
+def run_events():
+    """Runs each --event under load, separated by --event-window seconds of steady load."""
+    for event in args.events:
+        time.sleep(args.event_window)
+        preset, _, arg = event.partition(':')
+        command = EVENT_PRESETS[preset] % dict(vtctld=args.vtctld, arg=arg)
+        start_time = time.time()
+        print
+        print 'Event "%s" started: %s' % (event, command)
+        exit_code = subprocess.call(command, shell=True)
+        end_time = time.time()
+        print 'Event "%s" finished in %.2fs with exit code %d' % (event, end_time - start_time, exit_code)
+        events_run.append((event, command, start_time, end_time, exit_code))
+    time.sleep(args.event_window)
+    events_done.set()
+
+def start_events():
+    for event in args.events:
+        if event.partition(':')[0] not in EVENT_PRESETS:
+            print 'ERROR: unknown event preset in "%s", expected one of %s' % (event, sorted(EVENT_PRESETS))
+            sys.exit(1)
+    thread = threading.Thread(target=run_events)
+    thread.daemon = True
+    thread.start()
+
+def print_event_report():
+    """Compares throughput and errors around each event to the steady state before it."""
+    print
+    print '%-40s %8s %9s %9s %7s %10s %10s %10s %7s' % (
+        'event', 'start(s)', 'duration', 'err_window', 'errors', 'max_lat(ms)', 'base_qps', 'min_qps', 'dip')
+    run_start = min(timeline) if timeline else 0
+    # The last second is still in progress and would look like a dip.
+    run_end = max(timeline) if timeline else 0
+    for event, command, start_time, end_time, exit_code in events_run:
+        before = range(int(start_time) - args.event_window, int(start_time))
+        during = range(int(start_time), min(int(end_time) + args.event_window + 1, run_end))
+        baseline = [timeline[s][0] for s in before if s in timeline]
+        base_qps = float(sum(baseline)) / len(baseline) if baseline else 0.0
+        qps = [timeline.get(s, [0, 0, 0.0])[0] for s in during]
+        min_qps = min(qps) if qps else 0
+        error_seconds = [s for s in during if timeline.get(s, [0, 0])[1] or
+                         any(start < s + 1 and end >= s for start, end in outages)]
+        errors = sum(timeline.get(s, [0, 0])[1] for s in during)
+        error_window = error_seconds[-1] - error_seconds[0] + 1 if error_seconds else 0
+        max_latency = max([timeline.get(s, [0, 0, 0.0])[2] for s in during] or [0.0])
+        dip = 1 - min_qps / base_qps if base_qps else 0.0
+        if exit_code != 0:
+            event += ' (exit %d)' % exit_code
+        print '%-40s %8.1f %9.2f %9ds %7d %10.2f %10.2f %10d %6.1f%%' % (
+            event, start_time - run_start, end_time - start_time, error_window, errors,
+            max_latency * 1000, base_qps, min_qps, dip * 100)
 
 def throttled(f):
     def wrapper():
@@ -85,52 +406,214 @@ def throttled(f):
             time.sleep(under_budget)
     return wrapper
 
-@throttled
-def write_row():
+def exec_write_query(argc, params, pages=None):
+    return exec_write_transaction([(argc, params)], pages=pages)
+
+def exec_write_transaction(statements, num_rows=None, pages=None):
+    """Runs (sql, params) statements in one transaction, counting each statement as a write."""
     global write_counter
+    global write_row_counter
     global error_counter
-    global cnx, cursor
-    global time_created_values
-    insert_sql = 'INSERT INTO messages (page, time_created_ns, message) VALUES (%s, %s, %s)'
-    page = random.randint(1, 100)
-    time_created_ns = int(time.time() * 1e9)
-    time_created_values.append(time_created_ns)
-    message = 'V is for speed'
+    start_time = time.time()
     try:
-        cursor.execute(insert_sql, (page, time_created_ns, message))
+        traced = []
+        for argc, params in statements:
+            statement_start = time.time()
+            write_cursor.execute(argc, params)
+            traced.append((argc, params, statement_start, time.time() - statement_start))
         cnx.commit()
-        write_counter += 1
+        if trace_file:
+            # Only committed transactions are replayed.
+            for argc, params, statement_start, latency in traced:
+                record_trace(argc, params, statement_start, latency, trace_session(cnx), 'master')
+        record_query(pages, time.time() - start_time, True)
+        write_latencies.add(time.time() - start_time)
+        if recorder:
+            recorder.write(time.time() - start_time, num_rows if num_rows is not None else len(statements))
+        write_counter += len(statements)
+        write_row_counter += num_rows if num_rows is not None else len(statements)
+        return True
     except Exception as e:
+        record_query(pages, time.time() - start_time, False)
+        if recorder:
+            recorder.error()
         error_counter += 1
         print e
         connect()
         #cnx.rollback()
+        return False
+
+# Replica read offloading, see --offload-share.
+offload_cnx = None
+offload_cursor = None
+offload_map = None
+# shard -> worst SecondsBehindMaster of its offload tablets, absent until polled.
+replica_lag = {}
+offload_counter = 0
+fallback_counter = 0
+offload_latencies = client_lib.LatencyHistogram()
+
+def connect_offload():
+    global offload_cnx, offload_cursor
+    offload_cnx = make_connection(args.offload_tablet_type)
+    offload_cnx.autocommit = True
+    offload_cursor = offload_cnx.cursor(buffered=True)
+
+def reconnect_offload():
+    """Retries the offload connection in the background, reads go to master until it is back."""
+    global offload_cursor
+    offload_cursor = None
+    def retry():
+        while True:
+            try:
+                connect_offload()
+                print 'Offload connection to %s is back' % args.offload_tablet_type
+                return
+            except Exception as e:
+                print e
+                time.sleep(1)
+    thread = threading.Thread(target=retry)
+    thread.daemon = True
+    thread.start()
+
+def poll_replica_lag():
+    """Keeps replica_lag current from the /debug/vars of every offload tablet in vttablet.json."""
+    tablets = [t for t in client_lib.load_tablets(args.config_dir) if t['ttype'] == args.offload_tablet_type]
+    while True:
+        lags = {}
+        for tablet in tablets:
+            try:
+                lag = client_lib.fetch_debug_vars(tablet['host'], tablet['web_port']).get('SecondsBehindMaster', 0)
+            except Exception:
+                # vtgate does not route to tablets it cannot reach either.
+                continue
+            lags[tablet['shard']] = max(lags.get(tablet['shard'], 0), lag)
+        replica_lag.clear()
+        replica_lag.update(lags)
+        time.sleep(args.lag_poll_interval)
+
+def start_offload():
+    global offload_map
+    offload_map = shard_map or client_lib.ShardMap(args.shards.split(',') if args.shards else client_lib.load_shards(args.config_dir))
+    connect_offload()
+    thread = threading.Thread(target=poll_replica_lag)
+    thread.daemon = True
+    thread.start()
+
+def should_offload(page):
+    """Picks --offload-share of the reads for offloading, unless the page's shard lags too much."""
+    global fallback_counter
+    if offload_map is None or random.random() >= args.offload_share:
+        return False
+    if offload_cursor is None:
+        # Reconnecting, see reconnect_offload.
+        fallback_counter += 1
+        return False
+    lag = replica_lag.get(offload_map.shard_for_page(page))
+    if lag is None or lag > args.max_replica_lag:
+        fallback_counter += 1
+        return False
+    return True
 
-def exec_read_query(argc, **argv):
+def exec_read_query(argc, params=None, pages=None, offload=False):
     global read_counter
+    global offload_counter
     global error_counter
+    start_time = time.time()
     try:
-        cursor.execute(argc, argv)
+        if offload:
+            offload_cursor.execute(argc, params)
+            offload_latencies.add(time.time() - start_time)
+            offload_counter += 1
+        else:
+            cursor.execute(argc, params)
+            read_latencies.add(time.time() - start_time)
+        record_query(pages, time.time() - start_time, True)
+        if recorder:
+            recorder.read(time.time() - start_time)
+        if trace_file:
+            if offload:
+                record_trace(argc, params, start_time, time.time() - start_time,
+                             trace_session(offload_cnx), args.offload_tablet_type)
+            else:
+                record_trace(argc, params, start_time, time.time() - start_time, trace_session(cnx), 'master')
         read_counter += 1
         return True
     except Exception as e:
+        record_query(pages, time.time() - start_time, False)
+        if recorder:
+            recorder.error()
         error_counter += 1
         print e
-        connect()
+        if offload:
+            reconnect_offload()
+        else:
+            connect()
         return False
 
-@throttled
+def pick_written_key():
+    """Returns a (page, time_created_ns) written earlier, preferring the profile's page."""
+    page = profile.next_page()
+    keys = written_keys.get(page)
+    if not keys:
+        if not written_keys:
+            return page, 0
+        page = random.choice(written_keys.keys())
+        keys = written_keys[page]
+    return page, random.choice(keys)
+
+def write_row():
+    if args.batch_rows > 1 or args.batch_statements > 1:
+        write_batch()
+        return
+    insert_sql = 'INSERT INTO messages (page, time_created_ns, message) VALUES (%s, %s, %s)'
+    page = profile.next_page()
+    time_created_ns = int(time.time() * 1e9)
+    message = profile.next_message()
+    if exec_write_query(insert_sql, (page, time_created_ns, message), pages=[page]):
+        written_keys.setdefault(page, []).append(time_created_ns)
+
+def write_batch():
+    """Inserts --batch-statements multi-row INSERTs of --batch-rows rows each in one transaction."""
+    insert_sql = 'INSERT INTO messages (page, time_created_ns, message) VALUES ' + ', '.join(['(%s, %s, %s)'] * args.batch_rows)
+    base_ns = int(time.time() * 1e9)
+    keys = []
+    statements = []
+    for i in xrange(args.batch_statements):
+        params = []
+        for j in xrange(args.batch_rows):
+            page = profile.next_page()
+            # Offset the timestamp so rows of one batch never collide on the primary key.
+            time_created_ns = base_ns + len(keys)
+            keys.append((page, time_created_ns))
+            params += [page, time_created_ns, profile.next_message()]
+        statements.append((insert_sql, tuple(params)))
+    if exec_write_transaction(statements, len(keys), pages=[page for page, _ in keys]):
+        for page, time_created_ns in keys:
+            written_keys.setdefault(page, []).append(time_created_ns)
+
+def update_row():
+    update_sql = 'UPDATE messages SET message = %s WHERE page = %s AND time_created_ns = %s'
+    page, time_created_ns = pick_written_key()
+    exec_write_query(update_sql, (profile.next_message(), page, time_created_ns), pages=[page])
+
+def delete_row():
+    delete_sql = 'DELETE FROM messages WHERE page = %s AND time_created_ns = %s'
+    page, time_created_ns = pick_written_key()
+    if exec_write_query(delete_sql, (page, time_created_ns), pages=[page]) and time_created_ns in written_keys.get(page, []):
+        written_keys[page].remove(time_created_ns)
+        if not written_keys[page]:
+            del written_keys[page]
+
 def read_row():
-    global read_counter
-    global error_counter
-    query_sql = 'select * from messages where time_created_ns = %s'
-    time_created_ns = random.choice(time_created_values)
-    try:
-        cursor.execute(query_sql, (time_created_ns,))
-        read_counter += 1
-    except Exception as e:
-        error_counter += 1
+    query_sql = 'select * from messages where page = %s and time_created_ns = %s'
+    page, time_created_ns = pick_written_key()
+    exec_read_query(query_sql, (page, time_created_ns), pages=[page], offload=should_offload(page))
 
+def read_page():
+    query_sql = 'select * from messages where page = %s order by time_created_ns desc limit %s'
+    page = profile.next_page()
+    exec_read_query(query_sql, (page, profile.range_scan_limit), pages=[page], offload=should_offload(page))
 
 def read_row_count():
     query_sql = 'select count(*) from messages'
@@ -140,31 +623,220 @@ def read_row_count():
     else:
         return 0
 
+def table_row_count():
+    """Rows in messages for the status line, a bookkeeping query kept out of the stats, results and trace."""
+    try:
+        cursor.execute('select count(*) from messages')
+        return cursor.fetchone()[0] or 0
+    except Exception as e:
+        # The next workload query finds the broken connection and reconnects.
+        print e
+        return None
+
+OPERATION_FUNCS = {
+    'point_read': read_row,
+    'range_scan': read_page,
+    'insert': write_row,
+    'update': update_row,
+    'delete': delete_row,
+    'scatter_count': read_row_count,
+}
+
+@throttled
+def run_operation():
+    OPERATION_FUNCS[profile.next_operation()]()
+
+# Queued trace entries per replay session, bounds memory however large the trace is.
+REPLAY_QUEUE_SIZE = 1000
+
+class ReplayStats(object):
+    """Replay latencies next to the latencies recorded in the trace."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.count = 0
+        self.errors = 0
+        self.replay_latencies = client_lib.LatencyHistogram()
+        self.original_latencies = client_lib.LatencyHistogram()
+        self.schedule_lag = client_lib.LatencyHistogram()
+        self.compared = 0
+        self.total_divergence = 0.0
+        self.slower_2x = 0
+
+    def record(self, latency, original_latency, lag):
+        with self.lock:
+            self.count += 1
+            self.replay_latencies.add(latency)
+            self.schedule_lag.add(lag)
+            if original_latency is not None:
+                self.original_latencies.add(original_latency)
+                self.compared += 1
+                self.total_divergence += latency - original_latency
+                if latency > 2 * original_latency:
+                    self.slower_2x += 1
+
+    def error(self):
+        with self.lock:
+            self.errors += 1
+
+    def status(self, elapsed):
+        with self.lock:
+            mean_divergence = self.total_divergence / self.compared if self.compared else 0.0
+            return ('\relapsed=%4d replayed(count=%d qps=%.2f p50=%.2fms p99=%.2fms) original(p50=%.2fms p99=%.2fms) '
+                    'divergence(mean=%+.2fms slower_2x=%d) lag(p99=%.2fms) error(count=%d)' % (
+                        int(elapsed), self.count, self.count / max(elapsed, 1e-6),
+                        self.replay_latencies.percentile(50) * 1000, self.replay_latencies.percentile(99) * 1000,
+                        self.original_latencies.percentile(50) * 1000, self.original_latencies.percentile(99) * 1000,
+                        mean_divergence * 1000, self.slower_2x, self.schedule_lag.percentile(99) * 1000,
+                        self.errors))
+
+class ReplaySession(threading.Thread):
+    """Replays the trace sessions hashed to it, in order, on one connection."""
+    def __init__(self, stats, start_time):
+        super(ReplaySession, self).__init__()
+        self.daemon = True
+        self.stats = stats
+        self.start_time = start_time
+        self.queue = Queue.Queue(REPLAY_QUEUE_SIZE)
+        self.cursor = None
+        self.target = None
+
+    def connect(self):
+        self.cnx = make_connection()
+        self.cnx.autocommit = True
+        self.cursor = self.cnx.cursor(buffered=True)
+        self.target = None
+
+    def set_target(self, tablet_type):
+        if args.server != 'vtgate' or tablet_type == self.target:
+            return
+        self.cursor.execute('use `%s@%s`' % (config['database'], tablet_type))
+        self.target = tablet_type
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            offset, entry = item
+            if self.cursor is None:
+                # Without a connection the entries are counted as errors, the queue keeps draining.
+                try:
+                    self.connect()
+                except Exception as e:
+                    self.stats.error()
+                    print e
+                    continue
+            due = self.start_time + offset
+            wait = due - time.time()
+            if wait > 0:
+                time.sleep(wait)
+            start_time = time.time()
+            try:
+                self.set_target(entry.get('tablet_type', 'master'))
+                self.cursor.execute(entry['sql'], entry.get('bind') or None)
+                self.stats.record(time.time() - start_time, entry.get('latency'), max(start_time - due, 0))
+            except Exception as e:
+                self.stats.error()
+                print e
+                # Reconnects before the next entry.
+                self.cursor = None
+
+def queue_entry(session, item):
+    """Queues item for session, exits if the session died and will never take it."""
+    while True:
+        try:
+            session.queue.put(item, timeout=1)
+            return
+        except Queue.Full:
+            if not session.is_alive():
+                print 'ERROR: replay session %s stopped, aborting the replay.' % session.name
+                sys.exit(1)
+
+def replay():
+    """Streams the trace to the replay sessions, keeping recorded gaps divided by --replay-speed."""
+    stats = ReplayStats()
+    start_time = time.time()
+    sessions = [ReplaySession(stats, start_time) for i in xrange(args.replay_sessions)]
+    for session in sessions:
+        session.start()
+
+    def report():
+        while True:
+            time.sleep(1)
+            sys.stdout.write(stats.status(time.time() - start_time))
+            sys.stdout.flush()
+    reporter = threading.Thread(target=report)
+    reporter.daemon = True
+    reporter.start()
+
+    first_ts = None
+    with open(args.replay_trace) as fh:
+        for line in fh:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if first_ts is None:
+                first_ts = entry['ts']
+            if args.replay_speed > 0:
+                offset = (entry['ts'] - first_ts) / args.replay_speed
+            else:
+                offset = 0
+            session = sessions[hash(entry.get('session', 0)) % len(sessions)]
+            queue_entry(session, (offset, entry))
+    for session in sessions:
+        queue_entry(session, None)
+    for session in sessions:
+        session.join()
+    print stats.status(time.time() - start_time)
+
 def log(total_time, row_count):
     if row_count is None:
         row_count = 0
-    read_qps = read_counter / total_time
-    write_qps = write_counter / total_time
-    msg = '\relapsed=%4d rows(count=%4d) read(count=%4d qps=%.2f) write(count=%4d qps=%.2f) error(count=%4d)' % (int(total_time), row_count, read_counter, read_qps, write_counter, write_qps, error_counter)
+    msg = client_lib.format_status(total_time, row_count, read_counter, write_counter, write_row_counter,
+                                   error_counter, read_latencies, write_latencies)
+    if offload_map is not None:
+        # read(count) above includes the offloaded reads, its latencies do not.
+        msg += ' offload(%s count=%4d qps=%.2f share=%.1f%% p50=%.2fms p99=%.2fms fallback=%d max_lag=%s)' % (
+            args.offload_tablet_type, offload_counter, offload_counter / total_time,
+            100.0 * offload_counter / max(read_counter, 1),
+            offload_latencies.percentile(50) * 1000, offload_latencies.percentile(99) * 1000,
+            fallback_counter, max(replica_lag.values()) if replica_lag else '-')
     sys.stdout.write(msg)
     sys.stdout.flush()
 
 def run():
     total_time = 0
-    while True:
+    while not events_done.is_set():
         start_time = time.time()
-        read_queries = int(args.qps * args.read_write_ratio)
-        write_queries = int(args.qps - read_queries)
-        for i in xrange(write_queries):
-            write_row()
-        for i in xrange(read_queries):
-            read_row()
+        for i in xrange(int(args.qps)):
+            run_operation()
         time_elapsed = time.time() - start_time
         total_time += time_elapsed
-        log(total_time, read_row_count())
+        log(total_time, table_row_count())
+        if recorder:
+            recorder.end_interval()
+        if shard_map is not None and time.time() - last_shard_report >= args.shard_report_interval:
+            print_shard_report()
+    print_event_report()
+    if recorder:
+        recorder.close()
 
 if __name__ == '__main__':
     signal.signal(signal.SIGINT, handle_sigint)
     parse_args()
+    if args.replay_trace:
+        replay()
+        sys.exit()
+    if args.record_trace:
+        trace_file = open(args.record_trace, 'a')
+    load_profile()
+    load_shard_map()
+    if args.results:
+        recorder = client_lib.ResultRecorder(args.results, 'client_mysql', vars(args),
+                                             client_lib.load_layout(args.config_dir))
     connect()
+    if args.offload_share > 0:
+        start_offload()
+    if args.events:
+        start_events()
     run()
@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+
+"""Compares benchmark result files written with --results.
+
+The first file is the baseline, every other file is compared against it.
+Per-interval samples of each metric are compared with Welch's t-test and a
+change is flagged as a regression when it is both statistically significant
+and larger than --min-change. Exits with status 1 if any regression is found,
+so it can gate upgrades:
+
+    compare_results.py baseline.json candidate.json
+"""
+
+import argparse
+import json
+import math
+import sys
+
+# (metric, True if higher is better, scale, unit)
+METRICS = [
+    ('read_qps', True, 1, ''),
+    ('write_qps', True, 1, ''),
+    ('rows_per_s', True, 1, ''),
+    ('read_p50', False, 1000, 'ms'),
+    ('read_p99', False, 1000, 'ms'),
+    ('write_p50', False, 1000, 'ms'),
+    ('write_p99', False, 1000, 'ms'),
+    ('errors', False, 1, ''),
+]
+
+def load_run(path):
+    run = dict(path=path, header={}, intervals=[], summary=None)
+    with open(path) as fh:
+        for line in fh:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if entry['type'] == 'run':
+                run['header'] = entry
+            elif entry['type'] == 'interval':
+                run['intervals'].append(entry)
+            elif entry['type'] == 'summary':
+                run['summary'] = entry
+    return run
+
+def _betacf(a, b, x):
+    """Continued fraction for the regularized incomplete beta function."""
+    qab, qap, qam = a + b, a + 1.0, a - 1.0
+    c, d = 1.0, 1.0 - qab * x / qap
+    d = 1.0 / (d if abs(d) > 1e-30 else 1e-30)
+    h = d
+    for m in xrange(1, 200):
+        m2 = 2 * m
+        aa = m * (b - m) * x / ((qam + m2) * (a + m2))
+        d = 1.0 + aa * d
+        d = 1.0 / (d if abs(d) > 1e-30 else 1e-30)
+        c = 1.0 + aa / c
+        c = c if abs(c) > 1e-30 else 1e-30
+        h *= d * c
+        aa = -(a + m) * (qab + m) * x / ((a + m2) * (qap + m2))
+        d = 1.0 + aa * d
+        d = 1.0 / (d if abs(d) > 1e-30 else 1e-30)
+        c = 1.0 + aa / c
+        c = c if abs(c) > 1e-30 else 1e-30
+        delta = d * c
+        h *= delta
+        if abs(delta - 1.0) < 3e-12:
+            break
+    return h
+
+def _betai(a, b, x):
+    if x <= 0:
+        return 0.0
+    if x >= 1:
+        return 1.0
+    bt = math.exp(math.lgamma(a + b) - math.lgamma(a) - math.lgamma(b) + a * math.log(x) + b * math.log(1 - x))
+    if x < (a + 1) / (a + b + 2):
+        return bt * _betacf(a, b, x) / a
+    return 1.0 - bt * _betacf(b, a, 1 - x) / b
+
+def mean_var(samples):
+    n = len(samples)
+    mean = sum(samples) / float(n)
+    if n < 2:
+        return mean, 0.0
+    return mean, sum((s - mean) ** 2 for s in samples) / (n - 1)
+
+def welch_p_value(a, b):
+    """Two sided p-value of Welch's t-test for the means of samples a and b."""
+    if len(a) < 2 or len(b) < 2:
+        return 1.0
+    mean_a, var_a = mean_var(a)
+    mean_b, var_b = mean_var(b)
+    se2 = var_a / len(a) + var_b / len(b)
+    if se2 == 0:
+        return 1.0 if mean_a == mean_b else 0.0
+    t = (mean_a - mean_b) / math.sqrt(se2)
+    df = se2 ** 2 / ((var_a / len(a)) ** 2 / (len(a) - 1) + (var_b / len(b)) ** 2 / (len(b) - 1))
+    return _betai(df / 2.0, 0.5, df / (df + t * t))
+
+def samples(run, metric, warmup):
+    """The metric of every interval after warmup, skipping intervals that have no value for it."""
+    return [i[metric] for i in run['intervals'] if i['t'] > warmup and i.get(metric) is not None]
+
+def print_config_diff(base, other):
+    base_config = dict(base['header'].get('config', {}), **base['header'].get('layout', {}))
+    other_config = dict(other['header'].get('config', {}), **other['header'].get('layout', {}))
+    diffs = [k for k in sorted(set(base_config) | set(other_config))
+             if k != 'results' and base_config.get(k) != other_config.get(k)]
+    for k in diffs:
+        print '  %-24s %s -> %s' % (k, base_config.get(k), other_config.get(k))
+    if not diffs:
+        print '  (same config and cluster layout)'
+
+def compare(base, other, args):
+    print
+    print '%s vs %s' % (base['path'], other['path'])
+    print_config_diff(base, other)
+    print
+    print '%-12s %14s %14s %9s %9s  %s' % ('metric', 'baseline', 'candidate', 'change', 'p-value', 'verdict')
+    regressions = 0
+    for metric, higher_is_better, scale, unit in METRICS:
+        a = samples(base, metric, args.warmup)
+        b = samples(other, metric, args.warmup)
+        if not a or not b:
+            continue
+        mean_a, _ = mean_var(a)
+        mean_b, _ = mean_var(b)
+        if mean_a:
+            change = (mean_b - mean_a) / mean_a
+        else:
+            change = 0.0 if mean_b == mean_a else float('inf')
+        p_value = welch_p_value(a, b)
+        worse = change < 0 if higher_is_better else change > 0
+        if p_value < args.alpha and abs(change) >= args.min_change:
+            verdict = 'REGRESSION' if worse else 'improved'
+            if worse:
+                regressions += 1
+        else:
+            verdict = '~'
+        print '%-12s %12.2f%-2s %12.2f%-2s %+8.1f%% %9.4f  %s' % (
+            metric, mean_a * scale, unit, mean_b * scale, unit, change * 100, p_value, verdict)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser('Compare benchmark result files.')
+    parser.add_argument('results', nargs='+', help='Result files, the first one is the baseline.')
+    parser.add_argument('--alpha', type=float, default=0.01,
+                        help='Significance level of the t-test.')
+    parser.add_argument('--min-change', type=float, default=0.05,
+                        help='Smallest relative change worth flagging.')
+    parser.add_argument('--warmup', type=float, default=5,
+                        help='Ignore intervals in the first this many seconds of each run.')
+    args = parser.parse_args()
+    if len(args.results) < 2:
+        parser.error('need at least two result files')
+    runs = [load_run(path) for path in args.results]
+    regressions = 0
+    for other in runs[1:]:
+        regressions += compare(runs[0], other, args)
+    print
+    if regressions:
+        print '%d regression(s) found.' % regressions
+        sys.exit(1)
+    print 'No regressions found.'
+
+if __name__ == '__main__':
+    main()
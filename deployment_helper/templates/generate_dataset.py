@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+
+"""Generates and bulk loads a synthetic messages dataset.
+
+"generate" streams rows for the messages table of database_schema.sql,
+computes each row's keyspace id with the hash vindex of vschema.json and
+appends it to the file of the shard owning that keyspace id:
+
+    generate_dataset.py generate --rows 100000000 --distribution zipfian --out-dir /data/messages
+
+"load" loads every shard file in parallel through vtgate, targeting each
+connection at its shard ("keyspace:shard") so a batch never fans out, and
+reports rows/sec per shard:
+
+    generate_dataset.py load --out-dir /data/messages --host vtgate-host --parallel 8
+"""
+
+import argparse
+import multiprocessing
+import os
+import Queue
+import random
+import sys
+import time
+
+import client_lib
+
+SHARD_FILE_SUFFIX = '.tsv'
+
+def shard_filename(out_dir, shard):
+    return os.path.join(out_dir, '%s%s' % (shard, SHARD_FILE_SUFFIX))
+
+def generate(args):
+    if args.shards:
+        shards = args.shards.split(',')
+    else:
+        shards = client_lib.load_shards(args.config_dir)
+    shard_map = client_lib.ShardMap(shards)
+    try:
+        pages = client_lib.make_key_distribution(dict(type=args.distribution, pages=args.pages, theta=args.theta,
+                                                      hot_fraction=args.hot_fraction, hot_access=args.hot_access))
+    except ValueError as e:
+        print 'ERROR: %s' % e
+        sys.exit(1)
+    min_size = min(args.min_message_size, client_lib.MAX_MESSAGE_SIZE)
+    max_size = min(max(args.max_message_size, min_size), client_lib.MAX_MESSAGE_SIZE)
+    filler = 'V is for speed ' * (client_lib.MAX_MESSAGE_SIZE / 15 + 1)
+
+    if not os.path.isdir(args.out_dir):
+        os.makedirs(args.out_dir)
+    files = dict((shard, open(shard_filename(args.out_dir, shard), 'w')) for shard in shards)
+    counts = dict((shard, 0) for shard in shards)
+    base_ns = int(time.time() * 1e9)
+    start_time = time.time()
+    for i in xrange(args.rows):
+        page = pages.next_page()
+        message = filler[:random.randint(min_size, max_size)]
+        shard = shard_map.shard_for_page(page)
+        # Rows are unique on (page, time_created_ns), so a per-row offset is enough.
+        files[shard].write('%d\t%d\t%s\n' % (page, base_ns + i, message))
+        counts[shard] += 1
+        if (i + 1) % 100000 == 0:
+            elapsed = time.time() - start_time
+            sys.stdout.write('\rgenerated=%d rows/s=%.0f' % (i + 1, (i + 1) / elapsed))
+            sys.stdout.flush()
+    for fh in files.itervalues():
+        fh.close()
+    print
+    print 'Generated %d rows in %.1fs under %s' % (args.rows, time.time() - start_time, args.out_dir)
+    for shard in shards:
+        print '\t%-10s %12d rows  %s' % (shard, counts[shard], shard_filename(args.out_dir, shard))
+
+def load_shard(args, shard, progress):
+    """Loads one shard file with multi-row INSERTs, reporting (shard, rows, done) on progress."""
+    import mysql.connector
+    database = '%s:%s' % (args.keyspace, shard) if args.target_shard else args.keyspace
+    cnx = mysql.connector.connect(host=args.host, port=args.port, user=args.user, password=args.password,
+                                  database=database, charset='utf8', connection_timeout=args.timeout)
+    cursor = cnx.cursor()
+    insert_sql = 'INSERT INTO messages (page, time_created_ns, message) VALUES '
+    rows = []
+    statements = 0
+    loaded = 0
+    with open(shard_filename(args.out_dir, shard)) as fh:
+        for line in fh:
+            page, time_created_ns, message = line.rstrip('\n').split('\t', 2)
+            rows.extend((int(page), int(time_created_ns), message))
+            if len(rows) == 3 * args.batch_rows:
+                cursor.execute(insert_sql + ', '.join(['(%s, %s, %s)'] * args.batch_rows), rows)
+                loaded += args.batch_rows
+                rows = []
+                statements += 1
+                if statements % args.batch_statements == 0:
+                    cnx.commit()
+                    progress.put((shard, loaded, False))
+    if rows:
+        cursor.execute(insert_sql + ', '.join(['(%s, %s, %s)'] * (len(rows) / 3)), rows)
+        loaded += len(rows) / 3
+    cnx.commit()
+    cnx.close()
+    progress.put((shard, loaded, True))
+
+def load_shard_worker(args, shard, progress):
+    try:
+        load_shard(args, shard, progress)
+    except Exception as e:
+        print
+        print 'ERROR: loading shard %s failed: %s' % (shard, e)
+        progress.put((shard, None, True))
+
+def print_load_status(shards, loaded, started, finished, failed):
+    now = time.time()
+    print
+    print '%-10s %12s %12s %8s' % ('shard', 'rows', 'rows/s', 'state')
+    for shard in shards:
+        if shard not in started:
+            state, rate = 'queued', 0.0
+        else:
+            end = finished.get(shard, now)
+            rate = loaded.get(shard, 0) / max(end - started[shard], 1e-6)
+            state = 'failed' if shard in failed else 'done' if shard in finished else 'loading'
+        print '%-10s %12d %12.0f %8s' % (shard, loaded.get(shard, 0), rate, state)
+    total = sum(loaded.values())
+    print '%-10s %12d %12.0f' % ('total', total, total / max(now - min(started.values() or [now]), 1e-6))
+
+def load(args):
+    shards = sorted(f[:-len(SHARD_FILE_SUFFIX)] for f in os.listdir(args.out_dir) if f.endswith(SHARD_FILE_SUFFIX))
+    if not shards:
+        print 'ERROR: no shard files found under %s, run "generate" first' % args.out_dir
+        sys.exit(1)
+    progress = multiprocessing.Queue()
+    pending = list(shards)
+    running = {}
+    started = {}
+    finished = {}
+    loaded = {}
+    failed = []
+    last_report = time.time()
+    while pending or running:
+        while pending and len(running) < args.parallel:
+            shard = pending.pop(0)
+            proc = multiprocessing.Process(target=load_shard_worker, args=(args, shard, progress))
+            proc.start()
+            running[shard] = proc
+            started[shard] = time.time()
+        try:
+            shard, rows, done = progress.get(timeout=1)
+            if rows is None:
+                failed.append(shard)
+            else:
+                loaded[shard] = rows
+            if done:
+                finished[shard] = time.time()
+                running.pop(shard).join()
+        except Queue.Empty:
+            # A loader killed by a signal or the OOM killer never reports done. One that
+            # exited cleanly has posted its last message already and is handled above.
+            for shard, proc in running.items():
+                if not proc.is_alive() and proc.exitcode != 0:
+                    print
+                    print 'ERROR: loader of shard %s exited with %d' % (shard, proc.exitcode)
+                    failed.append(shard)
+                    finished[shard] = time.time()
+                    running.pop(shard).join()
+        if time.time() - last_report >= args.report_interval:
+            print_load_status(shards, loaded, started, finished, failed)
+            last_report = time.time()
+    print_load_status(shards, loaded, started, finished, failed)
+    if failed:
+        print 'ERROR: failed shards: %s' % ' '.join(failed)
+        sys.exit(1)
+
+def main():
+    parser = argparse.ArgumentParser('Generate and load a synthetic messages dataset.')
+    parser.add_argument('action', choices=['generate', 'load'])
+    parser.add_argument('--out-dir', dest='out_dir', default='dataset',
+                        help='Directory holding one <shard>.tsv file per shard.')
+    parser.add_argument('--config-dir', dest='config_dir', default=client_lib.default_config_dir(),
+                        help='Deployment config dir holding vttablet.json.')
+    parser.add_argument('--shards', dest='shards', default=None,
+                        help='Comma separated shards, defaults to the newest shard set in vttablet.json.')
+
+    parser.add_argument('--rows', dest='rows', type=int, default=1000000)
+    parser.add_argument('--pages', dest='pages', type=int, default=100000)
+    parser.add_argument('--distribution', dest='distribution', default='uniform',
+                        choices=['uniform', 'zipfian', 'hotspot'])
+    parser.add_argument('--theta', dest='theta', type=float, default=0.99,
+                        help='Skew of the zipfian distribution.')
+    parser.add_argument('--hot-fraction', dest='hot_fraction', type=float, default=0.2,
+                        help='Share of pages that are hot with the hotspot distribution.')
+    parser.add_argument('--hot-access', dest='hot_access', type=float, default=0.8,
+                        help='Share of rows on hot pages with the hotspot distribution.')
+    parser.add_argument('--min-message-size', dest='min_message_size', type=int, default=14)
+    parser.add_argument('--max-message-size', dest='max_message_size', type=int, default=200)
+
+    parser.add_argument('--host', dest='host', default='localhost')
+    parser.add_argument('--port', dest='port', type=int, default=15306)
+    parser.add_argument('--user', dest='user', default='mysql_user')
+    parser.add_argument('--password', dest='password', default='mysql_password')
+    parser.add_argument('--keyspace', dest='keyspace', default='messagedb')
+    parser.add_argument('--timeout', dest='timeout', type=int, default=15)
+    parser.add_argument('--target-shard', dest='target_shard', type=int, default=1,
+                        help='Connect each loader to "keyspace:shard" so vtgate skips routing, 0 disables.')
+    parser.add_argument('--parallel', dest='parallel', type=int, default=4,
+                        help='Shards loaded at the same time, one process each.')
+    parser.add_argument('--batch-rows', dest='batch_rows', type=int, default=500,
+                        help='Rows per INSERT statement.')
+    parser.add_argument('--batch-statements', dest='batch_statements', type=int, default=10,
+                        help='INSERT statements per transaction.')
+    parser.add_argument('--report-interval', dest='report_interval', type=int, default=10)
+    args = parser.parse_args()
+
+    if args.action == 'generate':
+        generate(args)
+    else:
+        load(args)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+
+# Runs a command in its own cgroup with the CPU and memory limits above,
+# see --isolation. Children, like the mysqld that mysqlctl forks, stay in it.
+#   isolate <name> <memory max MB> <memory protected MB, 0 for none> command...
+function isolate()
+{
+    name=$1-$UNIQUE_ID
+    memory_max=$2
+    memory_low=$3
+    shift 3
+    case "$ISOLATION" in
+    systemd)
+        # systemd keeps a scope that failed, say OOM killed, and would refuse its name on the next start.
+        systemctl reset-failed vitess-$name.scope > /dev/null 2>&1
+        systemd-run --scope --quiet --unit=vitess-$name \
+            -p CPUWeight=$CPU_WEIGHT \
+            ${CPU_QUOTA:+-p CPUQuota=${CPU_QUOTA}%} \
+            ${CPUSET:+-p AllowedCPUs=$CPUSET} \
+            ${MEMS:+-p AllowedMemoryNodes=$MEMS} \
+            -p MemoryMax=${memory_max}M \
+            -p MemoryLow=${memory_low}M \
+            "$@"
+        ;;
+    cgroup)
+        if [ ! -f /sys/fs/cgroup/cgroup.controllers ]; then
+            echo "WARNING: /sys/fs/cgroup is not cgroup v2, running $name without limits."
+            "$@"
+            return
+        fi
+        root=/sys/fs/cgroup/vitess
+        mkdir -p $root/$name 2>/dev/null
+        if [ ! -w $root/$name/cgroup.procs ]; then
+            echo "WARNING: can not write to $root/$name, run as root or delegate it, running $name without limits."
+            "$@"
+            return
+        fi
+        echo "+cpu +cpuset +memory" > /sys/fs/cgroup/cgroup.subtree_control 2>/dev/null
+        echo "+cpu +cpuset +memory" > $root/cgroup.subtree_control
+        echo $CPU_WEIGHT > $root/$name/cpu.weight
+        if [ -n "$CPU_QUOTA" ]; then
+            echo "$((CPU_QUOTA * 1000)) 100000" > $root/$name/cpu.max
+        fi
+        if [ -n "$CPUSET" ]; then
+            echo $CPUSET > $root/$name/cpuset.cpus
+        fi
+        if [ -n "$MEMS" ]; then
+            echo $MEMS > $root/$name/cpuset.mems
+        fi
+        echo $((memory_max * 1048576)) > $root/$name/memory.max
+        echo $((memory_low * 1048576)) > $root/$name/memory.low
+        # Move a subshell into the group and exec the command from it.
+        (echo $BASHPID > $root/$name/cgroup.procs ||
+             echo "WARNING: could not move $name into $root/$name, running it without limits."
+         exec "$@")
+        ;;
+    *)
+        "$@"
+        ;;
+    esac
+}
@@ -2,6 +2,8 @@
 # Variables used below would be assigned values above this line
 
 echo "Stopping MySQL for tablet $ALIAS..."
+# Keeps the supervisor from starting it again.
+touch $VTDATAROOT/$TABLET_DIR/mysqld.down
 $VTROOT/bin/mysqlctl \
     $DBCONFIG_DBA_FLAGS \
     -tablet_uid $UNIQUE_ID \
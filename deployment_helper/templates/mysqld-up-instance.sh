@@ -8,34 +8,121 @@ mkdir -p ${VTDATAROOT}/tmp
 mkdir -p ${BACKUP_DIR}
 
 echo "Starting MySQL for tablet $ALIAS..."
+# Lets the supervisor restart this mysqld again if it dies.
+rm -f $VTDATAROOT/$TABLET_DIR/mysqld.down
 
+# mysqlctl appends the EXTRA_MY_CNF files to the my.cnf it writes for a new tablet.
+if [ -n "$MY_CNF_OVERRIDES" ]; then
+    echo "$MY_CNF_OVERRIDES" > $VTDATAROOT/tmp/my-$UNIQUE_ID.cnf
+    export EXTRA_MY_CNF=${EXTRA_MY_CNF:+$EXTRA_MY_CNF:}$VTDATAROOT/tmp/my-$UNIQUE_ID.cnf
+fi
 
-if [ -d $VTDATAROOT/$TABLET_DIR ]; then
-    echo "Resuming from existing vttablet dir:"
-    echo "    $VTDATAROOT/$TABLET_DIR"
-    action='start'
-    $VTROOT/bin/mysqlctl \
-	-log_dir $VTDATAROOT/tmp \
-	-tablet_uid $UNIQUE_ID \
-	$DBCONFIG_DBA_FLAGS \
-	-mysql_port $MYSQL_PORT \
-	$action &
-else
-    action="init_config"
-    $VTROOT/bin/mysqlctl \
-	-log_dir $VTDATAROOT/tmp \
-	-tablet_uid $UNIQUE_ID \
-	$DBCONFIG_DBA_FLAGS \
-	-mysql_port $MYSQL_PORT \
-	$action &
 
-    action="init -init_db_sql_file $INIT_DB_SQL_FILE"
-    $VTROOT/bin/mysqlctl \
+function mysqlctl_cmd()
+{
+    # Only the commands that leave a mysqld running get isolated.
+    case "$1" in
+    init|start)
+        launch="isolate mysqld $MYSQLD_MEMORY_MAX $MYSQLD_MEMORY_LOW"
+        ;;
+    *)
+        launch=""
+        ;;
+    esac
+    $launch $VTROOT/bin/mysqlctl \
 	-log_dir $VTDATAROOT/tmp \
 	-tablet_uid $UNIQUE_ID \
 	$DBCONFIG_DBA_FLAGS \
 	-mysql_port $MYSQL_PORT \
-	$action &
+	"$@"
+}
+
+function copy_tree()
+{
+    # Copy on write clones where the filesystem supports them (btrfs, xfs, APFS),
+    # a plain copy elsewhere. Hardlinks would not do, InnoDB writes its files in place.
+    cp -a --reflink=auto $1 $2 2>/dev/null || cp -c -R -p $1 $2 2>/dev/null || cp -R -p $1 $2
+}
+
+# One golden data dir per host, mysqld build and init_db.sql, made by the
+# first tablet initialized on the host and copied by all the others.
+GOLDEN_DIR=$VTDATAROOT/golden/$({ cat $INIT_DB_SQL_FILE; ls -l $VT_MYSQL_ROOT/bin/mysqld $VT_MYSQL_ROOT/sbin/mysqld 2>/dev/null; } | cksum | awk '{print $1}')
+
+function init_golden_datadir()
+{
+    echo "Initializing golden data dir $GOLDEN_DIR ..."
+    mysqlctl_cmd init -init_db_sql_file $INIT_DB_SQL_FILE || return 1
+    mysqlctl_cmd shutdown || return 1
+    rm -rf $GOLDEN_DIR.tmp
+    mkdir -p $GOLDEN_DIR.tmp/data $GOLDEN_DIR.tmp/innodb
+    # Copy the contents, data and innodb may be links to another volume.
+    copy_tree $VTDATAROOT/$TABLET_DIR/data/. $GOLDEN_DIR.tmp/data/ || return 1
+    copy_tree $VTDATAROOT/$TABLET_DIR/innodb/. $GOLDEN_DIR.tmp/innodb/ || return 1
+    # Every copy must get its own server uuid.
+    rm -f $GOLDEN_DIR.tmp/data/auto.cnf
+    mv $GOLDEN_DIR.tmp $GOLDEN_DIR
+}
+
+function init_from_golden_datadir()
+{
+    mkdir -p $VTDATAROOT/golden
+    (
+        # flock is missing on OSX, where the tablets of a host start one at a time anyway.
+        command -v flock > /dev/null && flock 9
+        if [ ! -d $GOLDEN_DIR ]; then
+            init_golden_datadir
+        fi
+    ) 9> $VTDATAROOT/golden/lock || return 1
+    # The tablet that made the golden dir is initialized already.
+    if [ ! -f $VTDATAROOT/$TABLET_DIR/my.cnf ]; then
+        echo "Copying golden data dir $GOLDEN_DIR ..."
+        # init_config writes the my.cnf of this tablet (server id, port, paths).
+        mysqlctl_cmd init_config || return 1
+        rm -rf $VTDATAROOT/$TABLET_DIR/data/* $VTDATAROOT/$TABLET_DIR/innodb/*
+        copy_tree $GOLDEN_DIR/data/. $VTDATAROOT/$TABLET_DIR/data/ || return 1
+        copy_tree $GOLDEN_DIR/innodb/. $VTDATAROOT/$TABLET_DIR/innodb/ || return 1
+    fi
+    mysqlctl_cmd start
+}
+
+# Data files and binlogs may go to other volumes than VTDATAROOT. They are
+# linked into the tablet dir before mysqlctl creates the rest of it. The
+# tablet dir is new, so whatever a volume still holds for it is stale.
+function link_tablet_volumes()
+{
+    mkdir -p $VTDATAROOT/$TABLET_DIR
+    if [ -n "$DATA_VOLUME" ]; then
+        for d in data innodb; do
+            rm -rf $DATA_VOLUME/$TABLET_DIR/$d
+            mkdir -p $DATA_VOLUME/$TABLET_DIR/$d
+            ln -sfn $DATA_VOLUME/$TABLET_DIR/$d $VTDATAROOT/$TABLET_DIR/$d
+        done
+    fi
+    if [ -n "$BINLOG_VOLUME" ]; then
+        for d in bin-logs relay-logs; do
+            rm -rf $BINLOG_VOLUME/$TABLET_DIR/$d
+            mkdir -p $BINLOG_VOLUME/$TABLET_DIR/$d
+            ln -sfn $BINLOG_VOLUME/$TABLET_DIR/$d $VTDATAROOT/$TABLET_DIR/$d
+        done
+    fi
+}
+
+if [ -d $VTDATAROOT/$TABLET_DIR ]; then
+    echo "Resuming from existing vttablet dir:"
+    echo "    $VTDATAROOT/$TABLET_DIR"
+    mysqlctl_cmd start
+else
+    link_tablet_volumes
+    if [ $GOLDEN_DATADIR -eq 1 ]; then
+        init_from_golden_datadir
+    else
+        # init also writes the my.cnf, a separate init_config would race with it.
+        mysqlctl_cmd init -init_db_sql_file $INIT_DB_SQL_FILE
+    fi
 fi
+status=$?
 
-wait
+# mysqld_safe restarts the mysqld when it dies, the supervisor only restarts
+# mysqld_safe, so one mysqld at most runs on the data dir.
+pgrep -n -f "mysqld_safe.*--defaults-file=$VTDATAROOT/$TABLET_DIR/my.cnf" > $VTDATAROOT/$TABLET_DIR/mysqld_safe.pid
+exit $status
@@ -0,0 +1,8 @@
+
+# This script stops orchestrator.
+
+set -e
+
+pid=`cat $ORC_DIR/orchestrator.pid`
+echo "Stopping orchestrator..."
+kill $pid
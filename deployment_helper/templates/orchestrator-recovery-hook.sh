@@ -0,0 +1,20 @@
+
+# Variables used below would be assigned values above this line
+
+# Orchestrator runs this around every recovery, see the *Processes hooks in
+# orchestrator.conf.json:
+#   recovery-hook.sh <event> <failure type> <cluster> <failed host:port> <successor alias>
+# Each call is logged with a timestamp. Once Orchestrator has promoted a new
+# master, vtctld is told so vtgates send the writes of the shard to it.
+
+event=$1
+failure_type=$2
+cluster=$3
+failed=$4
+successor=$5
+
+echo "$(date +%s) $event $failure_type $cluster $failed $successor" >> $RECOVERY_LOG
+if [ "$event" == "promoted" -a -n "$successor" ]; then
+    $VTROOT/bin/vtctlclient -server $VTCTLD_SERVER TabletExternallyReparented $successor >> $RECOVERY_LOG 2>&1
+    echo "$(date +%s) reparented $successor exit $?" >> $RECOVERY_LOG
+fi
@@ -0,0 +1,23 @@
+
+# Variables used below would be assigned values above this line
+
+mkdir -p $ORC_DIR
+
+printf "%s" "$ORC_CONFIG" > $ORC_DIR/orchestrator.conf.json
+printf "%s" "$ORC_RECOVERY_HOOK" > $ORC_DIR/recovery-hook.sh
+chmod +x $ORC_DIR/recovery-hook.sh
+
+echo "Starting orchestrator..."
+
+# Orchestrator serves its web UI from resources/ under its install dir.
+cd $ORCHESTRATOR_ROOT
+$ORCHESTRATOR_ROOT/orchestrator \
+  -config $ORC_DIR/orchestrator.conf.json \
+  http \
+  > $ORC_DIR/orchestrator.out 2>&1 &
+echo $! > $ORC_DIR/orchestrator.pid
+
+disown -a
+
+echo "Access orchestrator at http://${HOSTNAME}:${ORC_PORT}"
+echo Note: recoveries are logged to $ORC_DIR/recovery.log.
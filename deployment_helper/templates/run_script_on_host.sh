@@ -36,6 +36,48 @@ function is_local()
     echo 0
 }
 
+# deployment_helper.py --profile sets DEPLOYMENT_HELPER_TIMING_FILE and reads
+# one "host script start end exit_code" line per run back from it.
+function record_timing()
+{
+    if [ -n "$DEPLOYMENT_HELPER_TIMING_FILE" ]; then
+        printf "%s\t%s\t%s\t%s\t%s\n" "$1" "$2" "$3" "$(date +%s.%N)" "$4" >> $DEPLOYMENT_HELPER_TIMING_FILE
+    fi
+}
+
+# Every run appends one JSON line to the event log, by default log/events.jsonl
+# next to the bin dir, see "deployment_helper.py --action summarize_events".
+# The write happens in the background so it does not hold up the caller.
+EVENT_LOG=${DEPLOYMENT_HELPER_EVENT_LOG:-$(cd $(dirname $0)/.. && pwd)/log/events.jsonl}
+
+function record_event()
+{
+    host=$1
+    script_file=$2
+    start=$3
+    exit_code=$4
+    end=$(date +%s.%N)
+    name=$(basename $script_file .sh)
+    component=${name%%-*}
+    rest=${name#*-}
+    command=${rest%%-*}
+    instance=""
+    if [[ "$name" == *-instance-* ]]; then
+        instance=${name##*-instance-}
+    fi
+    (
+        mkdir -p $(dirname $EVENT_LOG)
+        printf '{"run_id": "%s", "host": "%s", "component": "%s", "instance": "%s", "command": "%s", "script": "%s", "start": %s, "end": %s, "exit_code": %d, "local": %d, "ssh_failed": %d, "bytes": %d}\n' \
+            "$DEPLOYMENT_HELPER_RUN_ID" "$host" "$component" "$instance" "$command" "$script_file" \
+            "${start%.N}" "${end%.N}" "$exit_code" "$local" "$ssh_failed" "$bytes_sent" >> $EVENT_LOG
+    ) &
+}
+
+function file_size()
+{
+    wc -c < $1 | tr -d ' '
+}
+
 function log()
 {
     if [ $VERBOSE -eq 1 ]; then
@@ -54,13 +96,16 @@ function run_script_file()
         echo Running $script_file locally
 	set -m
         $script_file
+        rc=$?
 	set +m
+        return $rc
     else
         can_not_ssh=$(check_ssh $host)
         if [ $can_not_ssh -ne 0 ]; then
+            ssh_failed=1
             echo Unable to ssh to $host
             echo Failed to run $script_file on $host
-            exit $can_not_ssh
+            return $can_not_ssh
         fi
         echo Running $script_file remotely on $host
         cmd_dir=$(dirname $script_file)
@@ -68,12 +113,14 @@ function run_script_file()
         ssh $SSH_OPTS $host -- mkdir -p $cmd_dir
         log Copying $script_file to $host
         scp $SSH_OPTS $script_file $host:$script_file
+        bytes_sent=$(file_size $script_file)
         if [ "$config_file" != "" ]; then
             config_dir=$(dirname $config_file)
             log Making $config_dir on $host
             ssh $SSH_OPTS $host -- mkdir -p $config_dir
             log Copying $config_file to $host
             scp $SSH_OPTS $config_file $host:$config_file
+            bytes_sent=$((bytes_sent + $(file_size $config_file)))
         fi
         log Starting $script_file on $host
         ssh $SSH_OPTS $host -- $script_file
@@ -81,5 +128,13 @@ function run_script_file()
 }
 
 VERBOSE=0
+local=0
+ssh_failed=0
+bytes_sent=0
 
+start_time=$(date +%s.%N)
 run_script_file $1 $2 $3
+exit_code=$?
+record_timing $1 $2 $start_time $exit_code
+record_event $1 $2 $start_time $exit_code
+exit $exit_code
@@ -90,9 +90,11 @@ for shard in $new_shards; do
     %(deployment_dir)s/bin/mysqld-up-shard-${shard}.sh
     sleep 2
     %(deployment_dir)s/bin/vttablet-up-shard-${shard}.sh
-    sleep 2
 done
 
+echo Waiting for the new tablets to come up
+python $DIR/wait_for_lag.py --shards "$new_shards" --timeout 300
+
 cat << EOF
 
 Now, if we run the following command, we  should be able to see tablets for all old and new shards.
@@ -105,7 +107,7 @@ cat << EOF
 Once the tablets are ready, initialize replication by electing the first master for each of the new shards:
 EOF
 for shard in $new_shards; do
-    tablet=$($VTROOT/bin/vtctlclient -server %(vtctld_host)s:15999 ListShardTablets %(keyspace)s/$shard | head -1 | awk '{print $1}')
+    tablet=$($VTROOT/bin/vtctlclient -server %(vtctld_host)s:15999 ListShardTablets %(keyspace)s/$shard | grep "^%(cell)s-" | head -1 | awk '{print $1}')
     run_interactive "$VTROOT/bin/vtctlclient -server %(vtctld_host)s:15999 InitShardMaster -force %(keyspace)s/$shard $tablet"
 done
 
@@ -192,13 +194,19 @@ cat << EOF
 Now we are ready to switch over to serving from the new shards.
 The MigrateServedTypes command lets you do this one tablet type at a time, and even one cell at a time.
 The process can be rolled back at any point until the master is switched over.
+
+Each switch waits until filtered replication into the new shards has caught up,
+so the new shards serve the same data the original ones did.
 EOF
 
 for shard in $orig_shards; do
+    python $DIR/wait_for_lag.py --shards "$new_shards" --max-lag 2
     run_interactive "$VTROOT/bin/vtctlclient -server %(vtctld_host)s:15999 MigrateServedTypes %(keyspace)s/$shard rdonly"
 
+    python $DIR/wait_for_lag.py --shards "$new_shards" --max-lag 2
     run_interactive "$VTROOT/bin/vtctlclient -server %(vtctld_host)s:15999 MigrateServedTypes %(keyspace)s/$shard replica"
 
+    python $DIR/wait_for_lag.py --shards "$new_shards" --max-lag 2
     run_interactive "$VTROOT/bin/vtctlclient -server %(vtctld_host)s:15999 MigrateServedTypes %(keyspace)s/$shard master"
 done
 
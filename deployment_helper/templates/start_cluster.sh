@@ -55,8 +55,8 @@ echo The vttablet-up.sh script brings up vttablets, for all shards
 echo
 run_interactive "$DIR/vttablet-up.sh"
 echo
-echo Waiting a bit, for the tablet servers to catch up
-sleep 5
+echo Waiting for the tablet servers to come up
+python $DIR/wait_for_lag.py --timeout 300 || exit 1
 echo
 echo Next, designate one of the tablets to be the initial master.
 echo Vitess will automatically connect the other slaves' mysqld instances so that they start replicating from the master's mysqld.
@@ -68,7 +68,7 @@ first_orig_shard=$(echo $orig_shards | cut  -d " " -f1)
 num_orig_shards=$(echo $orig_shards | wc -w)
 
 for shard in $orig_shards; do
-    tablet=$($VTROOT/bin/vtctlclient -server %(vtctld_host)s:15999 ListShardTablets %(keyspace)s/$shard | head -1 | awk '{print $1}')
+    tablet=$($VTROOT/bin/vtctlclient -server %(vtctld_host)s:15999 ListShardTablets %(keyspace)s/$shard | grep "^%(cell)s-" | head -1 | awk '{print $1}')
     run_interactive "$VTROOT/bin/vtctlclient -server %(vtctld_host)s:15999 InitShardMaster -force %(keyspace)s/$shard $tablet"
 done
 
@@ -83,7 +83,18 @@ echo
 echo The vtctlclient tool can be used to apply the database schema across all tablets in a keyspace.
 echo The following command creates the table defined in the database_schema.sql file
 run_interactive '$VTROOT/bin/vtctlclient -server %(vtctld_host)s:15999 ApplySchema -sql "$(cat $DIR/../config/database_schema.sql)" %(keyspace)s'
-sleep 2
+echo
+echo Waiting for every tablet to have the schema of its master, so the backup includes it
+# Lag is no proof, a replica can report none before the ApplySchema statements reach it.
+schema_deadline=$((SECONDS + 300))
+until $VTROOT/bin/vtctlclient -server %(vtctld_host)s:15999 ValidateSchemaKeyspace %(keyspace)s > /dev/null 2>&1; do
+    if [ $SECONDS -ge $schema_deadline ]; then
+        echo "ERROR: The tablets of %(keyspace)s still differ from their masters' schema after 300s:"
+        $VTROOT/bin/vtctlclient -server %(vtctld_host)s:15999 ValidateSchemaKeyspace %(keyspace)s
+        exit 1
+    fi
+    sleep 2
+done
 echo
 echo "Now that the initial schema is applied, it's a good time to take the first backup. This backup will be used to automatically restore any additional replicas that you run, before they connect themselves to the master and catch up on replication. If an existing tablet goes down and comes back up without its data, it will also automatically restore from the latest backup and then resume replication."
 
@@ -119,7 +130,7 @@ fi
 
 echo Start vtgate
 
-echo Vitess uses vtgate to route each client query to the correct vttablet. This local example runs a single vtgate instance, though a real deployment would likely run multiple vtgate instances to share the load.
+echo Vitess uses vtgate to route each client query to the correct vttablet. Several vtgate instances share the load, clients can balance over them with bin/haproxy-vtgate.cfg or the endpoints in config/vtgate_endpoints.json.
 run_interactive "$DIR/vtgate-up.sh"
 
 echo
@@ -138,7 +149,7 @@ You can now explore the cluster:
 
 %(tablet_urls)s
 
-    Access vtgate at http://%(vtgate_host)s:15001/debug/status
+%(vtgate_urls)s
     Connect to vtgate either at grpc_port or mysql_port and run queries against vitess.
 
     Note: Vitess binaries write write logs under $VTDATAROOT/tmp.
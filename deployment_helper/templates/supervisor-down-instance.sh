@@ -0,0 +1,13 @@
+
+# Variables used below would be assigned values above this line
+
+# Only the supervisor stops, the processes it watches keep running.
+if [ ! -f $SUPERVISOR_DIR/supervisor.pid ]; then
+    echo "No supervisor running on $HOSTNAME"
+    exit 0
+fi
+pid=`cat $SUPERVISOR_DIR/supervisor.pid`
+echo "Stopping supervisor on $HOSTNAME..."
+kill $pid 2>/dev/null
+while ps -p $pid > /dev/null; do sleep 1; done
+rm -f $SUPERVISOR_DIR/supervisor.pid
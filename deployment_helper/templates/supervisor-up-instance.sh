@@ -0,0 +1,27 @@
+
+# Variables used below would be assigned values above this line
+
+mkdir -p $SUPERVISOR_DIR
+
+# A running supervisor is replaced, the processes it watches keep running
+# and the new one adopts them through their pid files.
+if [ -f $SUPERVISOR_DIR/supervisor.pid ]; then
+    pid=`cat $SUPERVISOR_DIR/supervisor.pid`
+    if kill $pid 2>/dev/null; then
+        echo "Stopping the running supervisor..."
+        while ps -p $pid > /dev/null; do sleep 1; done
+    fi
+fi
+
+printf "%s" "$SUPERVISOR_PY" > $SUPERVISOR_DIR/supervisor.py
+printf "%s" "$SUPERVISOR_CONFIG" > $SUPERVISOR_DIR/supervisor.json
+
+echo "Starting supervisor for $NUM_PROCESSES processes on $HOSTNAME..."
+python $SUPERVISOR_DIR/supervisor.py --config $SUPERVISOR_DIR/supervisor.json \
+    > $SUPERVISOR_DIR/supervisor.out 2>&1 &
+echo $! > $SUPERVISOR_DIR/supervisor.pid
+
+disown -a
+
+echo "Process status at http://127.0.0.1:$SUPERVISOR_PORT/ on $HOSTNAME"
+echo Note: the supervisor logs to $SUPERVISOR_DIR/supervisor.out.
@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+
+"""Keeps the mysqld, vttablet and vtgate processes of a host running.
+
+Reads the processes to watch from the JSON config deployment_helper.py
+writes for the host, each with the instance script that starts it, its pid
+file and a down file the stop scripts create. A mysqld is watched through
+its mysqld_safe, which restarts the mysqld itself. Processes that are already
+running are adopted through their pid file, so the supervisor can be
+restarted without touching them. A process that dies while its down file
+does not exist is started again by its script, right away the first time
+and with exponential backoff while it keeps dying within stable_time
+seconds of being started. Uptime and restart counts of every process are
+served as JSON on 127.0.0.1:
+
+    supervisor.py --config supervisor.json
+    curl -s http://127.0.0.1:15500/
+"""
+
+import argparse
+import BaseHTTPServer
+import errno
+import json
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+def log(msg):
+    print '%s %s' % (time.strftime('%Y-%m-%d %H:%M:%S'), msg)
+    sys.stdout.flush()
+
+def read_pid(pid_file):
+    try:
+        with open(pid_file) as fh:
+            return int(fh.read().strip())
+    except (IOError, ValueError):
+        return None
+
+def is_running(pid, command):
+    """True if pid is alive and, where /proc exists, runs command."""
+    if pid is None:
+        return False
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        if e.errno != errno.EPERM:
+            return False
+    cmdline = '/proc/%d/cmdline' % pid
+    if os.path.isdir('/proc/self'):
+        # The pid of a stale pid file may have been reused by another process.
+        try:
+            with open(cmdline) as fh:
+                return command in fh.read()
+        except IOError:
+            return False
+    return True
+
+class Process(object):
+    """One supervised process and its restart history."""
+
+    def __init__(self, config, settings, log_dir):
+        self.name = config['name']
+        self.command = config['command']
+        self.up = config['up']
+        self.pid_file = config['pid_file']
+        self.down_file = config['down_file']
+        self.settings = settings
+        self.log_file = os.path.join(log_dir, '%s.log' % self.name)
+        self.state = 'unknown'
+        self.pid = None
+        self.started = None
+        self.restarts = 0
+        self.failures = 0
+        self.last_exit = None
+        self.next_start = 0
+        self.starter = None
+
+    def backoff(self):
+        """Seconds to wait before the next start, 0 after a crash of a process that was up long enough."""
+        if self.failures == 0:
+            return 0
+        return min(self.settings['min_backoff'] * 2 ** (self.failures - 1), self.settings['max_backoff'])
+
+    def start(self, now):
+        log('%s: starting with %s' % (self.name, ' '.join(self.up)))
+        with open(self.log_file, 'a') as out:
+            # Its own session, so signals sent to the supervisor do not reach the process.
+            self.starter = subprocess.Popen(['bash'] + self.up, stdout=out, stderr=subprocess.STDOUT,
+                                            close_fds=True, preexec_fn=os.setsid)
+        # The first start of a process that was not running is not a restart.
+        if self.state != 'unknown':
+            self.restarts += 1
+        self.state = 'starting'
+
+    def failed(self, now, reason):
+        self.last_exit = now
+        self.next_start = now + self.backoff()
+        self.failures += 1
+        self.state = 'backoff'
+        self.pid = None
+        self.started = None
+        log('%s: %s, next start in %.0fs' % (self.name, reason, self.next_start - now))
+
+    def check(self, now):
+        if self.starter is not None:
+            if self.starter.poll() is None:
+                return
+            code = self.starter.returncode
+            self.starter = None
+            pid = read_pid(self.pid_file)
+            if code == 0 and is_running(pid, self.command):
+                self.adopt(pid, now, 'started')
+            elif code == 0:
+                # vttablet and vtgate write their pid file a moment after the script returns.
+                self.state = 'waiting'
+                self.wait_until = now + self.settings['start_timeout']
+            else:
+                self.failed(now, 'start script exited with %d' % code)
+            return
+
+        pid = read_pid(self.pid_file)
+        if is_running(pid, self.command):
+            if pid != self.pid:
+                self.adopt(pid, now, 'adopted' if self.state in ('unknown', 'down') else 'started')
+            elif self.failures and now - self.started >= self.settings['stable_time']:
+                self.failures = 0
+            return
+
+        if os.path.exists(self.down_file):
+            if self.state != 'down':
+                log('%s: stopped, down file %s exists' % (self.name, self.down_file))
+            self.state = 'down'
+            self.pid = None
+            self.started = None
+            self.failures = 0
+            return
+        if self.state == 'down':
+            # Give the start script that removed the down file time to start the process.
+            self.state = 'waiting'
+            self.wait_until = now + self.settings['start_timeout']
+        if self.state == 'waiting':
+            if now < self.wait_until:
+                return
+            self.failed(now, 'no pid in %s after start' % self.pid_file)
+        elif self.state == 'running':
+            if now - self.started >= self.settings['stable_time']:
+                self.failures = 0
+            self.failed(now, 'pid %d exited' % self.pid)
+        if self.state in ('unknown', 'backoff') and now >= self.next_start:
+            self.start(now)
+
+    def adopt(self, pid, now, how):
+        self.pid = pid
+        # An adopted process has been up since it wrote its pid file.
+        self.started = now if how == 'started' else min(now, os.path.getmtime(self.pid_file))
+        self.state = 'running'
+        log('%s: %s pid %d' % (self.name, how, pid))
+
+    def status(self, now):
+        return dict(name=self.name, state=self.state, pid=self.pid,
+                    uptime=round(now - self.started, 1) if self.started else None,
+                    restarts=self.restarts, failures=self.failures,
+                    last_exit=self.last_exit, backoff=self.backoff())
+
+class Supervisor(object):
+
+    def __init__(self, config):
+        self.config = config
+        self.settings = dict(min_backoff=1, max_backoff=60, stable_time=60, start_timeout=30, interval=1)
+        self.settings.update(config.get('settings', {}))
+        log_dir = config.get('log_dir', '.')
+        if not os.path.isdir(log_dir):
+            os.makedirs(log_dir)
+        self.processes = [Process(p, self.settings, log_dir) for p in config['processes']]
+        self.started = time.time()
+
+    def run(self):
+        log('Supervising %d processes: %s' % (len(self.processes), ' '.join(p.name for p in self.processes)))
+        while True:
+            now = time.time()
+            for process in self.processes:
+                try:
+                    process.check(now)
+                except Exception as e:
+                    log('%s: check failed: %s' % (process.name, e))
+            time.sleep(self.settings['interval'])
+
+    def status(self):
+        now = time.time()
+        return dict(host=self.config.get('host'), uptime=round(now - self.started, 1),
+                    processes=[p.status(now) for p in self.processes])
+
+def serve_status(supervisor, port):
+    class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = json.dumps(supervisor.status(), indent=2)
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = BaseHTTPServer.HTTPServer(('127.0.0.1', port), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    log('Status on http://127.0.0.1:%d/' % port)
+
+def main():
+    parser = argparse.ArgumentParser('Restart the crashed Vitess processes of a host.')
+    parser.add_argument('--config', dest='config', required=True,
+                        help='JSON config with the processes of the host.')
+    parser.add_argument('--port', dest='port', type=int, default=None,
+                        help='Port of the status endpoint on 127.0.0.1, defaults to the one in the config.')
+    args = parser.parse_args()
+
+    with open(args.config) as fh:
+        config = json.load(fh)
+    supervisor = Supervisor(config)
+    # The supervised processes keep running when the supervisor is stopped.
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    serve_status(supervisor, args.port or config['port'])
+    supervisor.run()
+
+if __name__ == '__main__':
+    main()
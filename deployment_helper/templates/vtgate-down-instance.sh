@@ -3,6 +3,8 @@
 
 set -e
 
-pid=`cat $VTDATAROOT/tmp/vtgate.pid`
-echo "Stopping vtgate..."
+pid=`cat $VTGATE_DIR/vtgate.pid`
+echo "Stopping vtgate on port $WEB_PORT..."
+# Keeps the supervisor from starting it again.
+touch $VTGATE_DIR/vtgate.down
 kill $pid
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+
+"""Measures how client throughput scales with the number of vtgates.
+
+Runs client_grpc.py through client.sh unthrottled against the first 1, 2,
+4, ... vtgates of vtgate_endpoints.json with the same number of sessions
+per vtgate, and prints the throughput of each step next to what linear
+scaling from a single vtgate would give:
+
+    vtgate_scaling.py --max-vtgates 8 --sessions-per-vtgate 16 --duration 60
+
+The per-step result files are kept under --out-dir for compare_results.py.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+import client_lib
+
+def vtgate_counts(max_vtgates):
+    """1, 2, 4, ... up to and including max_vtgates."""
+    counts = []
+    n = 1
+    while n < max_vtgates:
+        counts.append(n)
+        n *= 2
+    counts.append(max_vtgates)
+    return counts
+
+def read_summary(path):
+    with open(path) as fh:
+        for line in fh:
+            entry = json.loads(line)
+            if entry['type'] == 'summary':
+                return entry
+    return None
+
+def run_step(args, num_vtgates):
+    results = os.path.join(args.out_dir, 'vtgates-%d.jsonl' % num_vtgates)
+    client = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'client.sh')
+    cmd = ['bash', client, '--vtgates', str(num_vtgates), '--config-dir', args.config_dir,
+           '--sessions', str(num_vtgates * args.sessions_per_vtgate), '--qps', '0',
+           '--read-write-ratio', str(args.read_write_ratio),
+           '--duration', str(args.duration), '--results', results]
+    print 'Running: %s' % ' '.join(cmd)
+    with open(os.devnull, 'w') as devnull:
+        if subprocess.call(cmd, stdout=devnull) != 0:
+            print 'ERROR: client failed with %d vtgates' % num_vtgates
+            sys.exit(1)
+    return read_summary(results)
+
+def main():
+    parser = argparse.ArgumentParser('Benchmark throughput against the number of vtgates.')
+    parser.add_argument('--config-dir', dest='config_dir', default=client_lib.default_config_dir(),
+                        help='Deployment config dir holding vtgate_endpoints.json.')
+    parser.add_argument('--max-vtgates', dest='max_vtgates', type=int, default=0,
+                        help='Largest number of vtgates to run against, defaults to all of them.')
+    parser.add_argument('--sessions-per-vtgate', dest='sessions_per_vtgate', type=int, default=16)
+    parser.add_argument('--read-write-ratio', dest='read_write_ratio', type=float, default=0.8)
+    parser.add_argument('--duration', dest='duration', type=int, default=60,
+                        help='Seconds each step runs.')
+    parser.add_argument('--out-dir', dest='out_dir', default='vtgate_scaling',
+                        help='Directory for the result file of each step.')
+    args = parser.parse_args()
+
+    endpoints = client_lib.load_vtgate_endpoints(args.config_dir)
+    if not endpoints:
+        print 'ERROR: no vtgates in %s, run deployment_helper.py --action generate first' % args.config_dir
+        sys.exit(1)
+    max_vtgates = min(args.max_vtgates or len(endpoints), len(endpoints))
+    if not os.path.isdir(args.out_dir):
+        os.makedirs(args.out_dir)
+
+    rows = []
+    for num_vtgates in vtgate_counts(max_vtgates):
+        summary = run_step(args, num_vtgates)
+        if summary is None:
+            print 'ERROR: no summary written with %d vtgates' % num_vtgates
+            sys.exit(1)
+        rows.append((num_vtgates, summary))
+
+    base_qps = rows[0][1]['read_qps'] + rows[0][1]['write_qps']
+    print
+    print '%8s %10s %12s %10s %10s %10s %8s' % (
+        'vtgates', 'qps', 'qps/vtgate', 'scaling', 'read_p99', 'write_p99', 'errors')
+    for num_vtgates, summary in rows:
+        qps = summary['read_qps'] + summary['write_qps']
+        print '%8d %10.0f %12.0f %9.0f%% %8.1fms %8.1fms %8d' % (
+            num_vtgates, qps, qps / num_vtgates, 100.0 * qps / max(base_qps * num_vtgates, 1e-6),
+            summary['read_p99'] * 1000, summary['write_p99'] * 1000, summary['errors'])
+
+if __name__ == '__main__':
+    main()
@@ -2,6 +2,8 @@
 # Variables used below would be assigned values above this line
 
 echo "Stopping vttablet for $ALIAS..."
+# Keeps the supervisor from starting it again.
+touch $VTDATAROOT/$TABLET_DIR/vttablet.down
 pid=`cat $VTDATAROOT/$TABLET_DIR/vttablet.pid`
 kill $pid
 
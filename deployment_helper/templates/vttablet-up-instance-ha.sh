@@ -13,7 +13,7 @@ echo "Starting vttablet for $ALIAS..."
 
 $VTROOT/bin/vttablet \
     $TOPOLOGY_FLAGS \
-    -log_dir $VTDATAROOT/tmp \
+    -log_dir $VTDATAROOT/$TABLET_DIR \
     -tablet-path $ALIAS \
     -tablet_hostname "$HOSTNAME" \
     -init_keyspace $KEYSPACE \
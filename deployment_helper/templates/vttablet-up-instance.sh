@@ -12,17 +12,16 @@ BACKUP_PARAMS=${BACKUP_PARAMS_FILE}
 export LD_LIBRARY_PATH=${VTROOT}/dist/grpc/usr/local/lib
 export PATH=${VTROOT}/bin:${VTROOT}/.local/bin:${VTROOT}/dist/chromedriver:${VTROOT}/bin:/usr/local/sbin:/usr/local/bin:/usr/sbin:/usr/bin:/sbin:/bin:/usr/games:/usr/local/games:/snap/bin:/usr/local/go/bin:/usr/local/mysql/bin
 
-ORC_HOST=${VTCTLD_HOST}
-ORC_PORT=30000
-
 mkdir -p ${VTDATAROOT}/tmp
 mkdir -p ${BACKUP_DIR}
 
 echo "Starting vttablet for $ALIAS..."
+# Lets the supervisor restart this vttablet again if it dies.
+rm -f $VTDATAROOT/$TABLET_DIR/vttablet.down
 
-$VTROOT/bin/vttablet \
+isolate vttablet $VTTABLET_MEMORY_MAX 0 $VTROOT/bin/vttablet \
     $TOPOLOGY_FLAGS \
-    -log_dir $VTDATAROOT/tmp \
+    -log_dir $VTDATAROOT/$TABLET_DIR \
     -tablet-path $ALIAS \
     -tablet_hostname "$HOSTNAME" \
     -init_keyspace $KEYSPACE \
@@ -31,6 +30,7 @@ $VTROOT/bin/vttablet \
     -init_db_name_override $DBNAME \
     -mycnf_mysql_port $MYSQL_PORT \
     -health_check_interval 5s \
+    $QUERYSERVER_FLAGS \
     $BACKUP_PARAMS \
     -binlog_use_v3_resharding_mode \
     -port $WEB_PORT \
@@ -38,6 +38,7 @@ $VTROOT/bin/vttablet \
     -service_map 'grpc-queryservice,grpc-tabletmanager,grpc-updatestream' \
     -pid_file $VTDATAROOT/$TABLET_DIR/vttablet.pid \
     -vtctld_addr http://${VTCTLD_HOST}:${VTCTLD_WEB_PORT}/ \
+    -init_populate_metadata \
     -orc_api_url http://${ORC_HOST}:${ORC_PORT}/api \
     -orc_discover_interval "2m" \
     $DBCONFIG_FLAGS \
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+
+"""Blocks until the tablets of some shards are up and caught up on replication.
+
+Polls /debug/vars of every tablet of the given shards concurrently and
+exits 0 once each one answers and its replication lag is at most --max-lag
+seconds, or 1 after --timeout. Both regular replication
+(SecondsBehindMaster) and filtered replication into the destination shards
+of a resharding (BinlogPlayerSecondsBehindMaster) are checked. Progress
+and an ETA derived from how fast lag is falling are printed while waiting:
+
+    wait_for_lag.py --shards -80,80- --max-lag 2 --timeout 600
+"""
+
+import argparse
+from multiprocessing.pool import ThreadPool
+import sys
+import time
+
+import client_lib
+
+LAG_VARS = ['SecondsBehindMaster', 'BinlogPlayerSecondsBehindMaster']
+
+def tablet_lag(tablet_and_timeout):
+    """Returns the replication lag of a tablet in seconds, None if it can not be reached."""
+    tablet, timeout = tablet_and_timeout
+    try:
+        dvars = client_lib.fetch_debug_vars(tablet['host'], tablet['web_port'], timeout)
+    except Exception:
+        return None
+    lags = [dvars[v] for v in LAG_VARS if isinstance(dvars.get(v), (int, long, float))]
+    return max(lags or [0])
+
+class LagMonitor(object):
+    """Tracks the lag of a set of tablets and estimates when all of them are caught up."""
+
+    def __init__(self, tablets, max_lag, concurrency, timeout):
+        self.tablets = tablets
+        self.max_lag = max_lag
+        self.timeout = timeout
+        self.pool = ThreadPool(max(1, min(concurrency, len(tablets))))
+        self.history = []
+
+    def poll(self):
+        """Returns {alias: lag or None} and remembers the worst lag for the ETA."""
+        lags = self.pool.map(tablet_lag, [(t, self.timeout) for t in self.tablets])
+        lags = dict((t['alias'], lag) for t, lag in zip(self.tablets, lags))
+        reachable = [lag for lag in lags.itervalues() if lag is not None]
+        if reachable:
+            self.history.append((time.time(), max(reachable)))
+            self.history = self.history[-30:]
+        return lags
+
+    def caught_up(self, lags):
+        return [alias for alias, lag in lags.iteritems() if lag is not None and lag <= self.max_lag]
+
+    def eta(self):
+        """Seconds until the worst lag reaches --max-lag at the recent rate, None if it is not falling."""
+        if len(self.history) < 2:
+            return None
+        (t0, lag0), (t1, lag1) = self.history[0], self.history[-1]
+        rate = (lag0 - lag1) / max(t1 - t0, 1e-6)
+        if rate <= 0:
+            return None
+        return max(lag1 - self.max_lag, 0) / rate
+
+def progress_line(monitor, lags, tablets_by_alias, elapsed):
+    done = monitor.caught_up(lags)
+    down = [alias for alias, lag in lags.iteritems() if lag is None]
+    line = '%5.0fs %d/%d tablets caught up' % (elapsed, len(done), len(lags))
+    if down:
+        line += ', %d unreachable' % len(down)
+    lagging = [(lag, alias) for alias, lag in lags.iteritems() if lag is not None and lag > monitor.max_lag]
+    if lagging:
+        lag, alias = max(lagging)
+        line += ', max lag %ds on %s (%s)' % (lag, alias, tablets_by_alias[alias]['shard'])
+        eta = monitor.eta()
+        line += ', ETA %ds' % eta if eta is not None else ', ETA unknown'
+    return line
+
+def main():
+    parser = argparse.ArgumentParser('Wait for tablets to be up and caught up on replication.')
+    parser.add_argument('--config-dir', dest='config_dir', default=client_lib.default_config_dir(),
+                        help='Deployment config dir holding vttablet.json.')
+    parser.add_argument('--shards', dest='shards', default=None,
+                        help='Comma separated shards to wait for, defaults to every shard in vttablet.json.')
+    parser.add_argument('--tablet-types', dest='tablet_types', default='master,replica,rdonly',
+                        help='Comma separated tablet types to wait for.')
+    parser.add_argument('--max-lag', dest='max_lag', type=float, default=2,
+                        help='Seconds of replication lag considered caught up.')
+    parser.add_argument('--timeout', dest='timeout', type=float, default=600,
+                        help='Give up and exit 1 after this many seconds, 0 waits forever.')
+    parser.add_argument('--interval', dest='interval', type=float, default=1)
+    parser.add_argument('--concurrency', dest='concurrency', type=int, default=32,
+                        help='Tablets polled at the same time.')
+    parser.add_argument('--fetch-timeout', dest='fetch_timeout', type=float, default=1,
+                        help='Timeout in seconds of each /debug/vars fetch.')
+    args = parser.parse_args()
+
+    tablets = client_lib.load_tablets(args.config_dir)
+    if args.shards:
+        shards = args.shards.replace(' ', ',').split(',')
+        tablets = [t for t in tablets if t['shard'] in shards]
+    tablet_types = args.tablet_types.split(',')
+    tablets = [t for t in tablets if t['ttype'] in tablet_types]
+    if not tablets:
+        print 'ERROR: no %s tablets for shards %s in %s' % (args.tablet_types, args.shards, args.config_dir)
+        sys.exit(1)
+    tablets_by_alias = dict((t['alias'], t) for t in tablets)
+
+    monitor = LagMonitor(tablets, args.max_lag, args.concurrency, args.fetch_timeout)
+    start_time = time.time()
+    print 'Waiting for %d tablets to be up with replication lag <= %gs' % (len(tablets), args.max_lag)
+    while True:
+        lags = monitor.poll()
+        elapsed = time.time() - start_time
+        sys.stdout.write('\r%-100s' % progress_line(monitor, lags, tablets_by_alias, elapsed))
+        sys.stdout.flush()
+        if len(monitor.caught_up(lags)) == len(tablets):
+            print
+            print 'All tablets caught up after %.0fs' % elapsed
+            return
+        if args.timeout and elapsed >= args.timeout:
+            print
+            print 'ERROR: gave up after %.0fs, not caught up: %s' % (
+                elapsed, ' '.join(sorted(set(lags) - set(monitor.caught_up(lags)))))
+            sys.exit(1)
+        time.sleep(args.interval)
+
+if __name__ == '__main__':
+    main()
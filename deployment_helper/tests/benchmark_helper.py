@@ -0,0 +1,248 @@
+"""Benchmarks deployment_helper placement and script generation.
+
+Runs make_shards, distribute_tablets, config gathering/loading and full
+script generation over a grid of shard and host counts. Every case runs in
+a forked child so its peak memory is its own and class level state of the
+components does not leak between cases. Placement quality is checked for
+each case and results can be saved as a baseline and compared against:
+
+    python benchmark_helper.py --save-baseline
+    python benchmark_helper.py            # exits 1 on regressions
+"""
+
+import argparse
+import json
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import deployment_helper as dh
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+SHARD_COUNTS = [1, 2, 4, 16, 64, 256]
+HOST_COUNTS = [1, 4, 16, 100, 1000, 5000]
+QUICK_SHARD_COUNTS = [1, 4, 16]
+QUICK_HOST_COUNTS = [1, 4, 16]
+NUM_INSTANCES = dict(master=1, replica=2, rdonly=2)
+
+# Placement metrics where a higher value is worse.
+QUALITY_METRICS = ['max_per_host', 'max_masters_per_host', 'max_same_shard_per_host', 'colocated_shard_hosts']
+
+def run_in_child(func, *fargs):
+    """Runs func in a forked child, returns (result, seconds, peak rss growth in KB)."""
+    rfd, wfd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(rfd)
+        status = 0
+        try:
+            devnull = os.open(os.devnull, os.O_WRONLY)
+            os.dup2(devnull, 1)
+            rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            start_time = time.time()
+            result = func(*fargs)
+            elapsed = time.time() - start_time
+            rss_growth = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before
+            out = json.dumps(dict(result=result, seconds=elapsed, peak_kb=rss_growth))
+        except Exception as e:
+            out = json.dumps(dict(error='%s: %s' % (type(e).__name__, e)))
+            status = 1
+        with os.fdopen(wfd, 'w') as fh:
+            fh.write(out)
+        os._exit(status)
+    os.close(wfd)
+    with os.fdopen(rfd) as fh:
+        out = json.loads(fh.read())
+    os.waitpid(pid, 0)
+    if 'error' in out:
+        raise Exception(out['error'])
+    return out['result'], out['seconds'], out['peak_kb']
+
+def make_hosts(num_hosts):
+    return ['host-%04d.example.com' % i for i in xrange(num_hosts)]
+
+def placement_quality(shards, hosts, tablets_per_host):
+    per_host = [len(tablets_per_host.get(h, [])) for h in hosts]
+    masters = [len([t for t in tablets_per_host.get(h, []) if t[1] == 'master']) for h in hosts]
+    same_shard = []
+    colocated = 0
+    for h in hosts:
+        counts = {}
+        for shard, _, _ in tablets_per_host.get(h, []):
+            counts[shard] = counts.get(shard, 0) + 1
+        same_shard.append(max(counts.values() or [0]))
+        colocated += len([c for c in counts.values() if c > 1])
+    return dict(max_per_host=max(per_host), min_per_host=min(per_host),
+                max_masters_per_host=max(masters),
+                max_same_shard_per_host=max(same_shard),
+                colocated_shard_hosts=colocated)
+
+def bench_make_shards(num_shards):
+    for i in xrange(100):
+        shards = dh.make_shards(num_shards)
+    return len(shards)
+
+def bench_distribute(num_shards, num_hosts):
+    random.seed(0)
+    shards = dh.make_shards(num_shards)
+    hosts = make_hosts(num_hosts)
+    shard_config = dict((s, dict(num_instances=NUM_INSTANCES)) for s in shards)
+    tablets_per_host, _ = dh.distribute_tablets(shard_config, list(hosts))
+    return placement_quality(shards, hosts, tablets_per_host)
+
+def answer_prompts(answers):
+    """Replaces read_value so the interactive config flow takes scripted answers, else the defaults."""
+    def read_value(prompt, default=''):
+        for key, value in answers.iteritems():
+            if key in prompt:
+                return value
+        return str(default)
+    dh.read_value = read_value
+
+def setup_deployment(deployment_dir, num_shards, num_hosts, use_config):
+    os.environ['VTROOT'] = os.path.join(deployment_dir, 'vtroot')
+    os.environ['VTDATAROOT'] = os.path.join(deployment_dir, 'vtdataroot')
+    os.environ['DEPLOYMENT_DIR'] = deployment_dir
+    os.environ['CELL'] = 'bench'
+    dh.args = dh.define_args().parse_args(['--action', 'generate', '--interactive', 'false',
+                                           '--use-config-without-prompt', str(use_config)])
+    answer_prompts({
+        'Specify hosts for': ','.join(make_hosts(num_hosts)),
+        'Enter number of new shards:': str(num_shards),
+        'Config file': 'Y' if use_config else 'n',
+    })
+    random.seed(0)
+    dh.check_host()
+
+def make_components(hostname):
+    ls = dh.LockServer()
+    vtctld = dh.VtCtld(hostname, ls)
+    vtgate = dh.VtGate(hostname, ls)
+    vttablet = dh.VtTablet(hostname, ls, vtctld)
+    dh.MYSQL_AUTH_PARAM = vttablet.dbconfig.get_mysql_auth_param()
+    return [ls, vtctld, vtgate, vttablet]
+
+def bench_configure(deployment_dir, num_shards, num_hosts):
+    setup_deployment(deployment_dir, num_shards, num_hosts, False)
+    components = make_components('host-0000.example.com')
+    return len(components[-1].tablets)
+
+def bench_load_config(deployment_dir, num_shards, num_hosts):
+    setup_deployment(deployment_dir, num_shards, num_hosts, True)
+    components = make_components('host-0000.example.com')
+    return len(components[-1].tablets)
+
+def bench_generate(deployment_dir, num_shards, num_hosts):
+    setup_deployment(deployment_dir, num_shards, num_hosts, True)
+    components = make_components('host-0000.example.com')
+    for component in components:
+        component.run_action('generate')
+    return sum(len(files) for _, _, files in os.walk(os.path.join(deployment_dir, 'bin')))
+
+def run_case(num_shards, num_hosts):
+    results = {}
+    deployment_dir = tempfile.mkdtemp(prefix='dh-bench-')
+    try:
+        results['make_shards'] = run_in_child(bench_make_shards, num_shards)
+        results['distribute'] = run_in_child(bench_distribute, num_shards, num_hosts)
+        results['configure'] = run_in_child(bench_configure, deployment_dir, num_shards, num_hosts)
+        results['load_config'] = run_in_child(bench_load_config, deployment_dir, num_shards, num_hosts)
+        results['generate'] = run_in_child(bench_generate, deployment_dir, num_shards, num_hosts)
+    finally:
+        shutil.rmtree(deployment_dir)
+    case = dict(shards=num_shards, hosts=num_hosts, quality=results['distribute'][0])
+    for phase, (_, seconds, peak_kb) in results.iteritems():
+        case[phase] = dict(seconds=seconds, peak_kb=peak_kb)
+    case['tablets'] = results['configure'][0]
+    case['files'] = results['generate'][0]
+    return case
+
+PHASES = ['make_shards', 'distribute', 'configure', 'load_config', 'generate']
+
+def print_case(case):
+    q = case['quality']
+    times = ' '.join('%9.3f' % case[p]['seconds'] for p in PHASES)
+    peak_mb = max(case[p]['peak_kb'] for p in PHASES) / 1024.0
+    print '%6d %6d %7d %s %8.1f %5d %5d %6d %6d %6d' % (
+        case['shards'], case['hosts'], case['tablets'], times, peak_mb,
+        q['max_per_host'], q['min_per_host'], q['max_masters_per_host'],
+        q['max_same_shard_per_host'], q['colocated_shard_hosts'])
+
+def compare_to_baseline(cases, baseline, max_slowdown):
+    """Returns a list of regression messages against the baseline cases."""
+    base = dict(('%(shards)d/%(hosts)d' % c, c) for c in baseline['cases'])
+    regressions = []
+    for case in cases:
+        key = '%(shards)d/%(hosts)d' % case
+        if key not in base:
+            continue
+        old = base[key]
+        for phase in PHASES:
+            # Ignore noise on phases that take almost no time.
+            if case[phase]['seconds'] > max(old[phase]['seconds'], 0.05) * (1 + max_slowdown):
+                regressions.append('%s shards/hosts: %s took %.3fs, baseline %.3fs' % (
+                    key, phase, case[phase]['seconds'], old[phase]['seconds']))
+        for metric in QUALITY_METRICS:
+            if case['quality'][metric] > old['quality'][metric]:
+                regressions.append('%s shards/hosts: %s is %d, baseline %d' % (
+                    key, metric, case['quality'][metric], old['quality'][metric]))
+    return regressions
+
+def main():
+    ap = argparse.ArgumentParser('Benchmark deployment_helper placement and generation.')
+    ap.add_argument('--quick', action='store_true', help='Run a small grid.')
+    ap.add_argument('--shards', help='Comma separated shard counts, at most %d.' % dh.MAX_SHARDS)
+    ap.add_argument('--hosts', help='Comma separated host counts.')
+    ap.add_argument('--baseline', default=DEFAULT_BASELINE)
+    ap.add_argument('--save-baseline', action='store_true',
+                    help='Store the results as the new baseline instead of comparing.')
+    ap.add_argument('--max-slowdown', type=float, default=0.5,
+                    help='Relative slowdown of a phase flagged as a regression.')
+    ap.add_argument('--output', help='Also write the results as JSON to this file.')
+    args = ap.parse_args()
+
+    shard_counts = QUICK_SHARD_COUNTS if args.quick else SHARD_COUNTS
+    host_counts = QUICK_HOST_COUNTS if args.quick else HOST_COUNTS
+    if args.shards:
+        shard_counts = [int(s) for s in args.shards.split(',')]
+    if args.hosts:
+        host_counts = [int(h) for h in args.hosts.split(',')]
+
+    print '%6s %6s %7s %9s %9s %9s %9s %9s %8s %5s %5s %6s %6s %6s' % (
+        'shards', 'hosts', 'tablets', 'mk_shard', 'distrib', 'configure', 'load_cfg', 'generate', 'peak_mb',
+        'max/h', 'min/h', 'mstr/h', 'shrd/h', 'coloc')
+    cases = []
+    for num_shards in shard_counts:
+        for num_hosts in host_counts:
+            case = run_case(num_shards, num_hosts)
+            print_case(case)
+            sys.stdout.flush()
+            cases.append(case)
+
+    results = dict(time=time.time(), cases=cases)
+    if args.output:
+        with open(args.output, 'w') as fh:
+            json.dump(results, fh, indent=4, separators=(',', ': '))
+    if args.save_baseline:
+        with open(args.baseline, 'w') as fh:
+            json.dump(results, fh, indent=4, separators=(',', ': '))
+        print 'Saved baseline: %s' % args.baseline
+        return
+    if not os.path.exists(args.baseline):
+        print 'No baseline at %s, run with --save-baseline to create one.' % args.baseline
+        return
+    with open(args.baseline) as fh:
+        regressions = compare_to_baseline(cases, json.load(fh), args.max_slowdown)
+    for r in regressions:
+        print 'REGRESSION: %s' % r
+    if regressions:
+        sys.exit(1)
+    print 'No regressions against %s' % args.baseline
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+"""Checks the up scripts of the throwaway tablets of benchmark_restore.
+
+A restore tablet is not one of the deployment's tablets, but its mysqld
+and vttablet are sized like the tablets of the host it runs on. Generates
+its scripts on a host that has tablets and on one that has none.
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import benchmark_helper as bh
+dh = bh.dh
+
+def write_restore_scripts(deployment_dir, restore_host, isolation):
+    bh.setup_deployment(deployment_dir, 2, 4, True)
+    dh.args.restore_host = restore_host
+    dh.args.isolation = isolation
+    vttablet = bh.make_components('host-0000.example.com')[-1]
+    tablet = vttablet.restore_tablet(vttablet.shards[0], 0)
+    scripts = [vttablet.mysqld.write_instance_script(tablet, tablet['host'], 'up'),
+               vttablet.write_instance_script(tablet, tablet['host'], 'up')]
+    for script in scripts:
+        with open(script) as fh:
+            content = fh.read()
+        assert 'TABLET_DIR=vt_%010d' % tablet['unique_id'] in content, script
+        assert 'ISOLATION=%s' % isolation in content, script
+    with open(scripts[0]) as fh:
+        assert 'innodb_buffer_pool_size' in fh.read()
+    return scripts
+
+def test():
+    deployment_dir = tempfile.mkdtemp(prefix='dh-restore-')
+    try:
+        bh.run_in_child(bh.bench_configure, deployment_dir, 2, 4)
+        for restore_host in ['host-0001.example.com', 'restore.example.com']:
+            for isolation in ['none', 'cgroup']:
+                scripts, _, _ = bh.run_in_child(write_restore_scripts, deployment_dir, restore_host, isolation)
+                assert all(os.path.exists(s) for s in scripts), scripts
+    finally:
+        shutil.rmtree(deployment_dir)
+    print 'OK'
+
+if __name__ == '__main__':
+    test()
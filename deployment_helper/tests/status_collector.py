@@ -0,0 +1,105 @@
+"""Checks the status action against stub /debug/vars servers.
+
+Starts one local HTTP server per tablet and vtgate that serves growing
+query counters, points a config dir at them and checks the per shard and
+per host aggregation, including an unreachable tablet.
+"""
+
+import BaseHTTPServer
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import deployment_helper as dh
+
+class StubVars(object):
+    """Serves /debug/vars with TotalCount growing by qps every second."""
+
+    def __init__(self, timings_var, qps, latency, extra):
+        self.timings_var = timings_var
+        self.qps = qps
+        self.latency = latency
+        self.extra = extra
+        self.start = time.time()
+
+    def render(self):
+        count = int((time.time() - self.start) * self.qps)
+        out = {self.timings_var: dict(TotalCount=count, TotalTime=int(count * self.latency * 1e9))}
+        out.update(self.extra)
+        return json.dumps(out)
+
+def start_stub(stub):
+    class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.send_response(200)
+            self.end_headers()
+            self.wfile.write(stub.render())
+
+        def log_message(self, *args):
+            pass
+
+    server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server.server_address[1]
+
+def tablet(alias, shard, ttype, port):
+    return dict(alias=alias, shard=shard, ttype=ttype, host='127.0.0.1', web_port=port)
+
+def test():
+    pools = dict(ConnPoolCapacity=20, ConnPoolAvailable=2, TransactionPoolCapacity=10, TransactionPoolAvailable=10)
+    ports = [
+        start_stub(StubVars('Queries', 1000, 0.002, pools)),
+        start_stub(StubVars('Queries', 200, 0.004, dict(SecondsBehindMaster=7))),
+        start_stub(StubVars('Queries', 50, 0.001, {})),
+        start_stub(StubVars('VtgateApi', 1250, 0.005, dict(VtgateApiErrorCounts={'Execute.messagedb.master.INTERNAL': 3}))),
+    ]
+    config_dir = tempfile.mkdtemp(prefix='dh-status-')
+    try:
+        tablets = [tablet('test-100', '-80', 'master', ports[0]),
+                   tablet('test-101', '-80', 'replica', ports[1]),
+                   tablet('test-200', '80-', 'master', ports[2]),
+                   # Nothing listens on port 1.
+                   tablet('test-201', '80-', 'replica', 1)]
+        with open(os.path.join(config_dir, 'vttablet.json'), 'w') as fh:
+            json.dump(dict(tablets=tablets), fh)
+        with open(os.path.join(config_dir, 'vtgate.json'), 'w') as fh:
+            json.dump(dict(hostname='127.0.0.1', configured_hosts=['127.0.0.1'], ports=dict(web_port=ports[3])), fh)
+
+        targets = dh.load_status_targets(config_dir)
+        assert len(targets) == 5
+        collector = dh.StatusCollector(targets, 2, 0.5)
+        first = collector.scrape()
+        assert all(s['queries'] is None for s in first)
+        time.sleep(1)
+        samples = collector.scrape()
+
+        shards = dh.aggregate_samples([s for s in samples if s['kind'] == 'vttablet'], 'shard')
+        assert shards['-80']['count'] == 2 and shards['-80']['down'] == 0
+        assert 1000 < shards['-80']['qps'] < 1400
+        assert abs(shards['-80']['query_time'] / shards['-80']['queries'] - 0.0023) < 0.0005
+        assert shards['-80']['pool_use'] == (0.9, 'ConnPool')
+        assert shards['-80']['lag'] == 7
+        assert shards['80-']['down'] == 1
+        assert 30 < shards['80-']['qps'] < 70
+
+        vtgates = dh.aggregate_samples([s for s in samples if s['kind'] == 'vtgate'], 'name')
+        assert 1000 < vtgates['vtgate-0@127.0.0.1']['qps'] < 1500
+        assert vtgates['vtgate-0@127.0.0.1']['errors'] == 0
+
+        hosts = dh.aggregate_samples(samples, 'host')
+        assert hosts['127.0.0.1']['count'] == 5 and hosts['127.0.0.1']['down'] == 1
+        dh.print_status_table('shard', shards, 10)
+        dh.print_status_table('host', hosts, 10)
+    finally:
+        shutil.rmtree(config_dir)
+    print 'OK'
+
+if __name__ == '__main__':
+    test()
@@ -0,0 +1,102 @@
+"""Checks templates/supervisor.py against stub start scripts.
+
+Runs a sleep named like a vtgate as the supervised process, adopts it
+through its pid file, kills it and checks it is started again at once,
+that a down file keeps it stopped and that a start script that keeps
+failing is retried with a growing backoff.
+"""
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'templates'))
+import supervisor
+
+UP_SCRIPT = """rm -f %(dir)s/$1.down
+bash -c "exec -a vtgate-$1 sleep 600" > /dev/null 2>&1 &
+echo $! > %(dir)s/$1.pid
+"""
+
+def process_config(tmp_dir, name, up):
+    return dict(name=name, command='vtgate', up=up, pid_file=os.path.join(tmp_dir, '%s.pid' % name),
+                down_file=os.path.join(tmp_dir, '%s.down' % name))
+
+def wait_for_start(process, now):
+    process.starter.wait()
+    # Gives the background sleep time to exec, vtgate writes its own pid file.
+    time.sleep(0.2)
+    process.check(now)
+
+def test():
+    tmp_dir = tempfile.mkdtemp(prefix='dh-supervisor-')
+    up = os.path.join(tmp_dir, 'up.sh')
+    with open(up, 'w') as fh:
+        fh.write(UP_SCRIPT % dict(dir=tmp_dir))
+    fail = os.path.join(tmp_dir, 'fail.sh')
+    with open(fail, 'w') as fh:
+        fh.write('exit 3\n')
+    config = dict(host='test', port=0, log_dir=os.path.join(tmp_dir, 'log'),
+                  settings=dict(min_backoff=1, max_backoff=4, stable_time=10),
+                  processes=[process_config(tmp_dir, 'a', [up, 'a'])])
+    pids = []
+    try:
+        subprocess.check_call(['bash', up, 'a'])
+        adopted = supervisor.read_pid(os.path.join(tmp_dir, 'a.pid'))
+        pids.append(adopted)
+        time.sleep(0.1)
+        sup = supervisor.Supervisor(config)
+        a, = sup.processes
+        now = time.time()
+
+        a.check(now)
+        assert a.state == 'running' and a.pid == adopted and a.restarts == 0
+
+        os.kill(adopted, 9)
+        time.sleep(0.2)
+        a.check(now + 1)
+        assert a.state == 'starting' and a.restarts == 1
+        wait_for_start(a, now + 1)
+        assert a.state == 'running' and a.pid != adopted
+        pids.append(a.pid)
+
+        # A stopped process stays down.
+        open(a.down_file, 'w').close()
+        os.kill(a.pid, 9)
+        time.sleep(0.2)
+        a.check(now + 2)
+        a.check(now + 100)
+        assert a.state == 'down' and a.restarts == 1
+        assert sup.status()['processes'][0]['state'] == 'down'
+
+        # A start script that fails every time is retried at once, then with a
+        # backoff doubling up to max_backoff.
+        config['processes'] = [process_config(tmp_dir, 'b', [fail])]
+        b, = supervisor.Supervisor(config).processes
+        t = now
+        b.check(t)
+        wait_for_start(b, t)
+        delays = []
+        for _ in range(5):
+            assert b.state == 'backoff'
+            delays.append(b.next_start - t)
+            t = b.next_start
+            b.check(t)
+            wait_for_start(b, t)
+        assert delays == [0, 1, 2, 4, 4], delays
+        # The first start is not a restart.
+        assert b.restarts == 5 and b.failures == 6
+    finally:
+        for pid in pids:
+            try:
+                os.kill(pid, 9)
+            except OSError:
+                pass
+        shutil.rmtree(tmp_dir)
+    print 'OK'
+
+if __name__ == '__main__':
+    test()